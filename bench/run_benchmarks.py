@@ -0,0 +1,204 @@
+"""
+Benchmarks de los caminos críticos: arranque, cifrado, autenticación, bóveda y diccionario.
+
+    python bench/run_benchmarks.py                         # tamaños 10, 1000, 100000
+    python bench/run_benchmarks.py --sizes 10 1000 --out resultados.json
+    python bench/run_benchmarks.py --check                 # falla si se supera bench/thresholds.json
+    python bench/run_benchmarks.py --baseline anterior.json --tolerance 1.25
+
+Cada resultado guarda la mediana y el p95 en segundos por operación. Las
+comprobaciones usan la mediana, que es la medida más estable entre ejecuciones.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import secrets
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC))
+
+from database import AuthManager, Database, Verify, VaultManager, migrate  # noqa: E402
+from dataset import DatasetIndex, build_index  # noqa: E402
+from encryption import ARGON2ID, EncryptionManager, KdfParams, argon2_supported, derive_kek, derive_key, generate_passwords  # noqa: E402
+from llm import AiModel  # noqa: E402
+from strength import estimate  # noqa: E402
+
+THRESHOLDS = Path(__file__).resolve().parent / "thresholds.json"
+
+
+def measure(fn: Callable[[], None], runs: int, inner: int = 1) -> Dict[str, float]:
+    """Ejecuta `fn` runs x inner veces y devuelve segundos por operación."""
+    fn()  # calentamiento
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in range(inner):
+            fn()
+        samples.append((time.perf_counter() - start) / inner)
+    samples.sort()
+    median = statistics.median(samples)
+    return {
+        "median_s": median,
+        "p95_s": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "ops_per_s": 1 / median if median else float("inf"),
+        "runs": runs * inner,
+    }
+
+
+def random_word(k: int) -> str:
+    return "".join(random.choices(string.ascii_lowercase, k=k))
+
+
+def bench_crypto(results: dict):
+    salt = base64.b64encode(secrets.token_bytes(16)).decode()
+    results["kdf.derive_key"] = measure(lambda: derive_key("master-password", salt), runs=3)
+    if argon2_supported():
+        params = KdfParams(ARGON2ID, iterations=2, memory_kib=64 * 1024, parallelism=1)
+        results["kdf.derive_kek.argon2id"] = measure(lambda: derive_kek("master-password", salt, params), runs=3)
+    engine = EncryptionManager("master-password", salt)
+    blob = engine.encrypt("x" * 32)
+    record = engine.encrypt_fields(("example.com", "user@example.com", "x" * 32), b"bench")
+    results["crypto.encrypt"] = measure(lambda: engine.encrypt("x" * 32), runs=20, inner=500)
+    results["crypto.decrypt"] = measure(lambda: engine.decrypt(blob), runs=20, inner=500)
+    results["crypto.encrypt_fields"] = measure(
+        lambda: engine.encrypt_fields(("example.com", "user@example.com", "x" * 32), b"bench"), runs=20, inner=500)
+    results["crypto.decrypt_fields"] = measure(lambda: engine.decrypt_fields(record, 3, b"bench"), runs=20, inner=500)
+    results["crypto.generate_password"] = measure(engine.generate_password, runs=20, inner=100)
+    results["crypto.generate_passwords@1000"] = measure(lambda: generate_passwords(1000), runs=10)
+    return engine
+
+
+def bench_auth(results: dict, db: Database):
+    auth = AuthManager(db)
+    counter = iter(range(10 ** 9))
+    results["auth.register_user"] = measure(
+        lambda: auth.register_user(f"bench{next(counter)}", "Contrasena-Segura-1", "bench@example.com"), runs=5)
+    results["auth.login"] = measure(lambda: auth.login("bench0", "Contrasena-Segura-1"), runs=5)
+
+
+def bench_vault(results: dict, db: Database, engine: EncryptionManager, sizes):
+    vault = VaultManager(db, engine)
+    for user_id, size in enumerate(sizes, start=1000):
+        db.execute(
+            "INSERT INTO credentials (id, username, password_hash, salt, two_fa_contact) VALUES (?, ?, '', '', '');",
+            (user_id, f"vault{user_id}"),
+        )
+        items = [(f"{random_word(8)}.com", f"{random_word(6)}@example.com", password)
+                 for password in generate_passwords(size)]
+        ids = []
+        with db.transaction() as conn:
+            for start in range(0, size, 1000):
+                ids += vault.add_many(conn, user_id, items[start:start + 1000])
+        probe = items[size // 2][0][:5]
+        heavy = max(1, min(20, 20_000 // size))
+        results[f"vault.add@{size}"] = measure(
+            lambda: vault.add(user_id, "bench.example", "bench", "x" * 20), runs=20, inner=10)
+        results[f"vault.list_page@{size}"] = measure(lambda: vault.list_page(user_id), runs=20, inner=5)
+        results[f"vault.list_all_entries@{size}"] = measure(lambda: vault.list_all_entries(user_id), runs=heavy)
+        results[f"vault.search@{size}"] = measure(lambda: vault.search(user_id, probe), runs=20, inner=5)
+        results[f"vault.get_entry@{size}"] = measure(
+            lambda: vault.get_entry(user_id, random.choice(ids)), runs=20, inner=50)
+
+
+def bench_misc(results: dict, tmp: str):
+    results["verify.validate_password"] = measure(
+        lambda: Verify.validate_password("Contrasena-Segura-1"), runs=20, inner=1000)
+    ai = AiModel()
+    results["llm.transform_password"] = measure(
+        lambda: ai.transform_password("Contrasena-Segura-1"), runs=20, inner=1000)
+
+    wordlist = os.path.join(tmp, "wordlist.txt")
+    with open(wordlist, "w", encoding="latin-1") as f:
+        for _ in range(200_000):
+            f.write(random_word(random.randint(6, 12)) + "\n")
+    index_path = os.path.join(tmp, "wordlist.idx")
+    results["dataset.build_index@200000"] = measure(lambda: build_index(wordlist, index_path), runs=1)
+    index = DatasetIndex(index_path)
+    batch = [random_word(8) for _ in range(1000)]
+    results["dataset.contains"] = measure(lambda: index.contains("password123"), runs=20, inner=1000)
+    results["dataset.contains_many@1000"] = measure(lambda: index.contains_many(batch), runs=20)
+    results["strength.estimate"] = measure(lambda: estimate("Contrasena-Segura-1", index), runs=20, inner=100)
+    index.close()
+
+
+def bench_startup(results: dict):
+    # Arranque en frío: cada medida es un intérprete nuevo que importa el módulo
+    def import_module(name: str):
+        subprocess.run([sys.executable, "-c", f"import {name}"], cwd=SRC, check=True)
+
+    results["startup.import_llm"] = measure(lambda: import_module("llm"), runs=5)
+    results["startup.import_interface"] = measure(lambda: import_module("interface"), runs=5)
+
+
+def check(results: dict, limits: Dict[str, float], label: str) -> list:
+    failures = []
+    for name, limit in limits.items():
+        if name in results and results[name]["median_s"] > limit:
+            failures.append(f"{name}: {results[name]['median_s']:.6f}s > {limit:.6f}s ({label})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100_000])
+    parser.add_argument("--out", help="fichero JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--check", action="store_true", help="comparar con bench/thresholds.json")
+    parser.add_argument("--baseline", help="resultados anteriores con los que comparar")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="ralentización admitida frente a --baseline")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="olesa-bench-") as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        migrate(db)
+        bench_startup(results)
+        engine = bench_crypto(results)
+        bench_auth(results, db)
+        bench_vault(results, db, engine, args.sizes)
+        bench_misc(results, tmp)
+        db.close_all()
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "sizes": args.sizes,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+
+    failures = []
+    if args.check:
+        failures += check(results, json.loads(THRESHOLDS.read_text()), "umbral")
+    if args.baseline:
+        previous = json.loads(Path(args.baseline).read_text())["results"]
+        limits = {name: r["median_s"] * args.tolerance for name, r in previous.items()}
+        failures += check(results, limits, f"baseline x{args.tolerance}")
+    for failure in failures:
+        print(f"REGRESIÓN {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import base64
+import json
+import os
+import socket
+import stat
+import struct
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# --- AGENTE DE DESBLOQUEO PARA LA CLI ---
+# Como ssh-agent: `cli unlock` verifica la contraseña una vez (bcrypt + KDF) y
+# deja la clave de datos en un proceso en segundo plano que escucha en un
+# socket Unix. Las llamadas siguientes de la CLI piden la clave al agente y
+# se saltan la derivación, así que un script puede encadenar cientos de
+# llamadas sin pagar el KDF en cada una.
+#
+#   * El socket está en un directorio 0700 del usuario y solo se atiende a
+#     procesos del mismo uid (SO_PEERCRED donde existe).
+#   * Cada clave caduca a los `ttl` segundos de desbloquear (no se renueva con
+#     el uso) y se sobrescribe con ceros; sin claves, el agente termina.
+#   * Protocolo: una línea JSON por conexión y una línea JSON de respuesta.
+#
+# Sin sockets Unix o sin fork (Windows) no hay agente y la CLI pide la
+# contraseña en cada llamada.
+
+AGENT_SOCK = os.getenv("OLESA_AGENT_SOCK")
+AGENT_TTL  = float(os.getenv("OLESA_AGENT_TTL", str(15 * 60)))
+MAX_LINE   = 64 * 1024
+
+
+def supported() -> bool:
+    return hasattr(socket, "AF_UNIX") and hasattr(os, "fork")
+
+
+def socket_path() -> str:
+    if AGENT_SOCK:
+        return AGENT_SOCK
+    base = os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(base, f"olesa-{os.getuid()}", "agent.sock")
+
+
+def _private_dir(path: str):
+    """Crea el directorio del socket y comprueba que nadie más puede entrar en él."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"El directorio del agente {path} no es privado.")
+
+
+@dataclass
+class _HeldKey:
+    user_id: int
+    key: bytearray
+    expires: float
+    stamp: str  # AuthManager.key_stamp al desbloquear
+
+
+class UnlockAgent:
+    """Proceso que guarda claves de datos por (base de datos, usuario) hasta que caducan."""
+
+    def __init__(self, listener: socket.socket):
+        self.listener = listener
+        self._keys: Dict[Tuple[str, str], _HeldKey] = {}
+
+    def put(self, db: str, username: str, user_id: int, key: bytes, stamp: str, ttl: float):
+        self._drop((db, username))
+        self._keys[(db, username)] = _HeldKey(user_id, bytearray(key), time.monotonic() + ttl, stamp)
+
+    def serve(self):
+        self.listener.settimeout(1.0)
+        while self._keys:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.timeout:
+                self._purge()
+                continue
+            with conn:
+                try:
+                    conn.settimeout(2.0)
+                    if not self._same_user(conn):
+                        continue
+                    line = conn.makefile("rb").readline(MAX_LINE)
+                    reply = self._handle(json.loads(line))
+                    conn.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+                except (OSError, ValueError):
+                    pass  # cliente que se va a medias o línea mal formada
+            self._purge()
+        for held in self._keys.values():
+            held.key[:] = bytes(len(held.key))
+
+    def _handle(self, message: dict) -> dict:
+        self._purge()
+        op = message.get("op")
+        db, username = message.get("db"), message.get("user")
+        if op == "put":
+            self.put(
+                db, username, int(message["user_id"]), base64.b64decode(message["key"]), message["stamp"], float(message["ttl"])
+            )
+            return {"ok": True}
+        if op == "get":
+            found = self._find(db, username)
+            if found is None:
+                return {"ok": False}
+            (_, name), held = found
+            return {
+                "ok": True,
+                "user": name,
+                "user_id": held.user_id,
+                "key": base64.b64encode(bytes(held.key)).decode("ascii"),
+                "stamp": held.stamp,
+            }
+        if op == "lock":
+            for slot in [s for s in self._keys if (db is None or s[0] == db) and (username is None or s[1] == username)]:
+                self._drop(slot)
+            return {"ok": True}
+        if op == "status":
+            now = time.monotonic()
+            return {
+                "ok": True,
+                "keys": [{"db": d, "user": u, "expires_in": round(h.expires - now)} for (d, u), h in self._keys.items()],
+            }
+        return {"ok": False, "error": "operación desconocida"}
+
+    def _find(self, db: str, username: Optional[str]):
+        """Sin usuario vale la única clave desbloqueada para esa base de datos."""
+        if username is not None:
+            held = self._keys.get((db, username))
+            return ((db, username), held) if held else None
+        matches = [(slot, held) for slot, held in self._keys.items() if slot[0] == db]
+        return matches[0] if len(matches) == 1 else None
+
+    def _purge(self):
+        now = time.monotonic()
+        for slot in [s for s, h in self._keys.items() if h.expires <= now]:
+            self._drop(slot)
+
+    def _drop(self, slot: Tuple[str, str]):
+        held = self._keys.pop(slot, None)
+        if held is not None:
+            held.key[:] = bytes(len(held.key))
+
+    @staticmethod
+    def _same_user(conn: socket.socket) -> bool:
+        if not hasattr(socket, "SO_PEERCRED"):
+            return True  # sin SO_PEERCRED protege el directorio 0700
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", creds)
+        return uid == os.getuid()
+
+
+# ── cliente ───────────────────────────────────────────────────────────────────
+
+def request(message: dict) -> Optional[dict]:
+    """Envía un mensaje al agente; None si no hay agente escuchando."""
+    if not supported():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(2.0)
+            sock.connect(socket_path())
+            sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+            return json.loads(sock.makefile("rb").readline(MAX_LINE))
+    except (OSError, ValueError):
+        return None
+
+
+def get_key(db: str, username: Optional[str]) -> Optional[Tuple[str, int, bytes, str]]:
+    """
+    (usuario, id, clave de datos, huella) si el agente la tiene desbloqueada.
+    Quien la use debe comparar la huella con AuthManager.key_stamp.
+    """
+    reply = request({"op": "get", "db": db, "user": username})
+    if not reply or not reply.get("ok"):
+        return None
+    return reply["user"], reply["user_id"], base64.b64decode(reply["key"]), reply["stamp"]
+
+
+def lock(db: Optional[str] = None, username: Optional[str] = None) -> bool:
+    """Olvida las claves indicadas (todas por defecto). False si no había agente."""
+    return request({"op": "lock", "db": db, "user": username}) is not None
+
+
+def status() -> Optional[List[dict]]:
+    reply = request({"op": "status"})
+    return reply["keys"] if reply else None
+
+
+def add_key(db: str, username: str, user_id: int, key: bytes, stamp: str, ttl: float = AGENT_TTL):
+    """Entrega la clave al agente, arrancándolo si no está en marcha."""
+    message = {
+        "op": "put", "db": db, "user": username, "user_id": user_id,
+        "key": base64.b64encode(key).decode("ascii"), "stamp": stamp, "ttl": ttl,
+    }
+    if request(message) is not None:
+        return
+    if not supported():
+        raise OSError("Este sistema no admite el agente de desbloqueo.")
+    path = socket_path()
+    if not AGENT_SOCK:
+        _private_dir(os.path.dirname(path))
+    # No respondió: el fichero que quede es de un agente que ya terminó
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(16)
+    inode = os.stat(path).st_ino
+    # El socket ya escucha antes del fork: la siguiente llamada de la CLI
+    # puede conectar aunque el agente aún no haya llegado a accept()
+    if os.fork() > 0:
+        listener.close()
+        return
+    _daemonize()
+    agent = UnlockAgent(listener)
+    agent.put(db, username, user_id, key, stamp, ttl)
+    try:
+        agent.serve()
+    finally:
+        listener.close()
+        try:
+            # Solo si sigue siendo nuestro (otro agente pudo sustituirlo)
+            if os.stat(path).st_ino == inode:
+                os.unlink(path)
+        except OSError:
+            pass
+        # Sin finalizadores: el proceso heredó conexiones de SQLite del padre
+        os._exit(0)
+
+
+def _daemonize():
+    """Se separa del terminal y cierra la E/S heredada (p. ej. la de un `$(...)`)."""
+    os.setsid()
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))  # sin volcados con la clave
+    except (ImportError, ValueError, OSError):
+        pass
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.close(devnull)
@@ -0,0 +1,432 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from database import DECRYPT_ERROR, Entry, EntrySummary, SCHEMA_VERSION, StaleKeyError, migrate
+from metrics import timed
+from services import CachedVault, ServerBusy, Services, get_services
+
+# --- API HTTP/JSON SIN INTERFAZ ---
+# Servidor HTTP/1.1 mínimo sobre asyncio (sin dependencias nuevas) para
+# automatizar la bóveda sin pasar por el navegador. Comparte con la interfaz
+# web la capa de servicios del proceso: mismas claves en caché, mismo pool del
+# KDF y mismo control de admisión.
+#
+#   POST   /v1/sessions             {"username", "password"} -> {"token", ...}
+#   DELETE /v1/sessions             cierra la sesión del token
+#   GET    /v1/entries?after=&limit= página por cursor (servicio y usuario)
+#   GET    /v1/entries/search?q=    búsqueda con el índice ciego
+#   GET    /v1/entries/{id}         entrada completa, con la contraseña
+#   POST   /v1/entries              {"site", "user", "password"?} (sin contraseña se genera)
+#   PUT    /v1/entries/{id}         cambia los campos indicados (omitidos o null se conservan; "" es un error)
+#   DELETE /v1/entries/{id}
+#   POST   /v1/entries/batch        {"add": [...], "update": [...], "delete": [ids]} en una transacción
+#
+# El token va en "Authorization: Bearer ..." y es el id de la sesión en
+# Services: caduca con la inactividad igual que las sesiones web. Las
+# conexiones son persistentes (keep-alive) y todo el cifrado y el acceso a
+# SQLite se ejecuta en hilos, fuera del bucle de eventos.
+
+API_HOST          = os.getenv("OLESA_API_HOST", "127.0.0.1")
+API_PORT          = int(os.getenv("OLESA_API_PORT", "8001"))
+MAX_BODY          = 1024 * 1024
+MAX_HEADERS       = 64
+MAX_PAGE          = 500
+MAX_BATCH         = 1000
+MAX_ID            = 2**63 - 1  # mayor entero de SQLite: los ids y cursores no pasan de ahí
+KEEPALIVE_TIMEOUT = 30.0  # espera de la siguiente petición en una conexión abierta
+REQUEST_TIMEOUT   = 30.0  # para recibir el resto de una petición ya empezada
+
+REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+    404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 409: "Conflict", 411: "Length Required",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: Dict[str, List[str]]
+    headers: Dict[str, str]
+    body: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+    def json(self) -> dict:
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "El cuerpo no es JSON válido.")
+        if not isinstance(data, dict):
+            raise HttpError(400, "El cuerpo debe ser un objeto JSON.")
+        return data
+
+    def param(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def int_param(self, name: str, default: int, maximum: Optional[int] = None) -> int:
+        try:
+            value = int(self.param(name, str(default)))
+        except ValueError:
+            raise HttpError(400, f"'{name}' debe ser un entero.")
+        if value < 0:
+            raise HttpError(400, f"'{name}' no puede ser negativo.")
+        if maximum:
+            return min(value, maximum)
+        if value > MAX_ID:
+            raise HttpError(400, f"'{name}' está fuera de rango.")
+        return value
+
+
+Response = Tuple[int, Optional[object]]
+Handler = Callable[[Request, re.Match], Awaitable[Response]]
+
+
+def _summary_json(entry: EntrySummary) -> dict:
+    return {"id": entry.id, "site": entry.site_name, "user": entry.site_user}
+
+
+def _entry_json(entry: Entry) -> dict:
+    return {"id": entry.id, "site": entry.site_name, "user": entry.site_user, "password": entry.site_password}
+
+
+def _is_id(value) -> bool:
+    """Id entero que cabe en SQLite (uno mayor daría OverflowError al consultar)."""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= MAX_ID
+
+
+def _path_id(match: re.Match) -> int:
+    try:
+        entry_id = int(match.group(1))
+    except ValueError:  # más cifras de las que int() acepta
+        entry_id = MAX_ID + 1
+    if entry_id > MAX_ID:
+        raise HttpError(400, "Id de entrada fuera de rango.")
+    return entry_id
+
+
+def _text(data: dict, field: str, required: bool = True) -> Optional[str]:
+    value = data.get(field)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or (required and not value.strip()):
+        raise HttpError(400, f"'{field}' debe ser un texto no vacío.")
+    return value
+
+
+def _changed_text(data: dict, field: str) -> Optional[str]:
+    """Campo de una actualización: ausente o null conserva el valor; si viene, no puede estar vacío."""
+    if data.get(field) is None:
+        return None
+    return _text(data, field)
+
+
+def _apply_batch(vault: CachedVault, user_id: int, adds: list, updates: list, deletes: list) -> dict:
+    """Se ejecuta en un hilo: todas las operaciones del lote en una sola transacción."""
+    items = [
+        (_text(a, "site"), _text(a, "user"), _text(a, "password", required=False) or vault.engine.generate_password())
+        for a in adds
+    ]
+    changed, renamed, missing = [], [], []
+    for u in updates:
+        entry_id = u.get("id")
+        if not _is_id(entry_id):
+            raise HttpError(400, "Cada actualización necesita un 'id' entero válido.")
+        current = vault.get_entry(user_id, entry_id)
+        if current is None or DECRYPT_ERROR in (current.site_name, current.site_user, current.site_password):
+            missing.append(entry_id)
+            continue
+        site, user, password = (_changed_text(u, f) for f in ("site", "user", "password"))
+        entry = Entry(
+            id=entry_id,
+            site_name=current.site_name if site is None else site,
+            site_user=current.site_user if user is None else user,
+            site_password=current.site_password if password is None else password,
+        )
+        # Solo hay que regenerar los tokens de búsqueda si cambian servicio o usuario
+        same_index = (entry.site_name, entry.site_user) == (current.site_name, current.site_user)
+        (changed if same_index else renamed).append(entry)
+    if not all(_is_id(i) for i in deletes):
+        raise HttpError(400, "'delete' debe ser una lista de ids enteros válidos.")
+    with vault.db.transaction() as conn:
+        added = vault.add_many(conn, user_id, items) if items else []
+        vault.update_many(conn, user_id, changed)
+        vault.update_many(conn, user_id, renamed, reindex=True)
+        deleted = vault.delete_many(conn, user_id, deletes)
+    gone = set(deleted)
+    return {
+        "added": added,
+        "updated": [e.id for e in changed + renamed],
+        "deleted": deleted,
+        "not_found": missing + [i for i in deletes if i not in gone],
+    }
+
+
+class VaultApi:
+    """Rutas de la API sobre la capa de servicios compartida."""
+
+    def __init__(self, services: Services):
+        self.services = services
+        self.routes: List[Tuple[str, re.Pattern, Handler]] = [
+            ("POST",   re.compile(r"/v1/sessions"), self.create_session),
+            ("DELETE", re.compile(r"/v1/sessions"), self.delete_session),
+            ("GET",    re.compile(r"/v1/entries"), self.list_entries),
+            ("POST",   re.compile(r"/v1/entries"), self.add_entry),
+            ("GET",    re.compile(r"/v1/entries/search"), self.search_entries),
+            ("POST",   re.compile(r"/v1/entries/batch"), self.batch),
+            ("GET",    re.compile(r"/v1/entries/(\d+)"), self.get_entry),
+            ("PUT",    re.compile(r"/v1/entries/(\d+)"), self.update_entry),
+            ("DELETE", re.compile(r"/v1/entries/(\d+)"), self.delete_entry),
+            ("GET",    re.compile(r"/v1/health"), self.health),
+        ]
+
+    @timed("api_request")
+    async def dispatch(self, request: Request) -> Response:
+        allowed = False
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(request.path)
+            if match is None:
+                continue
+            if method == request.method:
+                return await handler(request, match)
+            allowed = True
+        if allowed:
+            raise HttpError(405, "Método no permitido.")
+        raise HttpError(404, "Ruta no encontrada.")
+
+    def _session(self, request: Request) -> Tuple[str, int, CachedVault]:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HttpError(401, "Falta el token de sesión.", {"WWW-Authenticate": "Bearer"})
+        vault = self.services.vault(token)
+        if vault is None:
+            raise HttpError(401, "Sesión caducada o inexistente.", {"WWW-Authenticate": "Bearer"})
+        return token, vault.user_id, vault
+
+    # ── sesiones ──────────────────────────────────────────────────────────────
+    async def create_session(self, request: Request, match: re.Match) -> Response:
+        data = request.json()
+        username, password = _text(data, "username"), _text(data, "password")
+        token = secrets.token_urlsafe(32)
+        try:
+            user = await self.services.login(token, username.strip(), password)
+        except ServerBusy as ex:
+            raise HttpError(503, str(ex), {"Retry-After": "5"})
+        if user is None:
+            raise HttpError(401, "Usuario o contraseña incorrectos.")
+        return 201, {"token": token, "user_id": user.id, "idle_timeout": self.services.keys.idle_timeout}
+
+    async def delete_session(self, request: Request, match: re.Match) -> Response:
+        token, _, _ = self._session(request)
+        self.services.logout(token)
+        return 204, None
+
+    # ── entradas ──────────────────────────────────────────────────────────────
+    async def list_entries(self, request: Request, match: re.Match) -> Response:
+        _, user_id, vault = self._session(request)
+        after = request.int_param("after", 0)
+        limit = request.int_param("limit", vault.PAGE_SIZE, MAX_PAGE) or vault.PAGE_SIZE
+        page = await asyncio.to_thread(vault.list_page, user_id, after, limit)
+        total = await asyncio.to_thread(vault.count_entries, user_id)
+        return 200, {
+            "entries": [_summary_json(e) for e in page],
+            "next": page[-1].id if len(page) == limit else None,
+            "total": total,
+        }
+
+    async def search_entries(self, request: Request, match: re.Match) -> Response:
+        _, user_id, vault = self._session(request)
+        query = (request.param("q") or "").strip()
+        if not query:
+            raise HttpError(400, "Falta el parámetro 'q'.")
+        limit = request.int_param("limit", MAX_PAGE, MAX_PAGE) or MAX_PAGE
+        results = await asyncio.to_thread(vault.search, user_id, query, limit)
+        return 200, {"entries": [_summary_json(e) for e in results]}
+
+    async def get_entry(self, request: Request, match: re.Match) -> Response:
+        _, user_id, vault = self._session(request)
+        entry = await asyncio.to_thread(vault.get_entry, user_id, _path_id(match))
+        if entry is None:
+            raise HttpError(404, "Entrada no encontrada.")
+        return 200, _entry_json(entry)
+
+    async def add_entry(self, request: Request, match: re.Match) -> Response:
+        _, user_id, vault = self._session(request)
+        data = request.json()
+        site, user = _text(data, "site"), _text(data, "user")
+        password = _text(data, "password", required=False)
+        entry = await asyncio.to_thread(vault.add, user_id, site, user, password)
+        return 201, _entry_json(entry)
+
+    async def update_entry(self, request: Request, match: re.Match) -> Response:
+        _, user_id, vault = self._session(request)
+        data = request.json()
+        fields = {f: _changed_text(data, f) for f in ("site", "user", "password")}
+        entry = await asyncio.to_thread(vault.update, user_id, _path_id(match), *fields.values())
+        if entry is None:
+            raise HttpError(404, "Entrada no encontrada.")
+        return 200, _entry_json(entry)
+
+    async def delete_entry(self, request: Request, match: re.Match) -> Response:
+        _, user_id, vault = self._session(request)
+        if await asyncio.to_thread(vault.delete, user_id, _path_id(match)) is None:
+            raise HttpError(404, "Entrada no encontrada.")
+        return 204, None
+
+    async def batch(self, request: Request, match: re.Match) -> Response:
+        _, user_id, vault = self._session(request)
+        data = request.json()
+        ops = {k: data.get(k) or [] for k in ("add", "update", "delete")}
+        if not all(isinstance(v, list) for v in ops.values()):
+            raise HttpError(400, "'add', 'update' y 'delete' deben ser listas.")
+        if sum(len(v) for v in ops.values()) > MAX_BATCH:
+            raise HttpError(413, f"Como mucho {MAX_BATCH} operaciones por lote.")
+        if not all(isinstance(x, dict) for x in ops["add"] + ops["update"]):
+            raise HttpError(400, "Las entradas de 'add' y 'update' deben ser objetos.")
+        result = await asyncio.to_thread(_apply_batch, vault, user_id, ops["add"], ops["update"], ops["delete"])
+        return 200, result
+
+    async def health(self, request: Request, match: re.Match) -> Response:
+        return 200, {"status": "ok", "schema": SCHEMA_VERSION}
+
+
+# ── HTTP/1.1 ──────────────────────────────────────────────────────────────────
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """Lee una petición; None si el cliente cerró la conexión (o no envió nada) entre peticiones."""
+    try:
+        line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+    if not line:
+        return None
+    # Cabeceras y cuerpo con su propio plazo: un cliente que se detiene a
+    # mitad de la petición no retiene la conexión indefinidamente
+    try:
+        return await asyncio.wait_for(_read_rest(reader, line), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HttpError(408, "La petición no llegó completa a tiempo.")
+
+
+async def _read_rest(reader: asyncio.StreamReader, line: bytes) -> Request:
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "Línea de petición no válida.")
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HttpError(400, "Demasiadas cabeceras.")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "Se necesita Content-Length.")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "Content-Length no válido.")
+    if length > MAX_BODY:
+        raise HttpError(413, "Cuerpo demasiado grande.")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return Request(method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), headers, body)
+
+
+def _write_response(
+    writer: asyncio.StreamWriter,
+    status: int,
+    payload: Optional[object],
+    keep_alive: bool,
+    extra: Optional[Dict[str, str]] = None,
+):
+    body = b"" if payload is None else json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json; charset=utf-8",
+        "Content-Length": str(len(body)),
+        # Las respuestas pueden llevar contraseñas: que nadie las guarde
+        "Cache-Control": "no-store",
+        "Connection": "keep-alive" if keep_alive else "close",
+        **(extra or {}),
+    }
+    head = f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+
+
+class ApiServer:
+    def __init__(self, services: Optional[Services] = None):
+        self.api = VaultApi(services or get_services())
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HttpError as ex:
+                    # Petición mal formada: no se sabe dónde empieza la siguiente
+                    _write_response(writer, ex.status, {"error": str(ex)}, False, ex.headers)
+                    await writer.drain()
+                    break
+                except (asyncio.IncompleteReadError, ValueError):
+                    break  # cliente que cierra a medias o línea demasiado larga
+                if request is None:
+                    break
+                headers = None
+                try:
+                    status, payload = await self.api.dispatch(request)
+                except HttpError as ex:
+                    status, payload, headers = ex.status, {"error": str(ex)}, ex.headers
+                except StaleKeyError as ex:
+                    # Petición en curso cuando se rotó la clave de datos del usuario
+                    status, payload = 409, {"error": str(ex)}
+                except Exception as ex:
+                    logging.error(f"Error en la API: {ex}")
+                    status, payload = 500, {"error": "Error interno."}
+                _write_response(writer, status, payload, request.keep_alive, headers)
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = API_HOST, port: int = API_PORT):
+        server = await asyncio.start_server(self.handle, host, port, reuse_address=True)
+        logging.info(f"API escuchando en http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def start_in_thread(host: str = API_HOST, port: int = API_PORT) -> threading.Thread:
+    """Arranca la API en un hilo con su propio bucle de eventos (junto a la interfaz de Flet)."""
+    thread = threading.Thread(target=lambda: asyncio.run(ApiServer().serve(host, port)), daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    # python src/api.py  (OLESA_API_HOST / OLESA_API_PORT; por defecto 127.0.0.1:8001)
+    logging.basicConfig(level=logging.INFO)
+    migrate(get_services().db)
+    asyncio.run(ApiServer().serve())
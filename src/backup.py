@@ -0,0 +1,275 @@
+import base64
+import json
+import os
+import secrets
+import sqlite3
+import struct
+import sys
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from database import DECRYPT_ERROR, Database, VaultManager
+from encryption import KDF_ITERATIONS, derive_key
+
+# --- EXPORTACIÓN Y COPIAS DE SEGURIDAD CIFRADAS EN STREAMING ---
+# El archivo se escribe por bloques sin cargar la bóveda en memoria y se cifra
+# con una clave de exportación derivada de una frase de paso propia.
+#
+#   cabecera : MAGIC | tipo (1 byte) | salt (16) | iteraciones (uint32) | prefijo de nonce (7)
+#   bloques  : longitud (uint32) | AES-GCM(registros JSON, una línea por registro)
+#
+# El nonce de cada bloque es prefijo + contador (uint32) + marca de último
+# bloque, y la cabecera va como datos asociados: reordenar, truncar o
+# mezclar bloques de otro archivo hace fallar la autenticación.
+
+MAGIC = b"OLESABK1"
+HEADER = struct.Struct(">8sB16sI7s")
+LENGTH = struct.Struct(">I")
+CHUNK_SIZE = 64 * 1024
+# Tope de un bloque cifrado: el lector no reserva más aunque la longitud del
+# archivo diga otra cosa, y el escritor nunca lo supera
+MAX_CHUNK = 16 * CHUNK_SIZE
+
+# Iteraciones de PBKDF2 que se aceptan al leer: la cabecera aún no está
+# autenticada cuando se deriva la clave, y un valor desmesurado dejaría la
+# restauración calculando durante horas
+MIN_ITERATIONS = 100_000
+MAX_ITERATIONS = 10 * KDF_ITERATIONS
+
+KIND_VAULT = 1      # entradas descifradas de un usuario, re-cifradas con la clave de exportación
+KIND_DATABASE = 2   # filas tal cual (ya cifradas) de toda la base de datos, multiusuario
+
+
+class BackupError(Exception):
+    """Archivo dañado, manipulado o frase de paso incorrecta."""
+
+
+def _export_key(passphrase: str, salt: bytes, iterations: int) -> AESGCM:
+    return AESGCM(derive_key(passphrase, base64.b64encode(salt).decode("utf-8"), iterations))
+
+
+class ArchiveWriter:
+    def __init__(self, out: BinaryIO, passphrase: str, kind: int):
+        salt = secrets.token_bytes(16)
+        self._prefix = secrets.token_bytes(7)
+        self._header = HEADER.pack(MAGIC, kind, salt, KDF_ITERATIONS, self._prefix)
+        self._aead = _export_key(passphrase, salt, KDF_ITERATIONS)
+        self._out = out
+        self._buffer = bytearray()
+        self._counter = 0
+        out.write(self._header)
+
+    def _flush(self, last: bool):
+        nonce = self._prefix + struct.pack(">IB", self._counter, 1 if last else 0)
+        sealed = self._aead.encrypt(nonce, bytes(self._buffer), self._header)
+        self._out.write(LENGTH.pack(len(sealed)) + sealed)
+        self._buffer.clear()
+        self._counter += 1
+
+    def write(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        if len(line) > MAX_CHUNK - CHUNK_SIZE:
+            raise BackupError("Registro demasiado grande para el archivo de copia.")
+        self._buffer += line
+        if len(self._buffer) >= CHUNK_SIZE:
+            self._flush(last=False)
+
+    def close(self):
+        self._flush(last=True)
+        self._out.flush()
+
+
+class ArchiveReader:
+    def __init__(self, inp: BinaryIO, passphrase: str):
+        self._header = inp.read(HEADER.size)
+        if len(self._header) != HEADER.size:
+            raise BackupError("Archivo de copia incompleto.")
+        magic, self.kind, salt, iterations, self._prefix = HEADER.unpack(self._header)
+        if magic != MAGIC:
+            raise BackupError("No es un archivo de copia de Olesa.")
+        if not MIN_ITERATIONS <= iterations <= MAX_ITERATIONS:
+            raise BackupError("Archivo manipulado: número de iteraciones fuera de rango.")
+        self._aead = _export_key(passphrase, salt, iterations)
+        self._inp = inp
+
+    def __iter__(self) -> Iterator[dict]:
+        counter = 0
+        while True:
+            raw_len = self._inp.read(LENGTH.size)
+            if len(raw_len) != LENGTH.size:
+                raise BackupError("El archivo está truncado: falta el bloque final.")
+            length = LENGTH.unpack(raw_len)[0]
+            if length > MAX_CHUNK + 16:
+                raise BackupError("Archivo manipulado: bloque de tamaño inválido.")
+            sealed = self._inp.read(length)
+            if len(sealed) != length:
+                raise BackupError("El archivo está truncado: falta parte de un bloque.")
+            payload, last = None, False
+            for flag in (0, 1):
+                nonce = self._prefix + struct.pack(">IB", counter, flag)
+                try:
+                    payload = self._aead.decrypt(nonce, sealed, self._header)
+                    last = bool(flag)
+                    break
+                except Exception:
+                    continue
+            if payload is None:
+                raise BackupError("Frase de paso incorrecta o archivo manipulado.")
+            for line in payload.splitlines():
+                yield json.loads(line)
+            if last:
+                if self._inp.read(1):
+                    raise BackupError("Hay datos después del bloque final.")
+                return
+            counter += 1
+
+
+# ── bóveda de un usuario ──────────────────────────────────────────────────────
+
+@dataclass
+class ExportResult:
+    """Entradas exportadas y entradas omitidas por no poder descifrarlas."""
+
+    exported: int = 0
+    unreadable: int = 0
+
+
+def export_vault(vault: VaultManager, user_id: int, out: BinaryIO, passphrase: str) -> ExportResult:
+    """
+    Exporta las entradas del usuario re-cifradas con la frase de paso. Las que
+    no se pueden descifrar se omiten (y se cuentan aparte) en lugar de copiar
+    el texto de error como si fuera la contraseña.
+    """
+    writer = ArchiveWriter(out, passphrase, KIND_VAULT)
+    result = ExportResult()
+    for entry in vault.iter_entries(user_id):
+        if DECRYPT_ERROR in (entry.site_name, entry.site_user, entry.site_password):
+            result.unreadable += 1
+            continue
+        writer.write({"site": entry.site_name, "user": entry.site_user, "password": entry.site_password})
+        result.exported += 1
+    writer.close()
+    return result
+
+
+def restore_vault(vault: VaultManager, user_id: int, inp: BinaryIO, passphrase: str, batch_size: int = 500) -> int:
+    """Añade a la bóveda del usuario las entradas de una exportación. Devuelve cuántas."""
+    reader = ArchiveReader(inp, passphrase)
+    if reader.kind != KIND_VAULT:
+        raise BackupError("El archivo no es una exportación de bóveda.")
+    count = 0
+    batch = []
+    for record in reader:
+        batch.append((record["site"], record["user"], record["password"]))
+        if len(batch) >= batch_size:
+            with vault.db.transaction() as conn:
+                vault.add_many(conn, user_id, batch)
+            count += len(batch)
+            batch.clear()
+    if batch:
+        with vault.db.transaction() as conn:
+            vault.add_many(conn, user_id, batch)
+        count += len(batch)
+    return count
+
+
+# ── base de datos completa ────────────────────────────────────────────────────
+# No necesita la clave de ningún usuario: copia las filas ya cifradas, por lo
+# que sirve para la copia nocturna de una instalación multiusuario.
+
+def _encode(value):
+    return {"b64": base64.b64encode(value).decode("ascii")} if isinstance(value, bytes) else value
+
+
+def _decode(value):
+    return base64.b64decode(value["b64"]) if isinstance(value, dict) else value
+
+
+def backup_database(db: Database, out: BinaryIO, passphrase: str) -> int:
+    """Copia esquema y filas de todas las tablas. Devuelve el número de filas."""
+    writer = ArchiveWriter(out, passphrase, KIND_DATABASE)
+    count = 0
+    # Una sola transacción de lectura: con WAL es una instantánea coherente
+    # que no bloquea a las sesiones que siguen escribiendo
+    with db.transaction() as conn:
+        conn.execute("BEGIN;")
+        schema = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 ELSE 1 END, name;"
+        ).fetchall()
+        # Versión del esquema, para que migrate() no repita pasos al restaurar
+        writer.write({"user_version": conn.execute("PRAGMA user_version;").fetchone()[0]})
+        for obj in schema:
+            writer.write({"schema": obj["sql"]})
+        for obj in schema:
+            if obj["type"] != "table":
+                continue
+            cur = conn.execute(f'SELECT * FROM "{obj["name"]}";')
+            while True:
+                rows = cur.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    writer.write({"table": obj["name"], "row": [_encode(v) for v in row]})
+                count += len(rows)
+        # Contadores de AUTOINCREMENT: sin ellos la base restaurada podría
+        # volver a usar los ids de filas borradas antes de la copia
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence';").fetchone():
+            for row in conn.execute("SELECT name, seq FROM sqlite_sequence;"):
+                writer.write({"sequence": row["name"], "seq": row["seq"]})
+    writer.close()
+    return count
+
+
+def restore_database(inp: BinaryIO, db_path: str, passphrase: str) -> int:
+    """Restaura una copia completa en un fichero de base de datos nuevo."""
+    if os.path.exists(db_path):
+        raise BackupError(f"{db_path} ya existe; restaura en un fichero nuevo.")
+    reader = ArchiveReader(inp, passphrase)
+    if reader.kind != KIND_DATABASE:
+        raise BackupError("El archivo no es una copia de la base de datos.")
+    conn = sqlite3.connect(db_path)
+    count = 0
+    try:
+        with conn:
+            for record in reader:
+                if "schema" in record:
+                    conn.execute(record["schema"])
+                    continue
+                if "user_version" in record:
+                    conn.execute(f"PRAGMA user_version = {int(record['user_version'])};")
+                    continue
+                if "sequence" in record:
+                    args = (int(record["seq"]), record["sequence"])
+                    if not conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?;", args).rowcount:
+                        conn.execute("INSERT INTO sqlite_sequence (seq, name) VALUES (?, ?);", args)
+                    continue
+                row = [_decode(v) for v in record["row"]]
+                conn.execute(f'INSERT INTO "{record["table"]}" VALUES ({", ".join("?" * len(row))});', row)
+                count += 1
+    except Exception:
+        conn.close()
+        os.remove(db_path)
+        raise
+    conn.close()
+    return count
+
+
+if __name__ == "__main__":
+    # Copia nocturna, p. ej. desde cron en el contenedor:
+    #   OLESA_BACKUP_PASSPHRASE=... python src/backup.py backup passmanager.db /backups/olesa-$(date +%F).olesabk
+    #   OLESA_BACKUP_PASSPHRASE=... python src/backup.py restore /backups/olesa.olesabk restaurada.db
+    passphrase: Optional[str] = os.getenv("OLESA_BACKUP_PASSPHRASE")
+    if len(sys.argv) != 4 or sys.argv[1] not in ("backup", "restore") or not passphrase:
+        print("Uso: OLESA_BACKUP_PASSPHRASE=... python backup.py backup|restore <origen> <destino>")
+        sys.exit(2)
+    if sys.argv[1] == "backup":
+        database = Database(sys.argv[2])
+        with open(sys.argv[3], "wb") as f:
+            print(f"{backup_database(database, f, passphrase)} filas copiadas en {sys.argv[3]}")
+        database.close_all()
+    else:
+        with open(sys.argv[2], "rb") as f:
+            print(f"{restore_database(f, sys.argv[3], passphrase)} filas restauradas en {sys.argv[3]}")
@@ -0,0 +1,304 @@
+import argparse
+import csv
+import getpass
+import io
+import json
+import os
+import sys
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import agent
+from database import DECRYPT_ERROR, AuthManager, Database, EntrySummary, SCHEMA_VERSION, VaultManager, migrate, schema_version
+from encryption import EncryptionManager, PasswordPolicy, generate_passwords
+
+# --- CLIENTE DE LÍNEA DE COMANDOS ---
+# Acceso a la bóveda desde scripts, sin Flet ni servidor:
+#
+#   python -m cli unlock -u ana            pide la contraseña y arranca el agente
+#   python -m cli list [--json]
+#   python -m cli search github
+#   python -m cli get 42 -p                solo la contraseña, para $(...)
+#   python -m cli add github.com ana       sin --password-stdin se genera
+#   python -m cli generate -n 5 --length 24
+#   python -m cli import chrome.csv
+#   python -m cli export copia.olesabk     (--csv para texto plano)
+#   python -m cli lock
+#
+# (desde src/, o con PYTHONPATH=src). Con el agente en marcha (agent.py) cada
+# llamada recibe la clave de datos por el socket y no repite bcrypt ni el KDF;
+# sin agente se pide la contraseña y se deriva en este mismo proceso. La
+# actualización de los parámetros del KDF se deja al inicio de sesión web.
+
+DB_PATH = os.getenv("OLESA_DB", "passmanager.db")
+
+
+class CliError(Exception):
+    """Error para el usuario: se imprime sin traza y la CLI sale con código 1."""
+
+
+def _open_db(path: str) -> Database:
+    db = Database(path)
+    if schema_version(db) < SCHEMA_VERSION:
+        migrate(db)
+    return db
+
+
+def _derive(db: Database, username: str) -> Tuple[int, bytes, int]:
+    """
+    Verifica la contraseña y devuelve (id, clave de datos, generación de la
+    clave). Adopta las cuentas
+    anteriores al cifrado de sobre y termina las rotaciones pendientes, igual
+    que el inicio de sesión web.
+    """
+    from kdf import verify_and_derive
+    from rekey import VaultRekeyer
+
+    auth = AuthManager(db)
+    row = auth.get_credentials(username)
+    password = getpass.getpass(f"Contraseña maestra de {username}: ")
+    key = verify_and_derive(password, row["password_hash"], row["salt"], row["wrapped_key"], row["kdf_params"]) if row else None
+    if not key:
+        raise CliError("Usuario o contraseña incorrectos.")
+    if row["wrapped_key"] is None:
+        auth.adopt_legacy_key(row["id"], key)
+    rekeyer = VaultRekeyer(db)
+    target = rekeyer.target_generation(row["id"])
+    if target is not None:
+        print("Terminando la rotación de la clave de la bóveda...", file=sys.stderr)
+        key = rekeyer.run(row["id"], EncryptionManager.from_key(key))
+        return row["id"], key, target
+    return row["id"], key, row["key_generation"]
+
+
+def _ask_username(args) -> str:
+    if args.user:
+        return args.user
+    if not sys.stdin.isatty():
+        raise CliError("Indica el usuario con -u o OLESA_USER.")
+    return input("Usuario: ").strip()
+
+
+def _open_vault(args) -> Tuple[VaultManager, int]:
+    """Bóveda del usuario: con la clave del agente si la tiene, si no pidiendo la contraseña."""
+    db = _open_db(args.db)
+    path = os.path.abspath(args.db)
+    held = agent.get_key(path, args.user)
+    if held is not None:
+        username, user_id, key, stamp = held
+        auth = AuthManager(db)
+        if stamp == auth.key_stamp(user_id):
+            return VaultManager(db, EncryptionManager.from_key(key), auth.key_generation(user_id)), user_id
+        # Desde el desbloqueo cambió la contraseña o se rotó la clave de datos:
+        # lo que se cifrara con la clave guardada no se podría leer después
+        agent.lock(path, username)
+        print("La clave del agente ya no es la vigente; hay que desbloquear de nuevo.", file=sys.stderr)
+    user_id, key, generation = _derive(db, _ask_username(args))
+    return VaultManager(db, EncryptionManager.from_key(key), generation), user_id
+
+
+def _print_summaries(entries: Iterable[EntrySummary], as_json: bool):
+    if as_json:
+        print(json.dumps([{"id": e.id, "site": e.site_name, "user": e.site_user} for e in entries], ensure_ascii=False))
+    else:
+        for e in entries:
+            print(f"{e.id}\t{e.site_name}\t{e.site_user}")
+
+
+def _iter_summaries(vault: VaultManager, user_id: int, limit: Optional[int]) -> Iterator[EntrySummary]:
+    after_id, left = 0, limit
+    while left is None or left > 0:
+        page = vault.list_page(user_id, after_id, min(left or VaultManager.PAGE_SIZE, VaultManager.PAGE_SIZE))
+        if not page:
+            return
+        yield from page
+        after_id = page[-1].id
+        if left is not None:
+            left -= len(page)
+
+
+# ── comandos ──────────────────────────────────────────────────────────────────
+
+def cmd_unlock(args):
+    if not agent.supported():
+        raise CliError("Este sistema no admite el agente de desbloqueo.")
+    username = _ask_username(args)
+    db = _open_db(args.db)
+    user_id, key, _ = _derive(db, username)
+    agent.add_key(os.path.abspath(args.db), username, user_id, key, AuthManager(db).key_stamp(user_id), args.ttl)
+    print(f"Bóveda de {username} desbloqueada durante {args.ttl:g} s.", file=sys.stderr)
+
+
+def cmd_lock(args):
+    db = os.path.abspath(args.db) if args.user else None
+    if not agent.lock(db, args.user):
+        print("No hay ningún agente en marcha.", file=sys.stderr)
+
+
+def cmd_status(args):
+    keys = agent.status()
+    if not keys:
+        print("No hay ninguna bóveda desbloqueada.", file=sys.stderr)
+        return
+    for held in keys:
+        print(f"{held['user']}\t{held['db']}\t{held['expires_in']} s")
+
+
+def cmd_list(args):
+    vault, user_id = _open_vault(args)
+    # Página a página: el listado de texto empieza a salir sin esperar al resto
+    _print_summaries(_iter_summaries(vault, user_id, args.limit), args.json)
+
+
+def cmd_search(args):
+    vault, user_id = _open_vault(args)
+    _print_summaries(vault.search(user_id, args.query, args.limit), args.json)
+
+
+def cmd_get(args):
+    vault, user_id = _open_vault(args)
+    entry = vault.get_entry(user_id, args.id)
+    if entry is None:
+        raise CliError(f"No existe la entrada {args.id}.")
+    if args.password:
+        print(entry.site_password)
+    elif args.json:
+        print(json.dumps(
+            {"id": entry.id, "site": entry.site_name, "user": entry.site_user, "password": entry.site_password},
+            ensure_ascii=False,
+        ))
+    else:
+        print(f"{entry.id}\t{entry.site_name}\t{entry.site_user}\t{entry.site_password}")
+
+
+def cmd_add(args):
+    password = sys.stdin.readline().rstrip("\r\n") if args.password_stdin else None
+    vault, user_id = _open_vault(args)
+    entry = vault.add(user_id, args.site, args.site_user, password)
+    print(entry.id)
+
+
+def cmd_generate(args):
+    policy = PasswordPolicy(
+        length=args.length,
+        symbols=None if args.no_symbols else 3,
+        exclude_lookalikes=args.no_lookalikes,
+        passphrase=args.passphrase,
+        words=args.words,
+    )
+    try:
+        passwords = generate_passwords(args.count, policy)
+    except ValueError as ex:
+        raise CliError(str(ex))
+    print("\n".join(passwords))
+
+
+def cmd_import(args):
+    from importer import VaultImporter
+
+    vault, user_id = _open_vault(args)
+    state = VaultImporter(vault).import_file(user_id, args.file)
+    print(f"{state.imported} entradas importadas, {state.skipped} descartadas.", file=sys.stderr)
+
+
+def cmd_export(args):
+    from backup import ExportResult, export_vault
+
+    vault, user_id = _open_vault(args)
+    out = sys.stdout.buffer if args.file == "-" else open(args.file, "wb")
+    try:
+        if args.csv:
+            # Mismas columnas que reconoce el importador (formato de Chrome)
+            text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+            writer = csv.writer(text)
+            writer.writerow(("name", "username", "password"))
+            result = ExportResult()
+            for entry in vault.iter_entries(user_id):
+                if DECRYPT_ERROR in (entry.site_name, entry.site_user, entry.site_password):
+                    result.unreadable += 1
+                    continue
+                writer.writerow((entry.site_name, entry.site_user, entry.site_password))
+                result.exported += 1
+            text.detach()
+        else:
+            passphrase = os.getenv("OLESA_BACKUP_PASSPHRASE") or getpass.getpass("Frase de paso de la exportación: ")
+            if not passphrase:
+                raise CliError("La exportación necesita una frase de paso.")
+            result = export_vault(vault, user_id, out, passphrase)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"{result.exported} entradas exportadas.", file=sys.stderr)
+    if result.unreadable:
+        raise CliError(f"{result.unreadable} entradas no se pudieron descifrar y no se han exportado.")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Acceso a la bóveda de Olesa desde la terminal.")
+    parser.add_argument("--db", default=DB_PATH, help="base de datos (OLESA_DB)")
+    parser.add_argument("-u", "--user", default=os.getenv("OLESA_USER"), help="usuario (OLESA_USER)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("unlock", help="verifica la contraseña y deja la clave en el agente")
+    p.add_argument("--ttl", type=float, default=agent.AGENT_TTL, help="segundos que el agente guarda la clave")
+    p.set_defaults(func=cmd_unlock)
+    commands.add_parser("lock", help="borra las claves del agente").set_defaults(func=cmd_lock)
+    commands.add_parser("status", help="bóvedas desbloqueadas en el agente").set_defaults(func=cmd_status)
+
+    p = commands.add_parser("list", help="lista servicio y usuario de las entradas")
+    p.add_argument("--limit", type=int)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_list)
+
+    p = commands.add_parser("search", help="busca en servicio y usuario")
+    p.add_argument("query")
+    p.add_argument("--limit", type=int)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_search)
+
+    p = commands.add_parser("get", help="muestra una entrada con su contraseña")
+    p.add_argument("id", type=int)
+    p.add_argument("-p", "--password", action="store_true", help="solo la contraseña")
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_get)
+
+    p = commands.add_parser("add", help="añade una entrada y escribe su id")
+    p.add_argument("site")
+    p.add_argument("site_user", metavar="user")
+    p.add_argument("--password-stdin", action="store_true", help="lee la contraseña de la entrada estándar")
+    p.set_defaults(func=cmd_add)
+
+    p = commands.add_parser("generate", help="genera contraseñas (no necesita la bóveda)")
+    p.add_argument("-n", "--count", type=int, default=1)
+    p.add_argument("--length", type=int, default=PasswordPolicy.length)
+    p.add_argument("--no-symbols", action="store_true")
+    p.add_argument("--no-lookalikes", action="store_true", help="sin caracteres que se confunden (0/O, 1/l...)")
+    p.add_argument("--passphrase", action="store_true", help="frase de paso en lugar de caracteres")
+    p.add_argument("--words", type=int, default=PasswordPolicy.words)
+    p.set_defaults(func=cmd_generate)
+
+    p = commands.add_parser("import", help="importa un CSV de un navegador o gestor")
+    p.add_argument("file")
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser("export", help="exporta la bóveda cifrada con una frase de paso")
+    p.add_argument("file", help="fichero de salida, o - para la salida estándar")
+    p.add_argument("--csv", action="store_true", help="CSV en texto plano (¡sin cifrar!)")
+    p.set_defaults(func=cmd_export)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except CliError as ex:
+        print(ex, file=sys.stderr)
+        return 1
+    except (OSError, EOFError, KeyboardInterrupt) as ex:
+        print(f"Error: {ex}" if str(ex) else "Cancelado.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,16 @@
-import bcrypt
+import hashlib
 import sqlite3
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
-from typing import Optional, List, Any
-from encryption import EncryptionManager
+from typing import Callable, Optional, List, Any, Dict, Iterator, Tuple
+from encryption import (
+    EncryptionManager, DECRYPT_ERROR, LEGACY_KDF, KdfParams, check_password, derive_kek, generate_data_key, hash_password,
+    wrap_key,
+)
+from metrics import timed
 import secrets
 import re
 
@@ -38,20 +45,91 @@ class Entry:
         return f"Servicio: {self.site_name} | Usuario: {self.site_user} | Contraseña: {self.site_password}"
 
 
-class Database:
-    """Gestiona la conexión al archivo .db local de SQLite."""
+@dataclass(frozen=True)
+class EntrySummary:
+    """Campos visibles en el listado; la contraseña se descifra solo bajo demanda."""
+
+    id: int
+    site_name: str
+    site_user: str
 
-    def __init__(self, db_name: str = "passmanager.db"):
+
+class Database:
+    """
+    Gestiona las conexiones al archivo .db local de SQLite.
+
+    Cada hilo (sesiones de Flet, hilo de Groq, to_thread...) usa su propia
+    conexión, así que nunca se comparten cursores. Con WAL los lectores no
+    esperan a los escritores.
+    """
+
+    def __init__(self, db_name: str = "passmanager.db", timeout: float = 10.0):
+        self._db_name = db_name
+        self._timeout = timeout
+        self._local = threading.local()
+        # ident del hilo -> (hilo, conexión), para cerrar las de hilos terminados
+        self._conns: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+        self._pool_lock = threading.Lock()
+        # ":memory:" es una base distinta por conexión: se comparte una sola
+        # conexión serializada con un lock
+        self._shared = db_name == ":memory:"
+        self._shared_lock = threading.RLock() if self._shared else nullcontext()
         try:
-            # check_same_thread=False permite que Auth y Vault compartan la db
-            # de forma segura en aplicaciones simples
-            self._conn = sqlite3.connect(db_name, check_same_thread=False)
-            self._conn.row_factory = (
-                sqlite3.Row
-            )  # Permite acceso por nombre de columna si se desea
+            self._conn
         except Exception as e:
             raise ConnectionError(f"Error al conectar con SQLite: {e}")
 
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._db_name,
+            timeout=self._timeout,          # busy timeout ante bloqueos de escritura
+            # Cada conexión solo la usa su hilo, pero close_all y la limpieza
+            # de hilos terminados la cierran desde otro
+            check_same_thread=False,
+            cached_statements=256,          # caché de sentencias preparadas
+        )
+        conn.row_factory = sqlite3.Row  # Permite acceso por nombre de columna
+        if not self._shared:
+            conn.execute("PRAGMA journal_mode = WAL;")
+            # NORMAL es seguro con WAL (solo se pierde la última transacción
+            # ante un corte de luz) y evita un fsync por commit
+            conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute(f"PRAGMA busy_timeout = {int(self._timeout * 1000)};")
+        # SQLite no comprueba las claves foráneas salvo que se pida en cada conexión
+        conn.execute("PRAGMA foreign_keys = ON;")
+        return conn
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        with self._pool_lock:
+            if self._shared and self._conns:
+                conn = next(iter(self._conns.values()))[1]
+            else:
+                # Cerrar conexiones de hilos que ya no existen
+                for ident, (thread, old) in list(self._conns.items()):
+                    if not thread.is_alive():
+                        old.close()
+                        del self._conns[ident]
+                conn = self._connect()
+                self._conns[threading.get_ident()] = (threading.current_thread(), conn)
+        self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Conexión del hilo dentro de una transacción (commit o rollback al salir)."""
+        conn = self._conn
+        try:
+            with self._shared_lock, conn:
+                yield conn
+        except sqlite3.Error as e:
+            print(f"Error de base de datos: {e}")
+            raise
+
+    @timed("db_execute")
     def execute(
         self,
         query: str,
@@ -65,22 +143,191 @@ class Database:
         """
         # Adaptación de sintaxis: PostgreSQL (%s) -> SQLite (?)
 
-        try:
-            with self._conn:  # Auto-commit / Rollback
-                cur = self._conn.cursor()
-                cur.execute(query, params)
-
-                if fetchone:
-                    return cur.fetchone()
-                if fetch:
-                    return cur.fetchall()
-                return None
-        except sqlite3.Error as e:
-            print(f"Error de base de datos: {e}")
-            raise
+        with self.transaction() as conn:  # Auto-commit / Rollback
+            cur = conn.execute(query, params)
+
+            if fetchone:
+                return cur.fetchone()
+            if fetch:
+                return cur.fetchall()
+            return None
+
+    @timed("db_executemany")
+    def executemany(self, query: str, seq_of_params) -> None:
+        """Ejecuta la misma query para cada tupla de parámetros en una sola transacción."""
+        with self.transaction() as conn:
+            conn.executemany(query, seq_of_params)
 
     def close_all(self):
-        self._conn.close()
+        with self._pool_lock:
+            for _, conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+        self._local = threading.local()
+
+
+# --- ESQUEMA Y MIGRACIONES ---
+# El esquema es la lista ordenada MIGRATIONS; PRAGMA user_version guarda la
+# última aplicada. migrate() se ejecuta una vez al arrancar, antes de atender
+# sesiones, y aplica cada paso pendiente en su propia transacción (BEGIN
+# IMMEDIATE: si arrancan dos procesos a la vez, el segundo espera y ya no
+# encuentra nada pendiente).
+#
+# Los pasos toleran bases creadas por versiones anteriores de la aplicación,
+# que creaban tablas y columnas sobre la marcha sin subir user_version.
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row["name"] for row in conn.execute(f"PRAGMA table_info({table});")}
+
+
+def _add_columns(conn: sqlite3.Connection, table: str, columns: Tuple[Tuple[str, str], ...]):
+    """Añade a `table` las columnas (nombre, tipo) que falten."""
+    existing = _table_columns(conn, table)
+    for column, kind in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind};")
+
+
+def _v1_base_tables(conn: sqlite3.Connection):
+    """
+    Tablas originales y cifrados como BLOB (nonce || ciphertext || tag) en vez
+    de base64 en TEXT. La conversión solo decodifica base64, no necesita claves.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS credentials (
+            id             INTEGER PRIMARY KEY AUTOINCREMENT,
+            username       TEXT UNIQUE NOT NULL,
+            password_hash  TEXT NOT NULL,
+            salt           TEXT NOT NULL,
+            two_fa_contact TEXT NOT NULL
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS vault (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id       INTEGER NOT NULL,
+            site_name     BLOB NOT NULL,
+            site_user     BLOB NOT NULL,
+            site_password BLOB NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES credentials (id) ON DELETE CASCADE
+        );
+    """)
+    rows = conn.execute(
+        """SELECT id, site_name, site_user, site_password FROM vault
+           WHERE typeof(site_name) = 'text' OR typeof(site_user) = 'text' OR typeof(site_password) = 'text';"""
+    )
+    as_blob = lambda v: base64.b64decode(v) if isinstance(v, str) else v
+    conn.executemany(
+        "UPDATE vault SET site_name = ?, site_user = ?, site_password = ? WHERE id = ?;",
+        [(as_blob(r["site_name"]), as_blob(r["site_user"]), as_blob(r["site_password"]), r["id"]) for r in rows],
+    )
+
+
+def _v2_records_and_jobs(conn: sqlite3.Connection):
+    """Registro empaquetado, índice de búsqueda ciego, cifrado de sobre y tablas de trabajos reanudables."""
+    _add_columns(conn, "credentials", (
+        # Generación de la clave de datos; aumenta en cada rotación (ver rekey.py)
+        ("key_generation", "INTEGER NOT NULL DEFAULT 0"),
+        # Clave de datos envuelta con la KEK (NULL en las cuentas antiguas
+        # hasta su siguiente inicio de sesión)
+        ("wrapped_key", "BLOB"),
+        # Parámetros JSON del KDF de la cuenta (NULL = PBKDF2 con 600k iteraciones)
+        ("kdf_params", "TEXT"),
+    ))
+    _add_columns(conn, "vault", (
+        ("header", "BLOB"),
+        ("record", "BLOB"),
+        ("updated_at", "INTEGER"),
+        ("key_generation", "INTEGER NOT NULL DEFAULT 0"),
+        # Contraseña anterior a la última rotación masiva, cifrada (ver rotation.py)
+        ("previous_password", "BLOB"),
+    ))
+    # Tokens HMAC de los n-gramas de site_name y site_user (ver VaultManager)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS vault_search (
+            user_id  INTEGER NOT NULL,
+            token    BLOB NOT NULL,
+            entry_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, token, entry_id)
+        ) WITHOUT ROWID;
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vault_search_entry ON vault_search (entry_id);")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            user_id     INTEGER NOT NULL,
+            source_hash TEXT NOT NULL,
+            rows_done   INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, source_hash)
+        );
+    """)
+    # password_hash y salt son los que tendrá la cuenta al terminar (ver rekey.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rekey_jobs (
+            user_id           INTEGER PRIMARY KEY,
+            target_generation INTEGER NOT NULL,
+            password_hash     TEXT NOT NULL,
+            salt              TEXT NOT NULL,
+            wrapped_key       BLOB NOT NULL,
+            last_id           INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    _add_columns(conn, "rekey_jobs", (("credential_key", "BLOB"),))
+    # Criterios fijados al empezar una rotación masiva (until_id: la última
+    # entrada que existía entonces) y el último id procesado
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rotation_jobs (
+            user_id        INTEGER PRIMARY KEY,
+            until_id       INTEGER NOT NULL,
+            updated_before INTEGER,
+            max_score      INTEGER,
+            last_id        INTEGER NOT NULL DEFAULT 0,
+            scanned        INTEGER NOT NULL DEFAULT 0,
+            rotated        INTEGER NOT NULL DEFAULT 0,
+            skipped        INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+
+
+def _v3_user_indexes(conn: sqlite3.Connection):
+    """
+    Sin índice, cada consulta por usuario (listado, paginación, borrado con
+    user_id) recorre la tabla entera. Con (user_id, id) cuesta lo que ocupan
+    las entradas de ese usuario y las páginas salen ya ordenadas por id.
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vault_user ON vault (user_id, id);")
+    conn.execute("ANALYZE;")
+
+
+MIGRATIONS: Tuple[Callable[[sqlite3.Connection], None], ...] = (
+    _v1_base_tables,
+    _v2_records_and_jobs,
+    _v3_user_indexes,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db: Database) -> int:
+    return db.execute("PRAGMA user_version;", fetchone=True)[0]
+
+
+@timed("db_migrate")
+def migrate(db: Database) -> int:
+    """Lleva la base de datos a SCHEMA_VERSION. Devuelve cuántas migraciones aplicó."""
+    applied = 0
+    while True:
+        with db.transaction() as conn:
+            conn.execute("BEGIN IMMEDIATE;")
+            version = conn.execute("PRAGMA user_version;").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(
+                    f"La base de datos tiene el esquema {version}, más reciente que el de esta versión ({SCHEMA_VERSION})."
+                )
+            if version == SCHEMA_VERSION:
+                return applied
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1};")
+        applied += 1
 
 
 class Verify:
@@ -123,16 +370,49 @@ class Verify:
 # ... (Imports y DataClasses se mantienen igual) ...
 
 class AuthManager:
+    # Los cambios de credenciales son compare-and-swap contra el salt y la clave
+    # envuelta que se desenvolvieron (expected_*): si entre tanto otro proceso
+    # cambió la contraseña o rotó la clave de datos, no se escribe nada, porque
+    # re-envolver la clave antigua dejaría la cuenta sin contraseña válida.
+    # Tampoco mientras haya una rotación pendiente: rekey_jobs.credential_key
+    # está envuelta con el salt actual y se aplicará al terminarla.
+    CAS_GUARD = (
+        "id = ? AND salt = ? AND wrapped_key IS ? "
+        "AND NOT EXISTS (SELECT 1 FROM rekey_jobs WHERE rekey_jobs.user_id = credentials.id)"
+    )
+
     def __init__(self, db: Database):
         self.db = db
 
+    def get_credentials(self, username: str) -> Optional[sqlite3.Row]:
+        """
+        Fila de credenciales (id, password_hash, salt, wrapped_key, kdf_params,
+        key_generation) para verificar fuera de este hilo.
+        """
+        query = "SELECT id, password_hash, salt, wrapped_key, kdf_params, key_generation FROM credentials WHERE username = ?;"
+        return self.db.execute(query, (username,), fetchone=True)
+
+    def key_generation(self, user_id: int) -> Optional[int]:
+        row = self.db.execute("SELECT key_generation FROM credentials WHERE id = ?;", (user_id,), fetchone=True)
+        return row[0] if row else None
+
+    def key_stamp(self, user_id: int) -> Optional[str]:
+        """
+        Huella de la clave de datos vigente (generación y clave envuelta). Cambia
+        al cambiar la contraseña, actualizar el KDF o rotar la clave de datos;
+        la CLI la usa para no fiarse de claves guardadas que ya no valen.
+        """
+        row = self.db.execute("SELECT key_generation, wrapped_key FROM credentials WHERE id = ?;", (user_id,), fetchone=True)
+        if row is None:
+            return None
+        return hashlib.sha256(str(row["key_generation"]).encode() + b":" + (row["wrapped_key"] or b"")).hexdigest()
+
     def login(self, username: str, password: str) -> Optional[User]:
         # CORRECCIÓN: Añadido 'salt' a la consulta SQL
-        query = "SELECT id, password_hash, salt FROM credentials WHERE username = ?;"
-        row = self.db.execute(query, (username,), fetchone=True)
+        row = self.get_credentials(username)
 
         try:
-            if row and bcrypt.checkpw(password.encode("utf-8"), row["password_hash"].encode("utf-8")):
+            if row and check_password(password, row["password_hash"]):
                 # CORRECCIÓN: Acceso por nombre de columna (sqlite3.Row)
                 return User(id=row["id"], username=username, salt=row["salt"])
             return None
@@ -140,52 +420,463 @@ class AuthManager:
             print(f"Error en login: {e}")
             return None
 
-    def register_user(self, username: str, password: str, two_fa_contact: str) -> int:
+    def register_user(self, username: str, password: str, two_fa_contact: str, kdf: KdfParams = LEGACY_KDF) -> int:
 
         if not Verify.validate_email(two_fa_contact):
             raise ValueError("Formato de correo electrónico inválido.")
 
 
-        salt_login = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode("utf-8"), salt_login)
+        hashed = hash_password(password)
 
-        # Salt para el cifrado AES-GCM
+        # Salt de la KEK, que solo envuelve la clave de datos aleatoria
         salt_encrypt = secrets.token_bytes(16)
         salt_encrypt_str = base64.b64encode(salt_encrypt).decode('utf-8')
+        wrapped = wrap_key(derive_kek(password, salt_encrypt_str, kdf), generate_data_key())
 
         # SQLite soporta RETURNING id en versiones recientes
-        query = "INSERT INTO credentials (username, password_hash, salt, two_fa_contact) VALUES (?, ?, ?, ?) RETURNING id;"
-        row = self.db.execute(query, (username, hashed.decode("utf-8"), salt_encrypt_str, two_fa_contact), fetchone=True)
+        query = (
+            "INSERT INTO credentials (username, password_hash, salt, two_fa_contact, wrapped_key, kdf_params) "
+            "VALUES (?, ?, ?, ?, ?, ?) RETURNING id;"
+        )
+        row = self.db.execute(
+            query,
+            (username, hashed.decode("utf-8"), salt_encrypt_str, two_fa_contact, wrapped, kdf.to_json()),
+            fetchone=True,
+        )
         return row[0]
 
+    def adopt_legacy_key(self, user_id: int, key: bytes) -> Optional[bytes]:
+        """
+        Cuenta anterior al cifrado de sobre: su clave de datos es la derivada de
+        la contraseña. Se guarda envuelta consigo misma para que a partir de
+        ahora cambiar la contraseña solo tenga que re-envolverla.
+        Devuelve la clave envuelta guardada, o None si otro proceso se adelantó.
+        """
+        wrapped = wrap_key(key, key)
+        with self.db.transaction() as conn:
+            cur = conn.execute(
+                "UPDATE credentials SET wrapped_key = ? WHERE id = ? AND wrapped_key IS NULL;",
+                (wrapped, user_id),
+            )
+        return wrapped if cur.rowcount else None
+
+    def store_wrapped_key(
+        self, user_id: int, salt: str, wrapped_key: bytes, kdf: KdfParams, expected_salt: str, expected_wrapped: Optional[bytes]
+    ) -> bool:
+        """Guarda la clave de datos re-envuelta con otro salt y otros parámetros del KDF. False si no se aplicó."""
+        with self.db.transaction() as conn:
+            cur = conn.execute(
+                f"UPDATE credentials SET salt = ?, wrapped_key = ?, kdf_params = ? WHERE {self.CAS_GUARD};",
+                (salt, wrapped_key, kdf.to_json(), user_id, expected_salt, expected_wrapped),
+            )
+        return cur.rowcount > 0
+
+    @timed("auth_change_master_password")
+    def change_master_password(
+        self,
+        user_id: int,
+        data_key: bytes,
+        new_password: str,
+        expected_salt: str,
+        expected_wrapped: Optional[bytes],
+        kdf: KdfParams = LEGACY_KDF,
+        rewrapped: Optional[Tuple[str, bytes]] = None,
+    ) -> bool:
+        """
+        Cambia la contraseña maestra en O(1): nuevo hash bcrypt, nuevo salt y la
+        misma clave de datos envuelta con la KEK nueva. La contraseña actual ya
+        debe estar verificada (es la que ha desenvuelto `data_key` a partir de
+        `expected_salt` y `expected_wrapped`). `rewrapped` es el (salt, clave
+        envuelta) ya calculado en el pool de KDF; sin él se deriva aquí. False
+        si las credenciales cambiaron entre tanto.
+        """
+        if rewrapped is None:
+            salt = base64.b64encode(secrets.token_bytes(16)).decode("utf-8")
+            rewrapped = salt, wrap_key(derive_kek(new_password, salt, kdf), data_key)
+        salt, wrapped = rewrapped
+        with self.db.transaction() as conn:
+            cur = conn.execute(
+                f"UPDATE credentials SET password_hash = ?, salt = ?, wrapped_key = ?, kdf_params = ? WHERE {self.CAS_GUARD};",
+                (hash_password(new_password).decode("utf-8"), salt, wrapped, kdf.to_json(), user_id, expected_salt, expected_wrapped),
+            )
+        return cur.rowcount > 0
+
+
+class StaleKeyError(Exception):
+    """Escritura con una clave de datos que ya no es la vigente, o durante su rotación."""
+
+
 class VaultManager:
-    def __init__(self, db: Database, engine: EncryptionManager):
+    PAGE_SIZE = 50
+
+    # Formato de registro: `header` cifra (servicio, usuario) para el listado y
+    # `record` la entrada completa, un AES-GCM cada uno. Las filas antiguas
+    # tienen ambas columnas a NULL y un cifrado por campo en site_name,
+    # site_user y site_password; en las nuevas esas columnas quedan vacías.
+    # Los datos asociados llevan además el usuario y el id de la fila (ver
+    # _aad): un cifrado copiado a otra fila o a otro usuario no se autentica.
+    HEADER_AAD = b"olesa:vault:header"
+    RECORD_AAD = b"olesa:vault:record"
+    PREVIOUS_AAD = b"olesa:vault:previous"
+    SUMMARY_COLUMNS = "id, user_id, header, site_name, site_user"
+    ENTRY_COLUMNS = "id, user_id, record, site_name, site_user, site_password"
+    # Cada fila guarda la generación de clave del usuario al escribirla (ver
+    # rekey.py). El id forma parte del cifrado, así que la fila se inserta
+    # vacía y se sella después, en la misma transacción (SEAL_QUERY).
+    INSERT_QUERY = (
+        "INSERT INTO vault (user_id, site_name, site_user, site_password, header, record, updated_at, key_generation) "
+        "VALUES (?, X'', X'', X'', X'', X'', CAST(strftime('%s', 'now') AS INTEGER), "
+        "COALESCE((SELECT key_generation FROM credentials WHERE id = ?), 0))"
+    )
+    SEAL_QUERY = "UPDATE vault SET header = ?, record = ? WHERE id = ?"
+    # `updated_at` (segundos Unix) marca el último cambio de la entrada; las
+    # filas anteriores a la columna lo tienen a NULL y cuentan como antiguas
+    UPDATE_QUERY = (
+        "UPDATE vault SET header = ?, record = ?, site_name = X'', site_user = X'', site_password = X'', "
+        "updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = ? AND user_id = ?"
+    )
+    # Igual, guardando además la contraseña sustituida (ver update_many)
+    REPLACE_QUERY = (
+        "UPDATE vault SET header = ?, record = ?, previous_password = ?, site_name = X'', site_user = X'', "
+        "site_password = X'', updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = ? AND user_id = ?"
+    )
+
+    def __init__(self, db: Database, engine: EncryptionManager, generation: Optional[int] = None):
         self.engine = engine
         self.db = db
+        # Generación de la clave de `engine` (credentials.key_generation al
+        # desenvolverla); None si el llamador no la conoce
+        self.generation = generation
+
+    def _check_key(self, conn: sqlite3.Connection, user_id: int):
+        """
+        Dentro de la transacción de una escritura y después de escribir (ya con
+        el bloqueo de escritura, así que lo leído es lo vigente): falla, y se
+        deshace todo, si la clave de datos del usuario se está rotando o si ya
+        no es la de esta bóveda. Sin esto, una sesión con la clave antigua
+        dejaría filas que nadie podría descifrar.
+        """
+        row = conn.execute(
+            """SELECT key_generation, EXISTS (SELECT 1 FROM rekey_jobs WHERE rekey_jobs.user_id = credentials.id)
+               FROM credentials WHERE id = ?;""",
+            (user_id,),
+        ).fetchone()
+        if row is not None and (row[1] or (self.generation is not None and row[0] != self.generation)):
+            raise StaleKeyError("La clave de la bóveda ha cambiado o se está rotando; hay que volver a abrirla.")
 
-    def add(self, user_id: int, site: str, user: str, password: str | None = None) -> None:
-        # FIX #1: Cifrar también site_name y site_user
-        encrypted_site = self.engine.encrypt(site)
-        encrypted_user = self.engine.encrypt(user)
-        plain_pass     = self.engine.generate_password() if not password else password
-        encrypted_pass = self.engine.encrypt(plain_pass)
-        query = "INSERT INTO vault (user_id, site_name, site_user, site_password) VALUES (?, ?, ?, ?);"
-        self.db.execute(query, (user_id, encrypted_site, encrypted_user, encrypted_pass))
+    # ── formato de registro ───────────────────────────────────────────────────
+    @staticmethod
+    def _aad(base: bytes, user_id: int, entry_id: int) -> bytes:
+        return b"%s:%d:%d" % (base, user_id, entry_id)
 
+    def _seal(self, user_id: int, entry_id: int, site: str, user: str, password: str) -> Tuple[bytes, bytes]:
+        return (
+            self.engine.encrypt_fields((site, user), self._aad(self.HEADER_AAD, user_id, entry_id)),
+            self.engine.encrypt_fields((site, user, password), self._aad(self.RECORD_AAD, user_id, entry_id)),
+        )
+
+    def _seal_previous(self, user_id: int, entry_id: int, password: str) -> bytes:
+        return self.engine.encrypt_fields((password,), self._aad(self.PREVIOUS_AAD, user_id, entry_id))
+
+    def _open_previous(self, user_id: int, entry_id: int, sealed: bytes) -> str:
+        return self.engine.decrypt_fields(sealed, 1, self._aad(self.PREVIOUS_AAD, user_id, entry_id))[0]
+
+    def _summary(self, row: sqlite3.Row) -> EntrySummary:
+        if row["header"] is not None:
+            aad = self._aad(self.HEADER_AAD, row["user_id"], row["id"])
+            site, user = self.engine.decrypt_fields(row["header"], 2, aad)
+        else:
+            site, user = self.engine.decrypt(row["site_name"]), self.engine.decrypt(row["site_user"])
+        return EntrySummary(id=row["id"], site_name=site, site_user=user)
+
+    def _entry(self, row: sqlite3.Row) -> Entry:
+        if row["record"] is not None:
+            aad = self._aad(self.RECORD_AAD, row["user_id"], row["id"])
+            site, user, password = self.engine.decrypt_fields(row["record"], 3, aad)
+        else:
+            # FIX #1: Descifrar todos los campos
+            site = self.engine.decrypt(row["site_name"])
+            user = self.engine.decrypt(row["site_user"])
+            password = self.engine.decrypt(row["site_password"])
+        return Entry(id=row["id"], site_name=site, site_user=user, site_password=password)
+
+    def upgrade_records(self, user_id: int) -> int:
+        """Pasa las entradas del formato antiguo (3 cifrados) al empaquetado. Devuelve cuántas."""
+        upgraded = 0
+        last_id = 0
+        while True:
+            rows = self.db.execute(
+                f"SELECT {self.ENTRY_COLUMNS} FROM vault WHERE user_id = ? AND id > ? AND record IS NULL ORDER BY id LIMIT ?;",
+                (user_id, last_id, self.PAGE_SIZE),
+                fetch=True,
+            )
+            if not rows:
+                return upgraded
+            updates = []
+            for row in rows:
+                entry = self._entry(row)
+                if DECRYPT_ERROR in (entry.site_name, entry.site_user, entry.site_password):
+                    continue  # no se sobrescribe lo que no se ha podido leer
+                updates.append((*self._seal(user_id, entry.id, entry.site_name, entry.site_user, entry.site_password), entry.id))
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    "UPDATE vault SET header = ?, record = ?, site_name = X'', site_user = X'', site_password = X'' WHERE id = ?;",
+                    updates,
+                )
+                self._check_key(conn, user_id)
+            upgraded += len(updates)
+            last_id = rows[-1]["id"]
+
+    # ── escritura ─────────────────────────────────────────────────────────────
+    def add(self, user_id: int, site: str, user: str, password: str | None = None) -> Entry:
+        """Guarda la entrada y la devuelve (con su id) para no tener que recargar la bóveda."""
+        plain_pass = self.engine.generate_password() if not password else password
+        # La entrada y sus tokens de búsqueda se guardan en la misma transacción
+        with self.db.transaction() as conn:
+            entry_id = conn.execute(self.INSERT_QUERY + " RETURNING id;", (user_id, user_id)).fetchone()[0]
+            conn.execute(self.SEAL_QUERY + ";", (*self._seal(user_id, entry_id, site, user, plain_pass), entry_id))
+            self._index_entry(conn, user_id, entry_id, site, user)
+            self._check_key(conn, user_id)
+        return Entry(id=entry_id, site_name=site, site_user=user, site_password=plain_pass)
+
+    def add_many(self, conn: sqlite3.Connection, user_id: int, items: List[Tuple[str, str, str]], workers: int = 0) -> List[int]:
+        """
+        Inserta un lote (servicio, usuario, contraseña) con executemany dentro de la
+        transacción `conn` del llamador. Con `workers` > 0 cifra en un pool de hilos.
+        """
+        conn.executemany(self.INSERT_QUERY + ";", [(user_id, user_id)] * len(items))
+        # Dentro de la transacción nadie más escribe: los ids son consecutivos
+        last_id = conn.execute("SELECT last_insert_rowid();").fetchone()[0]
+        ids = list(range(last_id - len(items) + 1, last_id + 1))
+
+        def seal_item(entry_id, item):
+            return (*self._seal(user_id, entry_id, *item), entry_id)
+
+        if workers:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                rows = list(pool.map(seal_item, ids, items, chunksize=64))
+        else:
+            rows = [seal_item(entry_id, item) for entry_id, item in zip(ids, items)]
+        conn.executemany(self.SEAL_QUERY + ";", rows)
+        conn.executemany(
+            "INSERT OR IGNORE INTO vault_search (user_id, token, entry_id) VALUES (?, ?, ?);",
+            [(user_id, t, entry_id) for entry_id, (site, user, _) in zip(ids, items)
+             for t in self.engine.blind_tokens(site, user)],
+        )
+        self._check_key(conn, user_id)
+        return ids
+
+    def update(
+        self,
+        user_id: int,
+        entry_id: int,
+        site: str | None = None,
+        user: str | None = None,
+        password: str | None = None,
+    ) -> Optional[Entry]:
+        """Cambia los campos indicados de la entrada. Devuelve la entrada nueva, o None si no existía."""
+        current = self.get_entry(user_id, entry_id)
+        if current is None or DECRYPT_ERROR in (current.site_name, current.site_user, current.site_password):
+            return None
+        entry = Entry(
+            id=entry_id,
+            site_name=current.site_name if site is None else site,
+            site_user=current.site_user if user is None else user,
+            site_password=current.site_password if password is None else password,
+        )
+        reindex = (entry.site_name, entry.site_user) != (current.site_name, current.site_user)
+        with self.db.transaction() as conn:
+            self.update_many(conn, user_id, [entry], reindex=reindex)
+        return entry
+
+    def update_many(
+        self,
+        conn: sqlite3.Connection,
+        user_id: int,
+        entries: List[Entry],
+        reindex: bool = False,
+        previous: Optional[List[Entry]] = None,
+    ) -> int:
+        """
+        Re-cifra y guarda un lote de entradas dentro de la transacción `conn` del
+        llamador. Con `reindex` se regeneran también sus tokens de búsqueda
+        (solo hace falta si cambian el servicio o el usuario). `previous` son
+        las mismas entradas antes del cambio, en el mismo orden: su contraseña
+        se conserva cifrada y se recupera con get_previous_password.
+        """
+        if previous is None:
+            conn.executemany(
+                self.UPDATE_QUERY + ";",
+                [(*self._seal(user_id, e.id, e.site_name, e.site_user, e.site_password), e.id, user_id) for e in entries],
+            )
+        else:
+            conn.executemany(
+                self.REPLACE_QUERY + ";",
+                [
+                    (*self._seal(user_id, e.id, e.site_name, e.site_user, e.site_password),
+                     self._seal_previous(user_id, e.id, old.site_password), e.id, user_id)
+                    for e, old in zip(entries, previous)
+                ],
+            )
+        if reindex:
+            conn.executemany("DELETE FROM vault_search WHERE entry_id = ?;", [(e.id,) for e in entries])
+            for e in entries:
+                self._index_entry(conn, user_id, e.id, e.site_name, e.site_user)
+        self._check_key(conn, user_id)
+        return len(entries)
+
+    def delete(self, user_id: int, entry_id: int) -> Optional[int]:
+        """Elimina la entrada del usuario. Devuelve su id, o None si no existía."""
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "DELETE FROM vault WHERE id = ? AND user_id = ? RETURNING id;",
+                (entry_id, user_id),
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute("DELETE FROM vault_search WHERE entry_id = ?;", (entry_id,))
+        return row[0]
+
+    def delete_many(self, conn: sqlite3.Connection, user_id: int, entry_ids: List[int]) -> List[int]:
+        """Elimina un lote de entradas del usuario dentro de la transacción `conn`. Devuelve los ids borrados."""
+        deleted = []
+        for entry_id in entry_ids:
+            row = conn.execute("DELETE FROM vault WHERE id = ? AND user_id = ? RETURNING id;", (entry_id, user_id)).fetchone()
+            if row:
+                deleted.append(row[0])
+        conn.executemany("DELETE FROM vault_search WHERE entry_id = ?;", [(i,) for i in deleted])
+        return deleted
+
+    # ── índice de búsqueda ────────────────────────────────────────────────────
+    def _index_entry(self, conn: sqlite3.Connection, user_id: int, entry_id: int, site: str, user: str):
+        tokens = self.engine.blind_tokens(site, user)
+        conn.executemany(
+            "INSERT OR IGNORE INTO vault_search (user_id, token, entry_id) VALUES (?, ?, ?);",
+            [(user_id, t, entry_id) for t in tokens],
+        )
+
+    def index_missing(self, user_id: int) -> int:
+        """Indexa las entradas que aún no tienen tokens (p. ej. creadas antes del índice)."""
+        indexed = 0
+        last_id = 0
+        while True:
+            rows = self.db.execute(
+                f"""SELECT {self.SUMMARY_COLUMNS} FROM vault v
+                   WHERE user_id = ? AND id > ?
+                   AND NOT EXISTS (SELECT 1 FROM vault_search s WHERE s.entry_id = v.id)
+                   ORDER BY id LIMIT ?;""",
+                (user_id, last_id, self.PAGE_SIZE),
+                fetch=True,
+            )
+            if not rows:
+                return indexed
+            with self.db.transaction() as conn:
+                for row in rows:
+                    summary = self._summary(row)
+                    if DECRYPT_ERROR in (summary.site_name, summary.site_user):
+                        continue  # no se indexa el texto de error como si fueran sus datos
+                    self._index_entry(conn, user_id, summary.id, summary.site_name, summary.site_user)
+                    indexed += 1
+                self._check_key(conn, user_id)
+            last_id = rows[-1]["id"]
+
+    @timed("vault_search")
+    def search(self, user_id: int, query: str, limit: Optional[int] = None) -> List[EntrySummary]:
+        """
+        Busca `query` en servicio y usuario mediante el índice ciego. Solo se
+        descifran las entradas candidatas que devuelve SQL, no toda la bóveda.
+        """
+        tokens = list(self.engine.blind_query_tokens(query))
+        if not tokens:
+            return self.list_page(user_id, limit=limit or self.PAGE_SIZE)
+        placeholders = ", ".join("?" * len(tokens))
+        ids = self.db.execute(
+            f"""SELECT entry_id FROM vault_search
+                WHERE user_id = ? AND token IN ({placeholders})
+                GROUP BY entry_id HAVING COUNT(*) = ?
+                ORDER BY entry_id;""",
+            (user_id, *tokens, len(tokens)),
+            fetch=True,
+        )
+        q = query.strip().lower()
+        results = []
+        for start in range(0, len(ids), self.PAGE_SIZE):
+            chunk = [r[0] for r in ids[start:start + self.PAGE_SIZE]]
+            rows = self.db.execute(
+                f"SELECT {self.SUMMARY_COLUMNS} FROM vault WHERE user_id = ? AND id IN ({', '.join('?' * len(chunk))}) ORDER BY id;",
+                (user_id, *chunk),
+                fetch=True,
+            )
+            for row in rows:
+                entry = self._summary(row)
+                # Los trigramas no garantizan que sean consecutivos: se confirma
+                if q in entry.site_name.lower() or q in entry.site_user.lower():
+                    results.append(entry)
+                    if limit and len(results) >= limit:
+                        return results
+        return results
+
+    # ── lectura ───────────────────────────────────────────────────────────────
+    @timed("vault_list_all_entries")
     def list_all_entries(self, user_id: int) -> List[Entry]:
         rows = self.db.execute(
-            "SELECT id, site_name, site_user, site_password FROM vault WHERE user_id = ?;",
+            f"SELECT {self.ENTRY_COLUMNS} FROM vault WHERE user_id = ?;",
             (user_id,),
             fetch=True,
         )
+        return [self._entry(row) for row in rows]
 
-        decrypted_entries = []
-        for row in rows:
-            # FIX #1: Descifrar todos los campos
-            decrypted_entries.append(Entry(
-                id=row["id"],
-                site_name=self.engine.decrypt(row["site_name"]),
-                site_user=self.engine.decrypt(row["site_user"]),
-                site_password=self.engine.decrypt(row["site_password"]),
-            ))
-        return decrypted_entries
\ No newline at end of file
+    def count_entries(self, user_id: int) -> int:
+        row = self.db.execute("SELECT COUNT(*) FROM vault WHERE user_id = ?;", (user_id,), fetchone=True)
+        return row[0]
+
+    @timed("vault_list_page")
+    def list_page(self, user_id: int, after_id: int = 0, limit: int = PAGE_SIZE) -> List[EntrySummary]:
+        """
+        Página de entradas con id > after_id (paginación por cursor).
+        Solo descifra la cabecera (servicio y usuario); el cursor de la
+        siguiente página es el id de la última entrada devuelta.
+        """
+        rows = self.db.execute(
+            f"SELECT {self.SUMMARY_COLUMNS} FROM vault WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?;",
+            (user_id, after_id, limit),
+            fetch=True,
+        )
+        return [self._summary(row) for row in rows]
+
+    def iter_entries(self, user_id: int, batch: int = PAGE_SIZE) -> Iterator[Entry]:
+        """Recorre la bóveda completa descifrada, página a página (memoria constante)."""
+        after_id = 0
+        while True:
+            rows = self.db.execute(
+                f"SELECT {self.ENTRY_COLUMNS} FROM vault WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?;",
+                (user_id, after_id, batch),
+                fetch=True,
+            )
+            if not rows:
+                return
+            for row in rows:
+                yield self._entry(row)
+            after_id = rows[-1]["id"]
+
+    def get_password(self, user_id: int, entry_id: int) -> Optional[str]:
+        """Descifra únicamente la entrada pedida para copiar o ver su contraseña."""
+        entry = self.get_entry(user_id, entry_id)
+        return entry.site_password if entry else None
+
+    def get_previous_password(self, user_id: int, entry_id: int) -> Optional[str]:
+        """Contraseña que tenía la entrada antes de la última rotación masiva, o None si no hay."""
+        row = self.db.execute(
+            "SELECT previous_password FROM vault WHERE id = ? AND user_id = ?;", (entry_id, user_id), fetchone=True
+        )
+        if row is None or row[0] is None:
+            return None
+        return self._open_previous(user_id, entry_id, row[0])
+
+    def get_entry(self, user_id: int, entry_id: int) -> Optional[Entry]:
+        row = self.db.execute(
+            f"SELECT {self.ENTRY_COLUMNS} FROM vault WHERE id = ? AND user_id = ?;",
+            (entry_id, user_id),
+            fetchone=True,
+        )
+        return self._entry(row) if row else None
@@ -0,0 +1,187 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from typing import Iterable, List, Optional
+
+# --- ÍNDICE DEL DICCIONARIO DE FILTRACIONES ---
+# rockyou.txt tiene ~14M de líneas; recorrerlo en cada comprobación cuesta
+# segundos. Se construye una sola vez un índice binario con registros de
+# ancho fijo ordenados (hash truncado + posición en el fichero), que luego se
+# abre con mmap y se consulta por búsqueda binaria.
+#
+# Formato del fichero (.idx):
+#   cabecera  : MAGIC (8 bytes) + número de registros (uint64 big-endian)
+#   fan-out   : 257 uint64 con el índice del primer registro de cada primer
+#               byte del hash (acota la búsqueda binaria a 1/256 del fichero)
+#   registros : HASH_SIZE bytes de BLAKE2b + uint32 con el rango (número de
+#               línea; rockyou está ordenado por frecuencia)
+
+MAGIC = b"OLESAIX1"
+HASH_SIZE = 8
+RECORD = struct.Struct(f">{HASH_SIZE}sI")
+HEADER = struct.Struct(">8sQ")
+FANOUT = struct.Struct(">257Q")
+DATA_OFFSET = HEADER.size + FANOUT.size
+
+DEFAULT_WORDLIST = "rockyou.txt"
+DEFAULT_INDEX = "rockyou.idx"
+
+
+def password_hash(password: str) -> bytes:
+    """Hash truncado con el que se indexa cada contraseña."""
+    return hashlib.blake2b(password.encode("utf-8"), digest_size=HASH_SIZE).digest()
+
+
+def build_index(wordlist_path: str = DEFAULT_WORDLIST, index_path: str = DEFAULT_INDEX) -> int:
+    """
+    Convierte el diccionario en un índice ordenado. Devuelve el número de registros.
+    Se reparte primero en 256 cubos temporales según el primer byte del hash para
+    ordenar cada cubo en memoria por separado, sin cargar el diccionario entero.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="olesa-idx-", dir=os.path.dirname(os.path.abspath(index_path)))
+    buckets = [open(os.path.join(tmp_dir, f"{i:02x}"), "wb") for i in range(256)]
+    try:
+        with open(wordlist_path, "rb") as f:
+            for rank, linea in enumerate(f):
+                # Igual que la búsqueda lineal original: latin-1 y strip()
+                digest = password_hash(linea.decode("latin-1").strip())
+                buckets[digest[0]].write(RECORD.pack(digest, rank))
+        for b in buckets:
+            b.close()
+
+        fanout = [0] * 257
+        tmp_index = index_path + ".tmp"
+        with open(tmp_index, "wb") as out:
+            out.write(b"\0" * DATA_OFFSET)
+            total = 0
+            for i in range(256):
+                fanout[i] = total
+                path = os.path.join(tmp_dir, f"{i:02x}")
+                with open(path, "rb") as b:
+                    data = b.read()
+                os.remove(path)
+                registros = {}
+                for digest, rank in RECORD.iter_unpack(data):
+                    # Las contraseñas repetidas conservan el mejor rango
+                    if digest not in registros or rank < registros[digest]:
+                        registros[digest] = rank
+                out.write(b"".join(RECORD.pack(d, registros[d]) for d in sorted(registros)))
+                total += len(registros)
+            fanout[256] = total
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, total))
+            out.write(FANOUT.pack(*fanout))
+        os.replace(tmp_index, index_path)
+        return total
+    finally:
+        for b in buckets:
+            b.close()
+        for nombre in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, nombre))
+        os.rmdir(tmp_dir)
+
+
+class DatasetIndex:
+    """Consulta de solo lectura sobre el índice mapeado en memoria."""
+
+    def __init__(self, index_path: str = DEFAULT_INDEX):
+        with open(index_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{index_path} no es un índice válido.")
+        self._fanout = FANOUT.unpack_from(self._mm, HEADER.size)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _find(self, digest: bytes) -> Optional[int]:
+        mm = self._mm
+        lo, hi = self._fanout[digest[0]], self._fanout[digest[0] + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = DATA_OFFSET + mid * RECORD.size
+            actual = mm[pos:pos + HASH_SIZE]
+            if actual < digest:
+                lo = mid + 1
+            elif actual > digest:
+                hi = mid
+            else:
+                return RECORD.unpack_from(mm, pos)[1]
+        return None
+
+    def rank(self, password: str) -> Optional[int]:
+        """Posición de la contraseña en el diccionario (0 = la más común) o None."""
+        return self._find(password_hash(password))
+
+    def contains(self, password: str) -> bool:
+        return self.rank(password) is not None
+
+    def contains_many(self, passwords: Iterable[str]) -> List[bool]:
+        """Comprueba un lote de contraseñas; el resultado respeta el orden de entrada."""
+        return [self._find(password_hash(p)) is not None for p in passwords]
+
+    def close(self):
+        self._mm.close()
+
+
+def open_index(index_path: str = DEFAULT_INDEX, wordlist_path: str = DEFAULT_WORDLIST) -> Optional[DatasetIndex]:
+    """
+    Abre el índice, construyéndolo antes si solo existe el diccionario en texto.
+    Devuelve None si no hay ni índice ni diccionario.
+    """
+    if not os.path.exists(index_path):
+        if not os.path.exists(wordlist_path):
+            return None
+        print(f"Construyendo índice de {wordlist_path} (solo la primera vez)...")
+        build_index(wordlist_path, index_path)
+    return DatasetIndex(index_path)
+
+
+_shared: Optional[DatasetIndex] = None
+_shared_loaded = False
+_shared_loading = False
+_shared_lock = threading.Lock()  # solo protege el estado; nunca se retiene durante la carga
+_load_lock = threading.Lock()    # una sola carga a la vez
+
+
+def _load_shared() -> Optional[DatasetIndex]:
+    global _shared, _shared_loaded, _shared_loading
+    with _load_lock:
+        if not _shared_loaded:
+            index = open_index()
+            with _shared_lock:
+                _shared = index
+                _shared_loaded = True
+                _shared_loading = False
+            if index is None:
+                print("⚠️ rockyou.txt no encontrado, omitiendo verificación de diccionario.")
+        return _shared
+
+
+def shared_index(wait: bool = True) -> Optional[DatasetIndex]:
+    """
+    Índice único del proceso (lo comparten AiModel y el estimador de fortaleza).
+    Con wait=False no bloquea: si aún no está abierto lo carga en segundo plano
+    y devuelve None mientras tanto.
+    """
+    global _shared_loading
+    if _shared_loaded or wait:
+        return _load_shared()
+    with _shared_lock:
+        if not _shared_loaded and not _shared_loading:
+            _shared_loading = True
+            threading.Thread(target=_load_shared, daemon=True).start()
+    return _shared
+
+
+if __name__ == "__main__":
+    # python dataset.py [rockyou.txt] [rockyou.idx]
+    wordlist = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_WORDLIST
+    index = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX
+    print(f"{build_index(wordlist, index)} contraseñas indexadas en {index}")
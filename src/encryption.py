@@ -1,50 +1,415 @@
 import base64
+import functools
+import hmac
+import json
+import os
 import secrets
 import string
+import struct
+import time
+from array import array
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Sequence, Set, Tuple
+import bcrypt
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+from metrics import timed
+
+
+KDF_ITERATIONS = 600000
+
+# Índice de búsqueda ciego: n-gramas de 1 a SEARCH_NGRAM caracteres
+SEARCH_NGRAM = 3
+SEARCH_TOKEN_SIZE = 16
+
+# Registros empaquetados: cada campo va precedido de su longitud (uint32)
+FIELD_LEN = struct.Struct(">I")
+DECRYPT_ERROR = "--- ERROR: NO SE PUDO DESCIFRAR ---"
+
+
+@timed("bcrypt_checkpw")
+def check_password(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+
+
+@timed("bcrypt_hashpw")
+def hash_password(password: str) -> bytes:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+
+
+@timed("kdf_derive")
+def derive_key(master_password: str, salt_str: str, iterations: int = KDF_ITERATIONS) -> bytes:
+    """Deriva la clave AES de 32 bytes (256 bits) con PBKDF2-SHA256."""
+    salt = base64.b64decode(salt_str)
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+    )
+    return kdf.derive(master_password.encode())
+
+
+# --- PARÁMETROS DEL KDF POR USUARIO ---
+# Cada cuenta guarda en credentials.kdf_params el algoritmo y el coste con el
+# que se derivó su KEK (NULL = PBKDF2 con 600k iteraciones, lo de siempre).
+# calibrate_kdf elige el coste para una latencia objetivo en el host actual y
+# el inicio de sesión re-envuelve la clave de datos cuando la cuenta quedó
+# por detrás de los parámetros vigentes.
+
+PBKDF2 = "pbkdf2-sha256"
+ARGON2ID = "argon2id"
+ARGON2_MIN_MEMORY_KIB = 19 * 1024   # mínimos recomendados por OWASP para Argon2id
+ARGON2_MIN_ITERATIONS = 2
+
+
+@dataclass(frozen=True)
+class KdfParams:
+    algorithm: str = PBKDF2
+    iterations: int = KDF_ITERATIONS  # iteraciones de PBKDF2 o pasadas de Argon2id
+    memory_kib: int = 0               # solo Argon2id
+    parallelism: int = 1              # solo Argon2id
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, value: Optional[str]) -> "KdfParams":
+        return cls(**json.loads(value)) if value else LEGACY_KDF
+
+    def cost(self) -> float:
+        """Coste relativo dentro del mismo algoritmo."""
+        return self.iterations * max(self.memory_kib, 1)
+
+    def needs_upgrade(self, target: "KdfParams") -> bool:
+        """Otro algoritmo, o un coste que se aleja más de un 50% del objetivo."""
+        if self.algorithm != target.algorithm:
+            return True
+        ratio = self.cost() / target.cost()
+        return not (2 / 3 <= ratio <= 3 / 2)
+
+
+LEGACY_KDF = KdfParams()
+
+
+def argon2_supported() -> bool:
+    """Argon2id necesita cryptography >= 44 compilado contra OpenSSL 3.2 o superior."""
+    try:
+        from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+        Argon2id(salt=b"\0" * 16, length=32, iterations=1, lanes=1, memory_cost=8).derive(b"")
+        return True
+    except Exception:
+        return False
+
+
+@timed("kdf_derive_kek")
+def derive_kek(master_password: str, salt_str: str, params: KdfParams = LEGACY_KDF) -> bytes:
+    """Deriva la KEK de 32 bytes con los parámetros de la cuenta."""
+    if params.algorithm == PBKDF2:
+        return derive_key(master_password, salt_str, params.iterations)
+    if params.algorithm == ARGON2ID:
+        from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+        return Argon2id(
+            salt=base64.b64decode(salt_str),
+            length=32,
+            iterations=params.iterations,
+            lanes=params.parallelism,
+            memory_cost=params.memory_kib,
+        ).derive(master_password.encode())
+    raise ValueError(f"Algoritmo de KDF desconocido: {params.algorithm}")
+
+
+def _time_kdf(params: KdfParams) -> float:
+    salt = base64.b64encode(secrets.token_bytes(16)).decode("utf-8")
+    start = time.perf_counter()
+    derive_kek("calibración", salt, params)
+    return time.perf_counter() - start
+
+
+def calibrate_kdf(target_seconds: float = 0.25, algorithm: str = ARGON2ID, memory_kib: int = 64 * 1024,
+                  parallelism: Optional[int] = None) -> KdfParams:
+    """
+    Parámetros que tardan unos `target_seconds` en este host. Con Argon2id se
+    fija la memoria (se reduce a la mitad mientras una sola pasada supere la
+    mitad del objetivo, sin bajar del mínimo) y se ajustan las pasadas. Nunca
+    baja de los mínimos recomendados, aunque eso supere el objetivo.
+    """
+    if algorithm == ARGON2ID and argon2_supported():
+        lanes = parallelism or min(4, os.cpu_count() or 1)
+        memory = max(memory_kib, ARGON2_MIN_MEMORY_KIB)
+        while True:
+            one_pass = _time_kdf(KdfParams(ARGON2ID, 1, memory, lanes))
+            if one_pass <= target_seconds / 2 or memory <= ARGON2_MIN_MEMORY_KIB:
+                break
+            memory = max(memory // 2, ARGON2_MIN_MEMORY_KIB)
+        passes = max(ARGON2_MIN_ITERATIONS, round(target_seconds / one_pass))
+        return KdfParams(ARGON2ID, passes, memory, lanes)
+    probe = 100_000
+    elapsed = _time_kdf(KdfParams(PBKDF2, probe))
+    iterations = max(KDF_ITERATIONS, round(probe * target_seconds / elapsed, -4))
+    return KdfParams(PBKDF2, int(iterations))
+
+
+# --- CIFRADO DE SOBRE ---
+# Las entradas se cifran con una clave de datos aleatoria por usuario (DEK).
+# La clave derivada de la contraseña maestra (KEK) solo envuelve la DEK, que
+# se guarda envuelta en credentials.wrapped_key: cambiar la contraseña o el
+# coste del KDF es re-envolver 32 bytes, no re-cifrar la bóveda.
+
+DATA_KEY_AAD = b"olesa:data-key"
+
+
+def generate_data_key() -> bytes:
+    return secrets.token_bytes(32)
+
+
+def wrap_key(kek: bytes, data_key: bytes) -> bytes:
+    """nonce || AES-GCM(kek, data_key)."""
+    nonce = secrets.token_bytes(12)
+    return nonce + AESGCM(kek).encrypt(nonce, data_key, DATA_KEY_AAD)
+
+
+def unwrap_key(kek: bytes, wrapped: bytes) -> bytes:
+    """Inverso de wrap_key. Lanza InvalidTag si la KEK no es la correcta."""
+    data = memoryview(wrapped)
+    return AESGCM(kek).decrypt(data[:12], data[12:], DATA_KEY_AAD)
+
+
+# --- GENERACIÓN DE CONTRASEÑAS EN LOTE ---
+# Todo el azar de un lote sale de un único búfer de os.urandom. Los bytes se
+# convierten en caracteres con bytes.translate: se descartan los que caen por
+# encima del mayor múltiplo del tamaño del alfabeto, así que no hay sesgo de
+# módulo. Los mínimos por clase se cumplen por construcción (se colocan los
+# obligatorios y se baraja), sin repetir contraseñas hasta que salga una válida.
+
+SYMBOLS = "!@#$%^&*"
+MAX_PASSWORD_LENGTH = 1024
+LOOKALIKES = "Il1|O0o"
+SYLLABLE_CONSONANTS = "bcdfghjklmnprstvz"
+SYLLABLE_VOWELS = "aeiou"
+
+
+@dataclass(frozen=True)
+class PasswordPolicy:
+    """Reglas de generación. Cada clase indica su mínimo; None la excluye."""
+    length: int = 32
+    lowercase: Optional[int] = 1
+    uppercase: Optional[int] = 1
+    digits: Optional[int] = 1
+    symbols: Optional[int] = 3
+    symbol_set: str = SYMBOLS
+    exclude_lookalikes: bool = False
+    # Modo frase de paso: `words` palabras unidas por `separator`. Sin lista
+    # propia, cada palabra son `syllables` sílabas consonante + vocal.
+    passphrase: bool = False
+    words: int = 6
+    separator: str = "-"
+    syllables: int = 3
+    wordlist: Optional[Tuple[str, ...]] = None
+
+    def classes(self) -> List[Tuple[str, int]]:
+        """(alfabeto, mínimo) de cada clase permitida."""
+        if not 1 <= self.length <= MAX_PASSWORD_LENGTH:
+            raise ValueError(f"La longitud debe estar entre 1 y {MAX_PASSWORD_LENGTH}.")
+        candidates = (
+            (string.ascii_lowercase, self.lowercase),
+            (string.ascii_uppercase, self.uppercase),
+            (string.digits, self.digits),
+            (self.symbol_set, self.symbols),
+        )
+        result = []
+        for alphabet, minimum in candidates:
+            if minimum is None:
+                continue
+            if self.exclude_lookalikes:
+                alphabet = "".join(c for c in alphabet if c not in LOOKALIKES)
+            if not alphabet and minimum:
+                raise ValueError("La política exige una clase de caracteres vacía.")
+            if alphabet:
+                result.append((alphabet, minimum))
+        if not result:
+            raise ValueError("La política no permite ningún carácter.")
+        if sum(m for _, m in result) > self.length:
+            raise ValueError("Los mínimos por clase superan la longitud de la contraseña.")
+        return result
+
+
+DEFAULT_POLICY = PasswordPolicy()
+
+
+@functools.lru_cache(maxsize=64)
+def _translation(alphabet: bytes) -> Tuple[bytes, bytes, int]:
+    """Tabla byte -> carácter, bytes a descartar y cuántos se aceptan."""
+    limit = 256 - 256 % len(alphabet)
+    table = bytes(alphabet[b % len(alphabet)] if b < limit else 0 for b in range(256))
+    return table, bytes(range(limit, 256)), limit
+
+
+class _RandomBuffer:
+    """Bytes de os.urandom pedidos en bloques grandes y consumidos por tramos."""
+
+    def __init__(self, size_hint: int):
+        self._size = max(size_hint, 4096)
+        self._buf = b""
+        self._pos = 0
+
+    def take(self, n: int) -> bytes:
+        if self._pos + n > len(self._buf):
+            self._buf = self._buf[self._pos:] + os.urandom(max(self._size, n))
+            self._pos = 0
+        out = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return out
+
+    def chars(self, alphabet: str, n: int) -> str:
+        """`n` caracteres uniformes del alfabeto (ASCII)."""
+        table, rejected, limit = _translation(alphabet.encode("ascii"))
+        out = b""
+        while len(out) < n:
+            missing = n - len(out)
+            out += self.take(missing * 256 // limit + 8).translate(table, rejected)
+        return out[:n].decode("ascii")
+
+    def below(self, bound: int, n: int) -> List[int]:
+        """`n` enteros uniformes en [0, bound) por rechazo sobre uint32."""
+        limit = (1 << 32) - (1 << 32) % bound
+        out: List[int] = []
+        while len(out) < n:
+            words = array("I", self.take(4 * (n - len(out) + 4)))
+            out += [w % bound for w in words if w < limit]
+        return out[:n]
+
+    def shuffle_keys(self, n: int) -> array:
+        """Claves aleatorias de 64 bits para barajar ordenando."""
+        return array("Q", self.take(8 * n))
+
+
+def _generate_passphrases(count: int, policy: PasswordPolicy, rand: _RandomBuffer) -> List[str]:
+    if policy.wordlist:
+        picks = rand.below(len(policy.wordlist), count * policy.words)
+        words = [policy.wordlist[i] for i in picks]
+    else:
+        consonants = rand.chars(SYLLABLE_CONSONANTS, count * policy.words * policy.syllables)
+        vowels = rand.chars(SYLLABLE_VOWELS, count * policy.words * policy.syllables)
+        words = ["".join(c + v for c, v in zip(consonants[k:k + policy.syllables], vowels[k:k + policy.syllables]))
+                 for k in range(0, len(consonants), policy.syllables)]
+    return [policy.separator.join(words[k:k + policy.words]) for k in range(0, len(words), policy.words)]
+
+
+def generate_passwords(count: int, policy: PasswordPolicy = DEFAULT_POLICY) -> List[str]:
+    """Genera `count` contraseñas que cumplen la política con un solo búfer de azar."""
+    if count <= 0:
+        return []
+    rand = _RandomBuffer(count * policy.length * 10)
+    if policy.passphrase:
+        return _generate_passphrases(count, policy, rand)
+
+    classes = policy.classes()
+    alphabet = "".join(a for a, _ in classes)
+    required = sum(m for _, m in classes)
+    free = policy.length - required
+    # Por clase, los caracteres obligatorios de todo el lote de una vez
+    fixed = [(rand.chars(a, m * count), m) for a, m in classes if m]
+    fillers = rand.chars(alphabet, free * count)
+    keys = rand.shuffle_keys(policy.length * count)
+
+    passwords = []
+    for n in range(count):
+        chars = "".join(block[n * m:(n + 1) * m] for block, m in fixed) + fillers[n * free:(n + 1) * free]
+        order = keys[n * policy.length:(n + 1) * policy.length]
+        passwords.append("".join(c for _, c in sorted(zip(order, chars))))
+    return passwords
+
 
 class EncryptionManager:
     """Maneja el cifrado AES-256-GCM y la derivación de claves."""
     
     def __init__(self, master_password: str, salt_str: str):
-        # 1. Derivar la clave de 32 bytes (256 bits)
-        # Usamos un salt fijo para este ejemplo simplificado
-
-        salt = base64.b64decode(salt_str)
+        self._load_key(derive_key(master_password, salt_str))
 
+    @classmethod
+    def from_key(cls, key: bytes) -> "EncryptionManager":
+        """Construye el gestor a partir de una clave ya derivada (sin pagar el KDF)."""
+        engine = cls.__new__(cls)
+        engine._load_key(bytes(key))
+        return engine
 
-        kdf = PBKDF2HMAC(
+    def _load_key(self, key: bytes):
+        self.aesgcm = AESGCM(key)
+        # Clave independiente para el índice de búsqueda (nunca la de cifrado)
+        self._search_key = HKDF(
             algorithm=hashes.SHA256(),
             length=32,
-            salt=salt,
-            iterations=600000,
-        )
-        key = kdf.derive(master_password.encode())
-        self.aesgcm = AESGCM(key)
+            salt=None,
+            info=b"olesa-search-index",
+        ).derive(key)
 
-    def encrypt(self, plain_text: str) -> str:
-        """Cifra y devuelve un string en base64 que incluye el nonce."""
+    def _token(self, gram: str) -> bytes:
+        return hmac.digest(self._search_key, gram.encode("utf-8"), "sha256")[:SEARCH_TOKEN_SIZE]
+
+    def blind_tokens(self, *texts: str) -> Set[bytes]:
+        """Tokens HMAC de todos los n-gramas (1..3) de los textos normalizados."""
+        grams = set()
+        for text in texts:
+            text = text.strip().lower()
+            for n in range(1, SEARCH_NGRAM + 1):
+                grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+        return {self._token(g) for g in grams}
+
+    def blind_query_tokens(self, query: str) -> Set[bytes]:
+        """
+        Tokens que debe tener una entrada para contener `query`. Hasta 3 caracteres
+        el token es exacto; a partir de ahí son sus trigramas y los candidatos
+        se confirman al descifrarlos.
+        """
+        query = query.strip().lower()
+        if len(query) <= SEARCH_NGRAM:
+            return {self._token(query)} if query else set()
+        return {self._token(query[i:i + SEARCH_NGRAM]) for i in range(len(query) - SEARCH_NGRAM + 1)}
+
+    def encrypt(self, plain_text: str) -> bytes:
+        """Cifra y devuelve nonce || ciphertext || tag en bruto, listo para una columna BLOB."""
         nonce = secrets.token_bytes(12)  # Nonce estándar para GCM
-        ciphertext = self.aesgcm.encrypt(nonce, plain_text.encode(), None)
-        # Combinamos nonce + ciphertext y lo pasamos a base64 para SQLite
-        return base64.b64encode(nonce + ciphertext).decode('utf-8')
+        return nonce + self.aesgcm.encrypt(nonce, plain_text.encode(), None)
 
-    def decrypt(self, encrypted_base64: str) -> str:
-        """Descifra el string base64 extrayendo el nonce inicial."""
+    def decrypt(self, encrypted: bytes | str) -> str:
+        """
+        Descifra un valor BLOB (nonce inicial + ciphertext). También acepta el
+        formato antiguo en base64 (TEXT) de las filas aún no migradas.
+        """
         try:
-            data = base64.b64decode(encrypted_base64)
-            nonce = data[:12]
-            ciphertext = data[12:]
-            return self.aesgcm.decrypt(nonce, ciphertext, None).decode('utf-8')
+            data = memoryview(base64.b64decode(encrypted) if isinstance(encrypted, str) else encrypted)
+            return self.aesgcm.decrypt(data[:12], data[12:], None).decode('utf-8')
         except Exception:
-            return "--- ERROR: NO SE PUDO DESCIFRAR ---"
+            return DECRYPT_ERROR
 
-    def generate_password(self, length=32):
-        alphabet = string.ascii_letters + string.digits + "!@#$%^&*"
-        while True:
-            password = ''.join(secrets.choice(alphabet) for _ in range(length))
-            if sum( c in "!@#$%^&*" for c in password) >= 3:
-                return password
\ No newline at end of file
+    def encrypt_fields(self, fields: Sequence[str], aad: bytes) -> bytes:
+        """Empaqueta varios campos y los cifra con una sola operación AES-GCM."""
+        encoded = [f.encode("utf-8") for f in fields]
+        packed = b"".join(FIELD_LEN.pack(len(b)) + b for b in encoded)
+        nonce = secrets.token_bytes(12)
+        return nonce + self.aesgcm.encrypt(nonce, packed, aad)
+
+    def decrypt_fields(self, encrypted: bytes, count: int, aad: bytes) -> List[str]:
+        """Inverso de encrypt_fields. `aad` debe coincidir (cabecera y registro no son intercambiables)."""
+        try:
+            data = memoryview(encrypted)
+            packed = self.aesgcm.decrypt(data[:12], data[12:], aad)
+            fields, pos = [], 0
+            for _ in range(count):
+                (size,) = FIELD_LEN.unpack_from(packed, pos)
+                pos += FIELD_LEN.size
+                fields.append(packed[pos:pos + size].decode("utf-8"))
+                pos += size
+            return fields
+        except Exception:
+            return [DECRYPT_ERROR] * count
+
+    def generate_password(self, length=32, policy: Optional[PasswordPolicy] = None) -> str:
+        return generate_passwords(1, policy or PasswordPolicy(length=length))[0]
+
+    def generate_passwords(self, count: int, policy: PasswordPolicy = DEFAULT_POLICY) -> List[str]:
+        return generate_passwords(count, policy)
@@ -0,0 +1,126 @@
+import csv
+import hashlib
+import io
+from dataclasses import dataclass
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+
+from database import VaultManager
+
+# --- IMPORTACIÓN MASIVA DESDE CSV ---
+# Acepta las exportaciones de los navegadores (Chrome, Edge, Firefox) y de
+# gestores como Bitwarden o KeePass. Las filas se leen con un generador, se
+# cifran por lotes y cada lote se inserta con executemany en una transacción
+# que también guarda el progreso, así una importación interrumpida continúa
+# donde se quedó al repetirla con el mismo fichero. Al terminar se borra el
+# progreso: volver a importar después el mismo fichero lo importa de nuevo.
+
+SITE_COLUMNS     = ("name", "title", "url", "login_uri", "origin", "hostname", "site", "account")
+USER_COLUMNS     = ("username", "login_username", "user", "email", "login", "user name")
+PASSWORD_COLUMNS = ("password", "login_password", "pass")
+
+
+@dataclass(frozen=True)
+class ImportRow:
+    site: str
+    user: str
+    password: str
+
+
+@dataclass
+class ImportProgress:
+    """Filas leídas del CSV (incluidas las de ejecuciones anteriores), importadas y descartadas."""
+
+    rows_done: int = 0
+    imported: int = 0
+    skipped: int = 0
+
+
+def _pick(row: dict, columns) -> str:
+    for column in columns:
+        value = row.get(column)
+        if value:
+            return value.strip()
+    return ""
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[Optional[ImportRow]]:
+    """
+    Genera una ImportRow por fila del CSV, o None si le falta el servicio o la
+    contraseña (se cuenta como descartada pero mantiene la numeración).
+    """
+    reader = csv.DictReader(lines)
+    if reader.fieldnames:
+        reader.fieldnames = [f.strip().lower() for f in reader.fieldnames]
+    for row in reader:
+        site     = _pick(row, SITE_COLUMNS)
+        password = _pick(row, PASSWORD_COLUMNS)
+        if not site or not password:
+            yield None
+            continue
+        yield ImportRow(site=site, user=_pick(row, USER_COLUMNS), password=password)
+
+
+class VaultImporter:
+    """Importa CSV a la bóveda de un usuario en lotes reanudables."""
+
+    def __init__(self, vault: VaultManager, batch_size: int = 500, workers: int = 0):
+        self.vault = vault
+        self.db = vault.db
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def import_bytes(self, user_id: int, data: bytes, progress: Callable[[ImportProgress], None] | None = None) -> ImportProgress:
+        source_hash = hashlib.sha256(data).hexdigest()
+        return self.import_lines(user_id, io.StringIO(data.decode("utf-8-sig"), newline=""), source_hash, progress)
+
+    def import_file(self, user_id: int, path: str, progress: Callable[[ImportProgress], None] | None = None) -> ImportProgress:
+        # Primera pasada en streaming solo para identificar el fichero
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            return self.import_lines(user_id, f, digest.hexdigest(), progress)
+
+    def import_lines(
+        self,
+        user_id: int,
+        lines: Iterable[str],
+        source_hash: str,
+        progress: Callable[[ImportProgress], None] | None = None,
+    ) -> ImportProgress:
+        row = self.db.execute(
+            "SELECT rows_done FROM import_jobs WHERE user_id = ? AND source_hash = ?;",
+            (user_id, source_hash),
+            fetchone=True,
+        )
+        state = ImportProgress(rows_done=row["rows_done"] if row else 0)
+        rows = parse_csv(lines)
+        # Reanudación: saltar las filas ya confirmadas en ejecuciones anteriores
+        for _ in islice(rows, state.rows_done):
+            pass
+
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                # Importación completa: la siguiente con este fichero empieza de cero
+                self.db.execute(
+                    "DELETE FROM import_jobs WHERE user_id = ? AND source_hash = ?;",
+                    (user_id, source_hash),
+                )
+                return state
+            items = [(r.site, r.user, r.password) for r in batch if r is not None]
+            with self.db.transaction() as conn:
+                if items:
+                    self.vault.add_many(conn, user_id, items, workers=self.workers)
+                conn.execute(
+                    """INSERT INTO import_jobs (user_id, source_hash, rows_done) VALUES (?, ?, ?)
+                       ON CONFLICT (user_id, source_hash) DO UPDATE SET rows_done = excluded.rows_done;""",
+                    (user_id, source_hash, state.rows_done + len(batch)),
+                )
+            state.rows_done += len(batch)
+            state.imported  += len(items)
+            state.skipped   += len(batch) - len(items)
+            if progress:
+                progress(state)
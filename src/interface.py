@@ -1,36 +1,36 @@
 import flet as ft
-from database import Database, AuthManager, VaultManager, User, Verify
-from encryption import EncryptionManager
+from database import VaultManager, User, Verify, EntrySummary, SCHEMA_VERSION, migrate
+from services import ServerBusy, get_services
+from importer import VaultImporter
+from rotation import VaultRotator
+from metrics import start_exporters
+from strength import estimate as estimate_strength
+from dataset import shared_index
 import sqlite3
+import asyncio
 import logging
+import secrets
 import threading
+import time
 
 from llm import AiModel
 import os
 
-DB_PATH = "passmanager.db"
+# Búsqueda en la bóveda: espera tras la última tecla y filas máximas a pintar
+SEARCH_DEBOUNCE  = 0.25
+MAX_VISIBLE_ROWS = 200
+
+# Color del indicador de fortaleza para cada puntuación (0-4)
+COLORES_FORTALEZA = (ft.Colors.RED_400, ft.Colors.DEEP_ORANGE_400, ft.Colors.ORANGE_400,
+                     ft.Colors.YELLOW_400, ft.Colors.GREEN_400)
 
 class AppSession:
-    def _init_(self):
-        self.db: Database | None = None
-        self.auth: AuthManager | None = None
+    def __init__(self):
+        self.id = secrets.token_urlsafe(16)
         self.vault: VaultManager | None = None
         self.user: User | None = None
 
 
-def _tables_exist(db_path: str) -> bool:
-    """Devuelve True si las tablas ya están creadas en la base de datos."""
-    try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='credentials';")
-        result = cur.fetchone()
-        conn.close()
-        return result is not None
-    except Exception:
-        return False
-
-
 def main(page: ft.Page):
     page.title = "Gestor de Olesa Manager"
     page.window_width = 960
@@ -38,9 +38,15 @@ def main(page: ft.Page):
     page.theme_mode = ft.ThemeMode.DARK
     page.padding = 0
 
-    session = AppSession()
-    session.db = Database(DB_PATH)
-    session.auth = AuthManager(session.db)
+    services = get_services()
+    session  = AppSession()
+
+    # La sesión web terminó: borrar su clave derivada y su caché
+    page.on_close = lambda _: services.logout(session.id)
+
+    # Servicio de selección de ficheros (importación CSV)
+    file_picker = ft.FilePicker()
+    page.services.append(file_picker)
 
     # ── helpers globales ──────────────────────────────────────────────────────
     def show_snack(msg: str, color=ft.Colors.GREEN_400):
@@ -62,13 +68,37 @@ def main(page: ft.Page):
         dlg.open = False
         page.update()
 
+    def current_vault() -> VaultManager | None:
+        """VaultManager de la sesión usando la clave en caché; None si ha caducado."""
+        session.vault = services.vault(session.id)
+        if session.vault is None:
+            go_to_login()
+            show_snack("Sesión caducada por inactividad.", ft.Colors.RED_400)
+        return session.vault
+
     def go_to_vault():
+        if current_vault() is None:
+            return
         page.overlay.clear()
         page.controls.clear()
         page.add(build_vault_view())
         page.update()
+        page.run_task(prepare_vault, session.vault, session.user.id)
+
+    async def prepare_vault(vault: VaultManager, user_id: int):
+        """
+        Pone al día las bóvedas antiguas (formato empaquetado y tokens de
+        búsqueda que falten) en un hilo, después de pintar la primera página:
+        en una bóveda grande bloquearía el bucle de eventos de todas las sesiones.
+        """
+        try:
+            await asyncio.to_thread(vault.upgrade_records, user_id)
+            await asyncio.to_thread(vault.index_missing, user_id)
+        except Exception as ex:
+            logging.error(f"Error poniendo al día la bóveda: {ex}")
 
     def go_to_login():
+        services.logout(session.id)
         session.user  = None
         session.vault = None
         page.overlay.clear()
@@ -102,7 +132,7 @@ def main(page: ft.Page):
         )
         loading = ft.ProgressRing(width=20, height=20, visible=False)
 
-        def on_login(e):
+        async def on_login(e):
             username = username_field.value.strip()
             password = password_field.value
 
@@ -116,17 +146,34 @@ def main(page: ft.Page):
             error_label.value  = ""
             page.update()
 
-            user_data = session.auth.login(username, password)
+            rekeyed = []
 
-            if user_data:
-                engine        = EncryptionManager(password, user_data.salt)
-                password      = " "
-                session.vault = VaultManager(session.db, engine)
-                session.user  = user_data
+            def notify(msg: str):
+                rekeyed.append(msg)
+                error_label.value = msg
+                page.update()
+
+            # bcrypt + KDF en el pool de procesos compartido: la UI sigue respondiendo
+            try:
+                session.user = await services.login(session.id, username, password, notify)
+            except ServerBusy as ex:
+                session.user      = None
+                error_label.value = f"Servidor ocupado: {ex} Inténtalo en unos minutos."
+            except Exception as ex:
+                # Adopción de la clave o rotación pendiente: la sesión ya se ha cerrado
+                logging.error(f"Error abriendo la bóveda: {ex}")
+                session.user      = None
+                error_label.value = "No se pudo abrir la bóveda. Inténtalo de nuevo."
+            else:
+                if session.user is None:
+                    error_label.value = "Usuario o contraseña incorrectos."
+            password = " "
+
+            if session.user is not None:
+                if rekeyed:
+                    show_snack("Rotación de la clave de la bóveda completada.")
                 go_to_vault()
             else:
-                password              = " "
-                error_label.value     = "Usuario o contraseña incorrectos."
                 login_btn.disabled    = False
                 loading.visible       = False
                 page.update()
@@ -134,8 +181,8 @@ def main(page: ft.Page):
         login_btn.on_click       = on_login
         password_field.on_submit = on_login
 
-        # ── formulario login (tablas ya creadas) ──────────────────────────────
-        if _tables_exist(DB_PATH):
+        # ── formulario login (ya hay cuentas) ─────────────────────────────────
+        if services.has_users():
             return ft.Container(
                 content=ft.Column(
                     [
@@ -166,28 +213,8 @@ def main(page: ft.Page):
             page.scroll  = ft.ScrollMode.AUTO
 
             try:
-                db   = session.db
-                auth = AuthManager(db)
                 ai   = AiModel()
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS credentials (
-                        id             INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username       TEXT UNIQUE NOT NULL,
-                        password_hash  TEXT NOT NULL,
-                        salt           TEXT NOT NULL,
-                        two_fa_contact TEXT NOT NULL
-                    );
-                """)
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS vault (
-                        id            INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id       INTEGER NOT NULL,
-                        site_name     TEXT NOT NULL,
-                        site_user     TEXT NOT NULL,
-                        site_password TEXT NOT NULL,
-                        FOREIGN KEY (user_id) REFERENCES credentials (id) ON DELETE CASCADE
-                    );
-                """)
+                AiModel.warm_up()  # el SDK de Groq solo hace falta en el registro
             except Exception as e:
                 return ft.Container(
                     content=ft.Column(
@@ -208,41 +235,25 @@ def main(page: ft.Page):
                 page.update()
 
             def actualizar_indicador(password: str):
-                errores = Verify.validate_password(password)
-                n = len(errores)
+                # Estimación local en cada pulsación; el análisis con IA queda opcional
                 if not password:
                     indicador_txt.value   = ""
                     barra_fortaleza.value = 0
                     barra_fortaleza.color = ft.Colors.GREY_700
-                elif n >= 4:
-                    indicador_txt.value   = "Muy debil"
-                    indicador_txt.color   = ft.Colors.RED_400
-                    barra_fortaleza.value = 0.15
-                    barra_fortaleza.color = ft.Colors.RED_400
-                elif n == 3:
-                    indicador_txt.value   = "Debil"
-                    indicador_txt.color   = ft.Colors.DEEP_ORANGE_400
-                    barra_fortaleza.value = 0.35
-                    barra_fortaleza.color = ft.Colors.DEEP_ORANGE_400
-                elif n == 2:
-                    indicador_txt.value   = "Regular"
-                    indicador_txt.color   = ft.Colors.ORANGE_400
-                    barra_fortaleza.value = 0.55
-                    barra_fortaleza.color = ft.Colors.ORANGE_400
-                elif n == 1:
-                    indicador_txt.value   = "Buena"
-                    indicador_txt.color   = ft.Colors.YELLOW_400
-                    barra_fortaleza.value = 0.75
-                    barra_fortaleza.color = ft.Colors.YELLOW_400
                 else:
-                    indicador_txt.value   = "Fuerte"
-                    indicador_txt.color   = ft.Colors.GREEN_400
-                    barra_fortaleza.value = 1.0
-                    barra_fortaleza.color = ft.Colors.GREEN_400
+                    fortaleza = estimate_strength(password)
+                    color = COLORES_FORTALEZA[fortaleza.score]
+                    detalle = f"{fortaleza.label} · {fortaleza.entropy_bits:.0f} bits · se descifra en {fortaleza.crack_time_display}"
+                    if fortaleza.warning:
+                        detalle += f"\n{fortaleza.warning}"
+                    indicador_txt.value   = detalle
+                    indicador_txt.color   = color
+                    barra_fortaleza.value = (fortaleza.score + 1) / 5
+                    barra_fortaleza.color = color
                 analizar_btn.visible = bool(password)
                 page.update()
 
-            def btn_analizar_click(e):
+            async def btn_analizar_click(e):
                 if not reg_pass.value:
                     mostrar_snack("Escribe una contrasena primero.")
                     return
@@ -253,23 +264,21 @@ def main(page: ft.Page):
                 groq_resultado.color  = ft.Colors.BLUE_GREY_400
                 page.update()
 
-                def consultar():
-                    try:
-                        resultado = ai.consultar_seguridad(reg_pass.value)
-                        groq_resultado.value = resultado
-                        groq_resultado.color = ft.Colors.BLUE_GREY_100
-                    except Exception as ex:
-                        logging.error(f"Error Groq: {ex}")
-                        groq_resultado.value = f"Error al consultar Groq: {ex}"
-                        groq_resultado.color = ft.Colors.RED_400
-                    finally:
-                        analizar_btn.disabled = False
-                        analizar_btn.text     = "Analizar con IA"
-                        page.update()
-
-                threading.Thread(target=consultar, daemon=True).start()
-
-            def btn_register_click(e):
+                # Cliente asíncrono compartido: no bloquea la UI ni abre una conexión nueva
+                try:
+                    resultado = await ai.consultar_seguridad_async(reg_pass.value)
+                    groq_resultado.value = resultado
+                    groq_resultado.color = ft.Colors.BLUE_GREY_100
+                except Exception as ex:
+                    logging.error(f"Error Groq: {ex}")
+                    groq_resultado.value = f"Error al consultar Groq: {ex}"
+                    groq_resultado.color = ft.Colors.RED_400
+                finally:
+                    analizar_btn.disabled = False
+                    analizar_btn.text     = "Analizar con IA"
+                    page.update()
+
+            async def btn_register_click(e):
                 reg_user.error_text         = None
                 reg_email.error_text        = None
                 reg_pass.error_text         = None
@@ -292,13 +301,12 @@ def main(page: ft.Page):
                 page.update()
 
                 try:
-                    auth.register_user(
+                    # bcrypt + KEK para envolver la clave de datos: fuera del hilo de la UI
+                    await services.register(
                         username       = reg_user.value.strip(),
                         password       = reg_pass.value,
-                        two_fa_contact = reg_email.value.strip()
+                        two_fa_contact = reg_email.value.strip(),
                     )
-                    session.db   = db
-                    session.auth = AuthManager(db)
                     mostrar_snack("¡Cuenta creada! Inicia sesión.", ft.Colors.GREEN_700)
                     page.window_width  = 960
                     page.window_height = 640
@@ -435,8 +443,10 @@ def main(page: ft.Page):
     #  VISTA BÓVEDA
     # ══════════════════════════════════════════════════════════════════════════
     def build_vault_view():
-        # Lista mutable: se actualiza con .clear() + .extend() sin nonlocal
-        entries_list = session.vault.list_all_entries(session.user.id)
+        # Lista mutable: se actualiza con .clear() + .extend() sin nonlocal.
+        # Solo contiene las páginas ya cargadas (sin contraseñas descifradas).
+        entries_list = session.vault.list_page(session.user.id)
+        total_entries = [session.vault.count_entries(session.user.id)]
 
         # ── tabla ─────────────────────────────────────────────────────────────
         table = ft.DataTable(
@@ -455,7 +465,7 @@ def main(page: ft.Page):
         )
 
         entries_count_txt = ft.Text(
-            str(len(entries_list)),
+            str(total_entries[0]),
             size=28,
             weight=ft.FontWeight.BOLD,
             color=ft.Colors.BLUE_300,
@@ -472,15 +482,23 @@ def main(page: ft.Page):
 
         # ── make_row ──────────────────────────────────────────────────────────
         def make_row(entry):
-            def on_copy(e, pwd=entry.site_password):
+            def on_copy(e, eid=entry.id):
+                vault = current_vault()
+                if vault is None:
+                    return
                 try:
-                    page.set_clipboard(pwd)
+                    page.set_clipboard(vault.get_password(session.user.id, eid))
                     show_snack("¡Contraseña copiada al portapapeles!")
                 except Exception as ex:
                     show_snack(f"Error al copiar: {ex}", ft.Colors.RED_400)
 
-            def on_view(e, ent=entry):
-                show_detail(ent)
+            def on_view(e, eid=entry.id):
+                vault = current_vault()
+                if vault is None:
+                    return
+                ent = vault.get_entry(session.user.id, eid)
+                if ent:
+                    show_detail(ent)
 
             def on_delete(e, eid=entry.id, sn=entry.site_name):
                 show_confirm_delete(eid, sn)
@@ -517,19 +535,46 @@ def main(page: ft.Page):
                 ]
             )
 
+        # ── paginación ────────────────────────────────────────────────────────
+        load_more_btn = ft.TextButton("Cargar más", icon=ft.Icons.EXPAND_MORE)
+
+        def all_loaded() -> bool:
+            return len(entries_list) >= total_entries[0]
+
+        def load_next_page() -> bool:
+            vault = current_vault()
+            if vault is None:
+                return False
+            after = entries_list[-1].id if entries_list else 0
+            entries_list.extend(vault.list_page(session.user.id, after_id=after))
+            return True
+
+        def on_load_more(e):
+            if load_next_page():
+                refresh_table()
+
+        load_more_btn.on_click = on_load_more
+
         # ── refresh_table ─────────────────────────────────────────────────────
         search_query = [""]
-
-        def refresh_table(query: str = None):
-            if query is not None:
-                search_query[0] = query
-            q = search_query[0].lower()
-            filtered = (
-                entries_list if not q
-                else [e for e in entries_list if q in e.site_name.lower() or q in e.site_user.lower()]
-            )
-            if filtered:
-                table.rows = [make_row(e) for e in filtered]
+        # Última búsqueda completada: se reutiliza para acotar si la consulta
+        # nueva solo añade caracteres a la anterior
+        last_search = {"q": "", "results": None}
+        search_gen = [0]
+        # id -> DataRow visible, para parchear la tabla sin reconstruirla
+        rows_by_id = {}
+        results_info = ft.Text("", size=12, italic=True, color=ft.Colors.GREY_500, visible=False)
+
+        def matches(entry, q: str) -> bool:
+            return not q or q in entry.site_name.lower() or q in entry.site_user.lower()
+
+        def render_rows(entries, q: str):
+            # Como mucho MAX_VISIBLE_ROWS filas: con bóvedas grandes se pide afinar la búsqueda
+            rows_by_id.clear()
+            for e in entries[:MAX_VISIBLE_ROWS]:
+                rows_by_id[e.id] = make_row(e)
+            if entries:
+                table.rows = list(rows_by_id.values())
             else:
                 table.rows = [
                     ft.DataRow(cells=[
@@ -542,11 +587,110 @@ def main(page: ft.Page):
                         ft.DataCell(ft.Text("")),
                     ])
                 ]
-            entries_count_txt.value = str(len(entries_list))
+            results_info.visible = len(entries) > MAX_VISIBLE_ROWS
+            results_info.value   = f"Mostrando {MAX_VISIBLE_ROWS} de {len(entries)} resultados. Afina la búsqueda."
+            update_counters()
+
+        def refresh_table(query: str = None):
+            if query is not None:
+                search_query[0] = query
+            q = search_query[0].lower()
+            if q and last_search["q"] == q:
+                filtered = last_search["results"]
+            elif q:
+                # Consulta SQL sobre el índice ciego: solo se descifran las coincidencias
+                vault = current_vault()
+                if vault is None:
+                    return
+                filtered = vault.search(session.user.id, q)
+                last_search.update(q=q, results=filtered)
+            else:
+                filtered = entries_list
+            render_rows(filtered, q)
             page.update()
 
+        async def on_search_change(e):
+            search_gen[0] += 1
+            gen = search_gen[0]
+            await asyncio.sleep(SEARCH_DEBOUNCE)
+            if gen != search_gen[0]:
+                return  # ha llegado otra tecla: esta consulta ya no sirve
+            q = (e.control.value or "").strip().lower()
+            search_query[0] = q
+            if not q:
+                results = entries_list
+            elif last_search["q"] and q.startswith(last_search["q"]):
+                # La consulta solo se ha alargado: se filtra el resultado anterior en memoria
+                results = [x for x in last_search["results"] if matches(x, q)]
+            else:
+                vault = current_vault()
+                if vault is None:
+                    return
+                results = await asyncio.to_thread(vault.search, session.user.id, q)
+                if gen != search_gen[0]:
+                    return
+            if q:
+                last_search.update(q=q, results=results)
+            else:
+                last_search.update(q="", results=None)
+            render_rows(results, q)
+            table.update()
+            results_info.update()
+            load_more_btn.update()
+
+        def reload_entries():
+            vault = current_vault()
+            if vault is None:
+                return
+            entries_list.clear()
+            entries_list.extend(vault.list_page(session.user.id))
+            total_entries[0] = vault.count_entries(session.user.id)
+            last_search.update(q="", results=None)
+            refresh_table()
+
+        def update_counters():
+            entries_count_txt.value = str(total_entries[0])
+            load_more_btn.visible   = not search_query[0] and not all_loaded()
+
         refresh_table()
 
+        def insert_entry(entry: EntrySummary):
+            total_entries[0] += 1
+            q = search_query[0].lower()
+            # Si quedan páginas sin cargar, la entrada nueva (id mayor) aparecerá
+            # al llegar al final; añadirla ahora rompería el cursor de paginación.
+            if len(entries_list) + 1 >= total_entries[0]:
+                entries_list.append(entry)
+                visible = matches(entry, q)
+            else:
+                visible = bool(q) and matches(entry, q)
+            if last_search["q"] and matches(entry, last_search["q"]):
+                last_search["results"].append(entry)
+            if visible:
+                if not rows_by_id:
+                    table.rows.clear()  # quitar la fila "boveda vacia"
+                rows_by_id[entry.id] = make_row(entry)
+                table.rows.append(rows_by_id[entry.id])
+            update_counters()
+            page.update()
+
+        def remove_entry(entry_id: int):
+            total_entries[0] -= 1
+            for i, e in enumerate(entries_list):
+                if e.id == entry_id:
+                    del entries_list[i]
+                    break
+            if last_search["results"] is not None:
+                last_search["results"] = [e for e in last_search["results"] if e.id != entry_id]
+            row = rows_by_id.pop(entry_id, None)
+            if row is not None:
+                table.rows.remove(row)
+            if not rows_by_id:
+                refresh_table()  # muestra el mensaje de tabla vacía
+                return
+            update_counters()
+            page.update()
+
         # ── detail dialog ─────────────────────────────────────────────────────
         def show_detail(entry):
             detail_dialog.title = ft.Text(f"  {entry.site_name}", weight=ft.FontWeight.BOLD)
@@ -586,18 +730,18 @@ def main(page: ft.Page):
                 page.update()
                 return
 
+            vault = current_vault()
+            if vault is None:
+                return
             try:
-                session.vault.add(session.user.id, site, usr, pwd)
+                entry = vault.add(session.user.id, site, usr, pwd)
             except Exception as ex:
                 err_f.value = f"Error al guardar: {ex}"
                 page.update()
                 return
 
             close_dlg(add_dialog)
-            new_entries = session.vault.list_all_entries(session.user.id)
-            entries_list.clear()
-            entries_list.extend(new_entries)
-            refresh_table()
+            insert_entry(EntrySummary(id=entry.id, site_name=entry.site_name, site_user=entry.site_user))
             show_snack("Entrada guardada correctamente.")
 
         add_dialog.content = ft.Column(
@@ -619,20 +763,18 @@ def main(page: ft.Page):
 
         # ── confirm delete dialog ─────────────────────────────────────────────
         def do_delete(entry_id: int, site_name: str):
+            vault = current_vault()
+            if vault is None:
+                return
             try:
-                session.db.execute(
-                    "DELETE FROM vault WHERE id = ? AND user_id = ?;",
-                    (entry_id, session.user.id),
-                )
+                deleted_id = vault.delete(session.user.id, entry_id)
             except Exception as ex:
                 show_snack(f"Error al eliminar: {ex}", ft.Colors.RED_400)
                 close_dlg(confirm_dialog)
                 return
             close_dlg(confirm_dialog)
-            new_entries = session.vault.list_all_entries(session.user.id)
-            entries_list.clear()
-            entries_list.extend(new_entries)
-            refresh_table()
+            if deleted_id is not None:
+                remove_entry(deleted_id)
             show_snack(f'Entrada "{site_name}" eliminada.')
 
         def show_confirm_delete(entry_id: int, site_name: str):
@@ -649,12 +791,217 @@ def main(page: ft.Page):
             ]
             open_dlg(confirm_dialog)
 
+        # ── importar CSV ──────────────────────────────────────────────────────
+        import_bar      = ft.ProgressBar(width=340, value=None)
+        import_txt      = ft.Text("Preparando importación...", size=12)
+        import_dialog   = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Importando CSV"),
+            content=ft.Column([import_bar, import_txt], tight=True, spacing=10, width=340),
+        )
+        page.overlay.append(import_dialog)
+
+        async def on_import(e):
+            files = await file_picker.pick_files(
+                dialog_title="Exportación CSV de otro gestor o navegador",
+                allowed_extensions=["csv"],
+                with_data=True,
+            )
+            if not files or files[0].bytes is None:
+                return
+            vault = current_vault()
+            if vault is None:
+                return
+            data = files[0].bytes
+
+            def on_progress(state):
+                import_txt.value = f"{state.imported} importadas, {state.skipped} descartadas..."
+                import_dialog.update()
+
+            open_dlg(import_dialog)
+            try:
+                importer = VaultImporter(vault)
+                state = await asyncio.to_thread(importer.import_bytes, session.user.id, data, on_progress)
+            except Exception as ex:
+                logging.error(f"Error al importar: {ex}")
+                close_dlg(import_dialog)
+                show_snack(f"Importación interrumpida ({ex}). Repítela para continuar.", ft.Colors.RED_400)
+                reload_entries()
+                return
+            close_dlg(import_dialog)
+            reload_entries()
+            show_snack(f"{state.imported} entradas importadas, {state.skipped} descartadas.")
+
+        # ── rotar contraseñas ─────────────────────────────────────────────────
+        rotation_mode = ft.RadioGroup(
+            value="weak",
+            content=ft.Column([
+                ft.Radio(value="weak", label="Débiles o filtradas"),
+                ft.Radio(value="old",  label="Sin cambiar en 90 días"),
+                ft.Radio(value="all",  label="Todas"),
+            ], tight=True),
+        )
+        rotation_bar    = ft.ProgressBar(width=340, value=0)
+        rotation_txt    = ft.Text("", size=12)
+        rotation_dialog = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Rotar contraseñas"),
+            content=ft.Column([
+                ft.Text("Se generarán contraseñas nuevas para las entradas elegidas.", size=12),
+                rotation_mode,
+                rotation_bar,
+                rotation_txt,
+            ], tight=True, spacing=10, width=340),
+            actions=[],
+        )
+        page.overlay.append(rotation_dialog)
+
+        async def run_rotation(e):
+            vault = current_vault()
+            if vault is None:
+                return
+            mode = rotation_mode.value
+            if mode == "weak":
+                criteria = dict(max_score=2)
+            elif mode == "old":
+                criteria = dict(updated_before=time.time() - 90 * 24 * 3600)
+            else:
+                criteria = {}
+
+            def on_progress(state):
+                rotation_bar.value = state.scanned / state.total if state.total else 1
+                rotation_txt.value = f"{state.rotated} rotadas de {state.scanned} revisadas..."
+                rotation_dialog.update()
+
+            for action in rotation_dialog.actions:
+                action.disabled = True
+            rotation_dialog.update()
+            try:
+                state = await asyncio.to_thread(VaultRotator(vault).rotate, session.user.id, progress=on_progress, **criteria)
+            except Exception as ex:
+                logging.error(f"Error al rotar: {ex}")
+                close_dlg(rotation_dialog)
+                show_snack(f"Rotación interrumpida ({ex}). Repítela para continuar donde se quedó.", ft.Colors.RED_400)
+                reload_entries()
+                return
+            close_dlg(rotation_dialog)
+            reload_entries()
+            show_snack(f"{state.rotated} contraseñas rotadas." + (f" {state.skipped} ilegibles omitidas." if state.skipped else ""))
+
+        def show_rotation_dialog(e):
+            rotation_bar.value = 0
+            rotation_txt.value = ""
+            vault = current_vault()
+            if vault is not None and VaultRotator(vault).pending(session.user.id):
+                # Los criterios de la rotación a medias se guardaron al empezarla
+                rotation_txt.value = "Hay una rotación a medias: se continuará con sus criterios."
+            rotation_dialog.actions = [
+                ft.TextButton("Cancelar", on_click=lambda _: close_dlg(rotation_dialog)),
+                ft.Button(
+                    "Rotar",
+                    on_click=run_rotation,
+                    style=ft.ButtonStyle(bgcolor=ft.Colors.ORANGE_800, color=ft.Colors.WHITE),
+                ),
+            ]
+            open_dlg(rotation_dialog)
+
+        # ── cambiar contraseña maestra ────────────────────────────────────────
+        # Solo re-envuelve la clave de datos; opcionalmente se genera además
+        # una clave de datos nueva, lo que sí re-cifra la bóveda por lotes
+        current_pw_f = ft.TextField(label="Contraseña actual", password=True, can_reveal_password=True, width=340)
+        new_pw_f     = ft.TextField(label="Contraseña nueva", password=True, can_reveal_password=True, width=340)
+        confirm_pw_f = ft.TextField(label="Confirmar contraseña nueva", password=True, can_reveal_password=True, width=340)
+        rotate_dek_cb = ft.Checkbox(label="Generar también una clave de datos nueva (re-cifra la bóveda)", value=False)
+        rekey_err    = ft.Text("", color=ft.Colors.RED_400, size=12)
+        rekey_bar    = ft.ProgressBar(width=340, value=0, visible=False)
+        rekey_dialog = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Cambiar contraseña maestra"),
+            content=ft.Column(
+                [current_pw_f, new_pw_f, confirm_pw_f, rotate_dek_cb, rekey_err, rekey_bar],
+                tight=True, spacing=10, width=340,
+            ),
+            actions=[],
+        )
+        page.overlay.append(rekey_dialog)
+
+        async def run_rekey(e):
+            if new_pw_f.value != confirm_pw_f.value:
+                rekey_err.value = "Las contraseñas nuevas no coinciden."
+                rekey_dialog.update()
+                return
+            errores = Verify.validate_password(new_pw_f.value)
+            if errores:
+                rekey_err.value = "\n".join(errores)
+                rekey_dialog.update()
+                return
+            try:
+                row, data_key = await services.unlock(session.user.username, current_pw_f.value)
+            except ServerBusy as ex:
+                rekey_err.value = f"Servidor ocupado: {ex}"
+                rekey_dialog.update()
+                return
+            if not data_key:
+                rekey_err.value = "La contraseña actual no es correcta."
+                rekey_dialog.update()
+                return
+
+            def on_progress(state):
+                rekey_bar.value = state.done / state.total if state.total else 1
+                rekey_err.value = f"{state.done} de {state.total} entradas re-cifradas..."
+                rekey_dialog.update()
+
+            for action in rekey_dialog.actions:
+                action.disabled = True
+            rekey_err.color = ft.Colors.GREY_400
+            rekey_err.value = "Derivando la clave nueva..."
+            rekey_dialog.update()
+            new_password = new_pw_f.value
+            current_pw_f.value = new_pw_f.value = confirm_pw_f.value = ""
+            try:
+                target = await services.kdf.target_params_async()
+                # La KEK nueva se deriva en el pool de KDF, no en el proceso del servidor
+                rewrapped = await services.kdf.rewrap_async(new_password, data_key, target)
+                changed = await asyncio.to_thread(
+                    services.auth.change_master_password,
+                    session.user.id, data_key, new_password, row["salt"], row["wrapped_key"], target, rewrapped,
+                )
+                if not changed:
+                    raise RuntimeError("las credenciales cambiaron durante el cambio de contraseña")
+                if rotate_dek_cb.value:
+                    # Cierra también las demás sesiones del usuario, que tienen la clave antigua
+                    rekey_bar.visible = True
+                    await asyncio.to_thread(services.rotate_data_key, session.id, new_password, on_progress)
+            except Exception as ex:
+                logging.error(f"Error cambiando la contraseña maestra: {ex}")
+                close_dlg(rekey_dialog)
+                show_snack("No se pudo completar el cambio; si quedó a medias se terminará al volver a entrar.", ft.Colors.RED_400)
+                go_to_login()
+                return
+            await asyncio.to_thread(services.lock_agent, session.user.username)
+            close_dlg(rekey_dialog)
+            reload_entries()
+            show_snack("Contraseña maestra cambiada.")
+
+        def show_rekey_dialog(e):
+            current_pw_f.value  = new_pw_f.value = confirm_pw_f.value = ""
+            rotate_dek_cb.value = False
+            rekey_err.value     = ""
+            rekey_err.color     = ft.Colors.RED_400
+            rekey_bar.value     = 0
+            rekey_bar.visible   = False
+            rekey_dialog.actions = [
+                ft.TextButton("Cancelar", on_click=lambda _: close_dlg(rekey_dialog)),
+                ft.Button("Cambiar", on_click=run_rekey),
+            ]
+            open_dlg(rekey_dialog)
+
         # ── toolbar ───────────────────────────────────────────────────────────
         search_field = ft.TextField(
             label="Búsqueda ...",
             prefix_icon=ft.Icons.SEARCH,
             width=260, height=44,
-            on_change=lambda e: refresh_table(e.control.value),
+            on_change=on_search_change,
         )
 
         toolbar = ft.Row(
@@ -668,10 +1015,26 @@ def main(page: ft.Page):
                         color=ft.Colors.WHITE,
                     ),
                 ),
+                ft.OutlinedButton(
+                    "Importar CSV",
+                    icon=ft.Icons.UPLOAD_FILE,
+                    on_click=on_import,
+                ),
+                ft.OutlinedButton(
+                    "Rotar",
+                    icon=ft.Icons.AUTORENEW,
+                    on_click=show_rotation_dialog,
+                ),
                 search_field,
                 ft.Row([
                     ft.Icon(ft.Icons.PERSON_OUTLINE, color=ft.Colors.GREY_400, size=16),
                     ft.Text(session.user.username, color=ft.Colors.GREY_300, size=13),
+                    ft.IconButton(
+                        icon=ft.Icons.KEY,
+                        tooltip="Cambiar contraseña maestra",
+                        icon_color=ft.Colors.GREY_400,
+                        on_click=show_rekey_dialog,
+                    ),
                     ft.IconButton(
                         icon=ft.Icons.LOGOUT,
                         tooltip="Cerrar sesion",
@@ -717,7 +1080,7 @@ def main(page: ft.Page):
                                 ft.Divider(height=4, color=ft.Colors.TRANSPARENT),
                                 stats_row,
                                 ft.Divider(height=4, color=ft.Colors.TRANSPARENT),
-                                ft.Column([table], scroll=ft.ScrollMode.AUTO, expand=True),
+                                ft.Column([table, results_info, load_more_btn], scroll=ft.ScrollMode.AUTO, expand=True),
                             ],
                             expand=True,
                             spacing=10,
@@ -736,4 +1099,15 @@ def main(page: ft.Page):
 
 
 if __name__ == "__main__":
+    start_exporters()
+    # El esquema se pone al día una sola vez, antes de atender ninguna sesión
+    applied = migrate(get_services().db)
+    if applied:
+        logging.info(f"Esquema de la base de datos actualizado a la versión {SCHEMA_VERSION}")
+    shared_index(wait=False)  # abre (o construye) el índice de rockyou en segundo plano
+    threading.Thread(target=get_services().kdf.target_params, daemon=True).start()  # calibra el KDF sin esperar al primer registro
+    if os.getenv("OLESA_API_PORT"):
+        # API HTTP/JSON en el mismo proceso: comparte sesiones, KDF y cachés con la web
+        from api import start_in_thread
+        start_in_thread()
     ft.run(main, view=ft.AppView.WEB_BROWSER, host="0.0.0.0", port=8000)
\ No newline at end of file
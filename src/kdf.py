@@ -0,0 +1,254 @@
+import asyncio
+import base64
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+import metrics
+from encryption import (
+    ARGON2ID, LEGACY_KDF, EncryptionManager, KdfParams, calibrate_kdf, check_password, derive_kek, unwrap_key, wrap_key,
+)
+from metrics import timed
+
+# --- DERIVACIÓN DE CLAVES FUERA DEL HILO DE LA UI ---
+# bcrypt + el KDF de la cuenta (Argon2id o PBKDF2) tardan del orden de un
+# segundo de CPU. Si se ejecutan dentro del manejador de eventos de Flet
+# bloquean al resto de sesiones web, así que se envían a un pool de procesos
+# acotado y la UI espera un future.
+
+
+# Parámetros del KDF para cuentas nuevas y actualizaciones:
+#   OLESA_KDF            argon2id (por defecto) o pbkdf2-sha256
+#   OLESA_KDF_TARGET_MS  latencia objetivo de la calibración (250 por defecto)
+#   OLESA_KDF_PARAMS     JSON con parámetros fijos; desactiva la calibración
+KDF_ALGORITHM = os.getenv("OLESA_KDF", ARGON2ID)
+KDF_TARGET_SECONDS = float(os.getenv("OLESA_KDF_TARGET_MS", "250")) / 1000
+KDF_PARAMS_OVERRIDE = os.getenv("OLESA_KDF_PARAMS")
+
+
+def _verify_and_derive(
+    password: str,
+    password_hash: str,
+    salt_str: str,
+    wrapped_key: Optional[bytes] = None,
+    params: KdfParams = LEGACY_KDF,
+) -> Optional[bytes]:
+    """
+    Se ejecuta en el proceso trabajador: comprueba bcrypt, deriva la KEK y
+    desenvuelve con ella la clave de datos. Las cuentas anteriores al cifrado
+    de sobre no tienen clave envuelta: su clave de datos es la propia KEK.
+    """
+    if not check_password(password, password_hash):
+        return None
+    kek = derive_kek(password, salt_str, params)
+    return unwrap_key(kek, wrapped_key) if wrapped_key else kek
+
+
+def verify_and_derive(
+    password: str,
+    password_hash: str,
+    salt_str: str,
+    wrapped_key: Optional[bytes] = None,
+    kdf_params: Optional[str] = None,
+) -> Optional[bytes]:
+    """
+    Igual que KeyDerivationService.unlock, pero en el proceso actual. Para la
+    CLI: una sola derivación no compensa arrancar el pool.
+    """
+    return _verify_and_derive(password, password_hash, salt_str, wrapped_key, KdfParams.from_json(kdf_params))
+
+
+def _rewrap(password: str, data_key: bytes, params: KdfParams) -> Tuple[str, bytes]:
+    """Nuevo salt y clave de datos envuelta con la KEK derivada con `params`."""
+    salt = base64.b64encode(secrets.token_bytes(16)).decode("utf-8")
+    return salt, wrap_key(derive_kek(password, salt, params), data_key)
+
+
+def _measured(fn: Callable, *args):
+    """
+    Se ejecuta en el proceso trabajador: (resultado, medidas, excepción). Las
+    medidas de @timed (bcrypt, KDF) se devuelven al proceso principal, que es
+    el que las exporta.
+    """
+    with metrics.capture() as records:
+        try:
+            return fn(*args), records, None
+        except Exception as ex:
+            return None, records, ex
+
+
+def _unpack_measured(inner: Future, outer: Future):
+    try:
+        result, records, error = inner.result()
+    except BaseException as ex:
+        outer.set_exception(ex)
+        return
+    metrics.replay(records)
+    if error is not None:
+        outer.set_exception(error)
+    else:
+        outer.set_result(result)
+
+
+class KeyDerivationService:
+    """Pool de procesos acotado para bcrypt y el KDF de las cuentas."""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self._max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._pool: ProcessPoolExecutor | None = None
+        self._target: KdfParams | None = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # El pool se crea en el primer uso; "spawn" evita hacer fork de un
+        # proceso con los hilos del servidor de Flet ya en marcha.
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        if not metrics.ENABLED:
+            return self._executor().submit(fn, *args)
+        outer: Future = Future()
+        outer.set_running_or_notify_cancel()
+        inner = self._executor().submit(_measured, fn, *args)
+        inner.add_done_callback(lambda f: _unpack_measured(f, outer))
+        return outer
+
+    def unlock(
+        self,
+        password: str,
+        password_hash: str,
+        salt_str: str,
+        wrapped_key: Optional[bytes] = None,
+        kdf_params: Optional[str] = None,
+    ) -> Future:
+        """Future con la clave de datos, o con None si la contraseña no es correcta."""
+        params = KdfParams.from_json(kdf_params)
+        return self._submit(_verify_and_derive, password, password_hash, salt_str, wrapped_key, params)
+
+    @timed("kdf_unlock")
+    async def unlock_async(
+        self,
+        password: str,
+        password_hash: str,
+        salt_str: str,
+        wrapped_key: Optional[bytes] = None,
+        kdf_params: Optional[str] = None,
+    ) -> Optional[bytes]:
+        return await asyncio.wrap_future(self.unlock(password, password_hash, salt_str, wrapped_key, kdf_params))
+
+    def target_params(self) -> KdfParams:
+        """
+        Parámetros vigentes para este host. Se calibran una sola vez y dentro
+        del pool, que es donde se ejecutan de verdad las derivaciones.
+        """
+        with self._lock:
+            if self._target is not None:
+                return self._target
+        if KDF_PARAMS_OVERRIDE:
+            target = KdfParams.from_json(KDF_PARAMS_OVERRIDE)
+        else:
+            target = self._submit(calibrate_kdf, KDF_TARGET_SECONDS, KDF_ALGORITHM).result()
+        with self._lock:
+            self._target = self._target or target
+            return self._target
+
+    async def target_params_async(self) -> KdfParams:
+        return await asyncio.to_thread(self.target_params)
+
+    async def rewrap_async(self, password: str, data_key: bytes, params: KdfParams) -> Tuple[str, bytes]:
+        """(salt, clave envuelta) para guardar la clave de datos con otros parámetros."""
+        return await asyncio.wrap_future(self._submit(_rewrap, password, data_key, params))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+@dataclass
+class _CachedKey:
+    key: bytearray
+    engine: EncryptionManager
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class SessionKeyCache:
+    """
+    Claves derivadas por sesión autenticada. Caducan tras `idle_timeout`
+    segundos sin uso y se sobrescriben con ceros al expulsarlas.
+    """
+
+    def __init__(self, idle_timeout: float = 900, on_evict: Callable[[str], None] | None = None):
+        self.idle_timeout = idle_timeout
+        # Se llama con el id de cada sesión que caduca o se expulsa (no al sustituir su clave)
+        self.on_evict = on_evict
+        self._entries: Dict[str, _CachedKey] = {}
+        self._lock = threading.Lock()
+        self._janitor: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, session_id: str, key: bytes) -> EncryptionManager:
+        engine = EncryptionManager.from_key(key)
+        with self._lock:
+            self._drop(session_id, notify=False)
+            self._entries[session_id] = _CachedKey(bytearray(key), engine)
+            self._start_janitor()
+        return engine
+
+    def get(self, session_id: str) -> Optional[EncryptionManager]:
+        """Devuelve el gestor de la sesión y renueva su tiempo de inactividad."""
+        with self._lock:
+            cached = self._entries.get(session_id)
+            if cached is None:
+                return None
+            now = time.monotonic()
+            if now - cached.last_used > self.idle_timeout:
+                self._drop(session_id)
+                return None
+            cached.last_used = now
+            return cached.engine
+
+    def evict(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            for session_id in [s for s, c in self._entries.items() if now - c.last_used > self.idle_timeout]:
+                self._drop(session_id)
+
+    def _drop(self, session_id: str, notify: bool = True):
+        cached = self._entries.pop(session_id, None)
+        if cached is not None:
+            # Se borra la copia que controlamos; la que guarda OpenSSL dentro
+            # de AESGCM se libera al perder la última referencia al gestor. El
+            # gestor no se desmonta: puede haber hilos (listado, importación,
+            # API) a mitad de una operación con él, que deben terminarla.
+            cached.key[:] = bytes(len(cached.key))
+            if notify and self.on_evict:
+                self.on_evict(session_id)
+
+    def _start_janitor(self):
+        if self._janitor is None:
+            self._janitor = threading.Thread(target=self._run_janitor, daemon=True)
+            self._janitor.start()
+
+    def _run_janitor(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 4))
+            self.purge_expired()
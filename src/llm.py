@@ -1,23 +1,112 @@
+import asyncio
+import importlib
 import string
 import secrets
-from groq import Groq
+import threading
+import time
+from collections import OrderedDict
 import os
+from typing import TYPE_CHECKING, List, Optional
+
+from dataset import DatasetIndex, shared_index
+from metrics import timed
+
+# El SDK de Groq (y su pila HTTP: httpx, pydantic...) tarda en importarse más
+# que el resto de la aplicación. Se importa al crear el primer cliente, así que
+# quien solo inicia sesión o usa el estimador local no lo paga.
+if TYPE_CHECKING:
+    from groq import AsyncGroq, Groq
+
+# Configuración del cliente de Groq. GROQ_BASE_URL permite apuntar a un
+# servidor local de pruebas (ver test/groq_stub.py).
+GROQ_MODEL           = "llama-3.3-70b-versatile"
+GROQ_BASE_URL        = os.getenv("GROQ_BASE_URL") or None
+GROQ_TIMEOUT         = float(os.getenv("GROQ_TIMEOUT", "20"))
+GROQ_MAX_RETRIES     = int(os.getenv("GROQ_MAX_RETRIES", "2"))     # reintentos con backoff exponencial del SDK
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "4"))
+GROQ_CACHE_TTL       = float(os.getenv("GROQ_CACHE_TTL", "3600"))
+GROQ_CACHE_SIZE      = int(os.getenv("GROQ_CACHE_SIZE", "256"))
+
+
+def password_shape(password: str) -> str:
+    """
+    Clase de carácter de cada posición (a, A, 9, #), lo único que conserva
+    transform_password. Dos contraseñas con la misma forma reciben el mismo análisis.
+    """
+    forma = []
+    for clave in password:
+        if clave in string.ascii_lowercase:
+            forma.append("a")
+        elif clave in string.ascii_uppercase:
+            forma.append("A")
+        elif clave in string.digits:
+            forma.append("9")
+        elif clave in string.punctuation:
+            forma.append("#")
+    return "".join(forma)
+
+
+class TTLCache:
+    """LRU acotado cuyas entradas caducan a los `ttl` segundos."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if time.monotonic() - item[0] > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
 
 class AiModel:
 
+    # Clientes y caché compartidos por todas las sesiones: se reutilizan las
+    # conexiones HTTP (y el handshake TLS) entre análisis
+    _cache = TTLCache(GROQ_CACHE_SIZE, GROQ_CACHE_TTL)
+    _client: Optional["Groq"] = None
+    _async_client: Optional["AsyncGroq"] = None
+    _async_loop: asyncio.AbstractEventLoop | None = None
+    _semaphore: asyncio.Semaphore | None = None
+    _client_lock = threading.Lock()
+
     def __init__(self):
         self._api_key = os.getenv("API_KEY")  # ← Pon tu clave aquí
 
+    @staticmethod
+    def warm_up():
+        """Importa el SDK en segundo plano para que el primer análisis no lo haga en el bucle de eventos."""
+        threading.Thread(target=importlib.import_module, args=("groq",), daemon=True).start()
+
+    @staticmethod
+    def _dataset() -> DatasetIndex | None:
+        """Índice compartido por todo el proceso; se abre una sola vez."""
+        return shared_index()
+
     def buscar_en_dataset(self, password: str) -> bool:
-        """Busca la contraseña en el diccionario rockyou.txt."""
-        try:
-            with open('rockyou.txt', 'r', encoding='latin-1') as f:
-                for linea in f:
-                    if password == linea.strip():
-                        return True
-        except FileNotFoundError:
-            print("⚠️ rockyou.txt no encontrado, omitiendo verificación de diccionario.")
-        return False
+        """Busca la contraseña en el índice del diccionario rockyou.txt."""
+        indice = self._dataset()
+        return indice.contains(password) if indice else False
+
+    def buscar_lote_en_dataset(self, passwords: List[str]) -> List[bool]:
+        """Igual que buscar_en_dataset para un lote de contraseñas."""
+        indice = self._dataset()
+        return indice.contains_many(passwords) if indice else [False] * len(passwords)
 
     def transform_password(self, password: str) -> str:
         """Genera una contraseña con las mismas características de tipo de caracteres."""
@@ -33,13 +122,32 @@ class AiModel:
                 entropia_cont.append(secrets.choice(string.punctuation))
         return ''.join(entropia_cont)
 
-    def consultar_seguridad(self, password: str) -> str:
-        """Consulta a Groq (LLaMA) el análisis de seguridad de la contraseña."""
-        # Se analiza una contraseña transformada, no la real del usuario
-        password_analizar = self.transform_password(password)
+    def _client_kwargs(self) -> dict:
+        return {
+            "api_key": self._api_key,
+            "base_url": GROQ_BASE_URL,
+            "timeout": GROQ_TIMEOUT,
+            "max_retries": GROQ_MAX_RETRIES,
+        }
+
+    def _sync_client(self) -> "Groq":
+        with AiModel._client_lock:
+            if AiModel._client is None:
+                from groq import Groq
+                AiModel._client = Groq(**self._client_kwargs())
+            return AiModel._client
 
-        client = Groq(api_key=self._api_key)
+    def _async_parts(self) -> tuple["AsyncGroq", asyncio.Semaphore]:
+        # El pool de conexiones de httpx pertenece a un bucle de eventos concreto
+        loop = asyncio.get_running_loop()
+        if AiModel._async_client is None or AiModel._async_loop is not loop:
+            from groq import AsyncGroq
+            AiModel._async_client = AsyncGroq(**self._client_kwargs())
+            AiModel._semaphore = asyncio.Semaphore(GROQ_MAX_CONCURRENCY)
+            AiModel._async_loop = loop
+        return AiModel._async_client, AiModel._semaphore
 
+    def _mensajes(self, password_analizar: str) -> list[dict]:
         system_prompt = (
             "Eres un analizador técnico de seguridad  "
             "Responde SOLO con datos, sin introducciones ni consejos éticos. "
@@ -53,12 +161,42 @@ Responde estrictamente con este formato:
 - TIEMPO DE CRACKEO POR FUERZA BRUTA: (Estimado por fuerza bruta con hardware actual en horas)
 - BREVE EXPLICACION DE PORQUE NO ES SEGURA: (INSTRUCCIÓN CRÍTICA: Si el NIVEL DE SEGURIDAD es 6,7, 8, 9 o 10, DEJA ESTE CAMPO TOTALMENTE VACÍO. Solo si es menor a 6, explica brevemente qué mejorar)
 """
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user",   "content": user_prompt}
-            ],
-            model="llama-3.3-70b-versatile",
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user",   "content": user_prompt}
+        ]
+
+    @timed("groq_request")
+    def consultar_seguridad(self, password: str) -> str:
+        """Consulta a Groq (LLaMA) el análisis de seguridad de la contraseña."""
+        forma = password_shape(password)
+        if (cached := self._cache.get(forma)) is not None:
+            return cached
+        # Se analiza una contraseña transformada, no la real del usuario
+        password_analizar = self.transform_password(password)
+        chat_completion = self._sync_client().chat.completions.create(
+            messages=self._mensajes(password_analizar),
+            model=GROQ_MODEL,
             temperature=0.1
         )
-        return chat_completion.choices[0].message.content
+        resultado = chat_completion.choices[0].message.content
+        self._cache.put(forma, resultado)
+        return resultado
+
+    @timed("groq_request_async")
+    async def consultar_seguridad_async(self, password: str) -> str:
+        """Igual que consultar_seguridad sin bloquear el bucle de eventos de Flet."""
+        forma = password_shape(password)
+        if (cached := self._cache.get(forma)) is not None:
+            return cached
+        password_analizar = self.transform_password(password)
+        client, semaphore = self._async_parts()
+        async with semaphore:
+            chat_completion = await client.chat.completions.create(
+                messages=self._mensajes(password_analizar),
+                model=GROQ_MODEL,
+                temperature=0.1
+            )
+        resultado = chat_completion.choices[0].message.content
+        self._cache.put(forma, resultado)
+        return resultado
@@ -0,0 +1,188 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# --- INSTRUMENTACIÓN DE LOS CAMINOS CRÍTICOS ---
+# Se activa con OLESA_METRICS=1. Desactivada, @timed devuelve la función
+# original sin envolver, así que no añade ningún coste en producción.
+#
+#   OLESA_METRICS_PORT     puerto local del endpoint Prometheus (/metrics, /metrics.json)
+#   OLESA_METRICS_DUMP     fichero donde volcar periódicamente el JSON
+#   OLESA_METRICS_INTERVAL segundos entre volcados (60 por defecto)
+
+ENABLED = os.getenv("OLESA_METRICS", "") not in ("", "0", "false")
+
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Latencias en segundos con buckets fijos, número de llamadas y de errores."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # el último es +Inf
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float, error: bool):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "error_rate": self.errors / self.count if self.count else 0.0,
+            "sum_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count else 0.0,
+            "buckets": {str(le): n for le, n in zip((*BUCKETS, "+Inf"), self.buckets)},
+        }
+
+
+Observation = Tuple[str, float, bool]
+
+
+class Registry:
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._capture = threading.local()
+
+    def observe(self, name: str, seconds: float, error: bool = False):
+        records = getattr(self._capture, "records", None)
+        if records is not None:
+            records.append((name, seconds, error))
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds, error)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: h.to_dict() for name, h in sorted(self._histograms.items())}
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, data in self.snapshot().items():
+            metric = f"olesa_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for le, n in data["buckets"].items():
+                cumulative += n
+                lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f"{metric}_sum {data['sum_seconds']}")
+            lines.append(f"{metric}_count {data['count']}")
+            lines.append(f"# TYPE olesa_{name}_errors_total counter")
+            lines.append(f"olesa_{name}_errors_total {data['errors']}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# Los procesos trabajadores (pool del KDF) tienen su propio REGISTRY, que nadie
+# exporta: allí se capturan las medidas y viajan con el resultado para
+# registrarlas en el proceso principal.
+@contextmanager
+def capture() -> Iterator[List[Observation]]:
+    """Desvía a una lista las medidas que se tomen en este hilo dentro del bloque."""
+    REGISTRY._capture.records = records = []
+    try:
+        yield records
+    finally:
+        REGISTRY._capture.records = None
+
+
+def replay(records: List[Observation]):
+    """Registra medidas capturadas en otro proceso."""
+    for name, seconds, error in records:
+        REGISTRY.observe(name, seconds, error)
+
+
+def timed(name: str) -> Callable:
+    """Decorador que registra latencia, llamadas y errores de la función (también async)."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                error = False
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    REGISTRY.observe(name, time.perf_counter() - start, error)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            error = False
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                REGISTRY.observe(name, time.perf_counter() - start, error)
+        return wrapper
+    return decorator
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = REGISTRY.render_prometheus().encode(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(REGISTRY.snapshot()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # no llenar la consola con cada scrape
+
+
+def _dump_forever(path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"timestamp": time.time(), "metrics": REGISTRY.snapshot()}, f)
+        os.replace(tmp, path)
+
+
+def start_exporters():
+    """Arranca el endpoint local y/o el volcado periódico según las variables de entorno."""
+    if not ENABLED:
+        return
+    port = os.getenv("OLESA_METRICS_PORT")
+    if port:
+        server = ThreadingHTTPServer(("127.0.0.1", int(port)), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    dump = os.getenv("OLESA_METRICS_DUMP")
+    if dump:
+        interval = float(os.getenv("OLESA_METRICS_INTERVAL", "60"))
+        threading.Thread(target=_dump_forever, args=(dump, interval), daemon=True).start()
@@ -0,0 +1,180 @@
+import secrets
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from database import DECRYPT_ERROR, Database, VaultManager
+from encryption import EncryptionManager, KdfParams, derive_kek, generate_data_key, wrap_key
+from metrics import timed
+
+# --- ROTACIÓN DE LA CLAVE DE DATOS CON RE-CIFRADO EN STREAMING ---
+# Con el cifrado de sobre, cambiar la contraseña maestra solo re-envuelve la
+# clave de datos (AuthManager.change_master_password). Este módulo es para el
+# caso contrario: sustituir la propia clave de datos (p. ej. si la antigua
+# pudo quedar expuesta, o en cuentas migradas cuya clave de datos aún es la
+# derivada de una contraseña anterior). Eso sí obliga a re-cifrar la bóveda,
+# y se hace por lotes, cada uno en su propia transacción, sin cargarla en
+# memoria ni bloquear la base de datos más que lo que tarda un lote.
+#
+# Seguridad ante caídas:
+#   * rekey_jobs guarda el trabajo pendiente: generación destino, la clave
+#     nueva envuelta con la antigua (para reanudar), la misma envuelta con la
+#     KEK (lo que acabará en credentials) y el último id procesado.
+#   * vault.key_generation indica con qué clave está cifrada cada fila; cada
+#     lote la actualiza junto con el marcador en la misma transacción.
+#   * credentials no cambia hasta el final: si el proceso cae a mitad, el
+#     inicio de sesión sigue desenvolviendo la clave antigua, que desenvuelve
+#     la nueva y permite terminar el trabajo.
+#   * Mientras haya un trabajo pendiente VaultManager no escribe en la bóveda
+#     del usuario, y después solo con la clave de la generación vigente (ver
+#     VaultManager._check_key): ninguna sesión con la clave antigua puede
+#     colar filas que el re-cifrado ya no vaya a ver.
+
+KEY_AAD = b"olesa:rekey:pending-key"
+
+
+@dataclass
+class RekeyProgress:
+    """Entradas re-cifradas, ilegibles (se dejan como estaban) y total del usuario."""
+
+    total: int = 0
+    done: int = 0
+    unreadable: int = 0
+
+
+class VaultRekeyer:
+    def __init__(self, db: Database, batch_size: int = 200):
+        self.db = db
+        self.batch_size = batch_size
+
+    def pending(self, user_id: int) -> bool:
+        """True si el usuario tiene una rotación de clave a medias."""
+        row = self.db.execute("SELECT 1 FROM rekey_jobs WHERE user_id = ?;", (user_id,), fetchone=True)
+        return row is not None
+
+    def target_generation(self, user_id: int) -> Optional[int]:
+        """Generación que tendrá la clave nueva de la rotación pendiente, o None si no hay."""
+        row = self.db.execute("SELECT target_generation FROM rekey_jobs WHERE user_id = ?;", (user_id,), fetchone=True)
+        return row[0] if row else None
+
+    def start(self, user_id: int, old_engine: EncryptionManager, password: str):
+        """
+        Prepara la rotación: genera la clave de datos nueva y la guarda envuelta
+        con la antigua y con la KEK de `password` (la contraseña actual, ya
+        verificada). Si ya había una rotación pendiente se conserva.
+        """
+        if self.pending(user_id):
+            return
+        row = self.db.execute("SELECT salt, kdf_params FROM credentials WHERE id = ?;", (user_id,), fetchone=True)
+        if row is None:
+            return
+        new_key = generate_data_key()
+        nonce = secrets.token_bytes(12)
+        pending_key = nonce + old_engine.aesgcm.encrypt(nonce, new_key, KEY_AAD + str(user_id).encode())
+        credential_key = wrap_key(derive_kek(password, row["salt"], KdfParams.from_json(row["kdf_params"])), new_key)
+        # credential_key vale para el salt leído: si otro proceso lo cambió
+        # mientras se derivaba la KEK, no se crea el trabajo
+        with self.db.transaction() as conn:
+            cur = conn.execute(
+                """INSERT INTO rekey_jobs (user_id, target_generation, password_hash, salt, wrapped_key, credential_key)
+                   SELECT id, key_generation + 1, password_hash, salt, ?, ? FROM credentials WHERE id = ? AND salt = ?;""",
+                (pending_key, credential_key, user_id, row["salt"]),
+            )
+        if not cur.rowcount:
+            raise RuntimeError("Las credenciales cambiaron al preparar la rotación de la clave.")
+
+    @timed("vault_rekey")
+    def run(
+        self,
+        user_id: int,
+        old_engine: EncryptionManager,
+        progress: Callable[[RekeyProgress], None] | None = None,
+    ) -> Optional[bytes]:
+        """
+        Re-cifra (o continúa re-cifrando) la bóveda y activa la clave nueva.
+        Devuelve la clave de datos nueva, o None si no había nada pendiente.
+        """
+        job = self.db.execute("SELECT * FROM rekey_jobs WHERE user_id = ?;", (user_id,), fetchone=True)
+        if job is None:
+            return None
+        wrapped = memoryview(job["wrapped_key"])
+        new_key = old_engine.aesgcm.decrypt(wrapped[:12], wrapped[12:], KEY_AAD + str(user_id).encode())
+        target = job["target_generation"]
+        old_vault = VaultManager(self.db, old_engine)
+        new_vault = VaultManager(self.db, EncryptionManager.from_key(new_key))
+
+        state = RekeyProgress(total=old_vault.count_entries(user_id))
+        state.done = self.db.execute(
+            "SELECT COUNT(*) FROM vault WHERE user_id = ? AND key_generation = ?;", (user_id, target), fetchone=True
+        )[0]
+        last_id = job["last_id"]
+        while True:
+            rows = self.db.execute(
+                f"""SELECT {VaultManager.ENTRY_COLUMNS}, previous_password FROM vault
+                    WHERE user_id = ? AND id > ? AND key_generation < ? ORDER BY id LIMIT ?;""",
+                (user_id, last_id, target, self.batch_size),
+                fetch=True,
+            )
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            updates, entries = [], []
+            for row in rows:
+                entry = old_vault._entry(row)
+                if DECRYPT_ERROR in (entry.site_name, entry.site_user, entry.site_password):
+                    state.unreadable += 1
+                    continue
+                sealed = new_vault._seal(user_id, entry.id, entry.site_name, entry.site_user, entry.site_password)
+                # La contraseña guardada por una rotación masiva también pasa a la clave nueva
+                previous = row["previous_password"]
+                if previous is not None:
+                    old_password = old_vault._open_previous(user_id, entry.id, previous)
+                    if old_password != DECRYPT_ERROR:
+                        previous = new_vault._seal_previous(user_id, entry.id, old_password)
+                updates.append((*sealed, previous, target, entry.id))
+                entries.append(entry)
+            # Filas, tokens de búsqueda (dependen de la clave) y marcador, juntos
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    """UPDATE vault SET header = ?, record = ?, previous_password = ?, site_name = X'', site_user = X'',
+                       site_password = X'', key_generation = ? WHERE id = ?;""",
+                    updates,
+                )
+                conn.executemany("DELETE FROM vault_search WHERE entry_id = ?;", [(e.id,) for e in entries])
+                for e in entries:
+                    new_vault._index_entry(conn, user_id, e.id, e.site_name, e.site_user)
+                conn.execute("UPDATE rekey_jobs SET last_id = ? WHERE user_id = ?;", (last_id, user_id))
+            state.done += len(entries)
+            if progress:
+                progress(state)
+
+        # Sin credential_key (trabajos creados antes del cifrado de sobre) la
+        # clave nueva es la KEK de la contraseña del trabajo y se adopta al
+        # iniciar sesión, como en cualquier cuenta antigua.
+        # Compare-and-swap: si otro run() ya terminó el trabajo no queda nada
+        # que hacer, y si las credenciales ya no son las del inicio del trabajo
+        # no se pisan (la transacción se deshace y el trabajo sigue pendiente).
+        with self.db.transaction() as conn:
+            if not conn.execute("DELETE FROM rekey_jobs WHERE user_id = ?;", (user_id,)).rowcount:
+                return new_key
+            # (los trabajos antiguos guardan el salt de la contraseña nueva, no el vigente)
+            expected_salt = job["salt"] if job["credential_key"] is not None else None
+            cur = conn.execute(
+                """UPDATE credentials SET password_hash = ?, salt = ?, key_generation = ?, wrapped_key = ?
+                   WHERE id = ? AND key_generation = ? AND (? IS NULL OR salt = ?);""",
+                (job["password_hash"], job["salt"], target, job["credential_key"],
+                 user_id, target - 1, expected_salt, expected_salt),
+            )
+            if not cur.rowcount:
+                raise RuntimeError("Las credenciales cambiaron durante la rotación de la clave.")
+        return new_key
+
+    def rotate_data_key(
+        self,
+        user_id: int,
+        old_engine: EncryptionManager,
+        password: str,
+        progress: Callable[[RekeyProgress], None] | None = None,
+    ) -> bytes:
+        """start + run. `old_engine` debe ser el de la clave de datos actual."""
+        self.start(user_id, old_engine, password)
+        return self.run(user_id, old_engine, progress)
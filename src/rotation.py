@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from database import DECRYPT_ERROR, Entry, VaultManager
+from dataset import shared_index
+from encryption import DEFAULT_POLICY, PasswordPolicy, generate_passwords
+from strength import estimate
+
+# --- ROTACIÓN MASIVA DE CONTRASEÑAS ---
+# Recorre la bóveda por páginas (cursor por id), elige las entradas que cumplen
+# los criterios, genera todas las contraseñas nuevas del lote de una vez y las
+# guarda re-cifradas en una transacción por lote.
+#
+# Reanudable: rotation_jobs guarda los criterios fijados al empezar (el corte
+# de fecha no se recalcula al reanudar, y las entradas creadas después de
+# empezar quedan fuera), el último id procesado y los contadores, y cada lote
+# lo actualiza en la misma transacción que las entradas. La contraseña
+# sustituida se conserva cifrada en la propia fila
+# (VaultManager.get_previous_password) por si el servicio aún no la cambió.
+
+
+@dataclass
+class RotationProgress:
+    """Entradas candidatas según SQL, revisadas, rotadas y omitidas (ilegibles)."""
+
+    total: int = 0
+    scanned: int = 0
+    rotated: int = 0
+    skipped: int = 0
+
+
+class VaultRotator:
+    """Sustituye por contraseñas generadas las entradas antiguas o débiles de un usuario."""
+
+    def __init__(self, vault: VaultManager, batch_size: int = 200, policy: PasswordPolicy = DEFAULT_POLICY):
+        self.vault = vault
+        self.db = vault.db
+        self.batch_size = batch_size
+        self.policy = policy
+
+    def _filter(self, updated_before: Optional[float], until_id: Optional[int] = None):
+        where, params = "", ()
+        if updated_before is not None:
+            where, params = " AND (updated_at IS NULL OR updated_at < ?)", (int(updated_before),)
+        if until_id is not None:
+            where, params = where + " AND id <= ?", (*params, until_id)
+        return where, params
+
+    def count_candidates(
+        self, user_id: int, updated_before: Optional[float] = None, after_id: int = 0, until_id: Optional[int] = None
+    ) -> int:
+        where, params = self._filter(updated_before, until_id)
+        row = self.db.execute(
+            f"SELECT COUNT(*) FROM vault WHERE user_id = ? AND id > ?{where};", (user_id, after_id, *params), fetchone=True
+        )
+        return row[0]
+
+    def pending(self, user_id: int) -> bool:
+        """True si el usuario tiene una rotación a medias."""
+        row = self.db.execute("SELECT 1 FROM rotation_jobs WHERE user_id = ?;", (user_id,), fetchone=True)
+        return row is not None
+
+    def start(self, user_id: int, updated_before: Optional[float] = None, max_score: Optional[int] = None):
+        """
+        Registra los criterios de la rotación y la última entrada existente.
+        Si ya había una rotación pendiente se conserva con sus criterios.
+        """
+        self.db.execute(
+            """INSERT OR IGNORE INTO rotation_jobs (user_id, until_id, updated_before, max_score)
+               VALUES (?, (SELECT COALESCE(MAX(id), 0) FROM vault WHERE user_id = ?), ?, ?);""",
+            (user_id, user_id, None if updated_before is None else int(updated_before), max_score),
+        )
+
+    def run(self, user_id: int, progress: Callable[[RotationProgress], None] | None = None) -> Optional[RotationProgress]:
+        """Rota (o continúa rotando) según el trabajo pendiente. None si no había ninguno."""
+        job = self.db.execute("SELECT * FROM rotation_jobs WHERE user_id = ?;", (user_id,), fetchone=True)
+        if job is None:
+            return None
+        updated_before, max_score = job["updated_before"], job["max_score"]
+        where, params = self._filter(updated_before, job["until_id"])
+        # Para decidir qué es débil se espera al índice de rockyou: aquí
+        # importa más no dejar ninguna filtrada que la latencia
+        index = shared_index() if max_score is not None else None
+        last_id = job["last_id"]
+        state = RotationProgress(scanned=job["scanned"], rotated=job["rotated"], skipped=job["skipped"])
+        state.total = state.scanned + self.count_candidates(user_id, updated_before, last_id, job["until_id"])
+        while True:
+            rows = self.db.execute(
+                f"SELECT {VaultManager.ENTRY_COLUMNS} FROM vault WHERE user_id = ? AND id > ?{where} ORDER BY id LIMIT ?;",
+                (user_id, last_id, *params, self.batch_size),
+                fetch=True,
+            )
+            if not rows:
+                break
+            selected = []
+            skipped = 0
+            for row in rows:
+                entry = self.vault._entry(row)
+                if DECRYPT_ERROR in (entry.site_name, entry.site_user, entry.site_password):
+                    skipped += 1
+                    continue
+                if max_score is None or estimate(entry.site_password, index).score <= max_score:
+                    selected.append(entry)
+            passwords = generate_passwords(len(selected), self.policy) if selected else []
+            # Entradas y marcador juntos; el marcador es además un compare-and-swap
+            # por si otro proceso está reanudando la misma rotación
+            with self.db.transaction() as conn:
+                cur = conn.execute(
+                    """UPDATE rotation_jobs SET last_id = ?, scanned = scanned + ?, rotated = rotated + ?,
+                       skipped = skipped + ? WHERE user_id = ? AND last_id = ?;""",
+                    (rows[-1]["id"], len(rows), len(selected), skipped, user_id, last_id),
+                )
+                if not cur.rowcount:
+                    raise RuntimeError("Otra rotación de la misma bóveda avanzó a la vez.")
+                if selected:
+                    self.vault.update_many(conn, user_id, [
+                        Entry(id=e.id, site_name=e.site_name, site_user=e.site_user, site_password=p)
+                        for e, p in zip(selected, passwords)
+                    ], previous=selected)
+            last_id = rows[-1]["id"]
+            state.scanned += len(rows)
+            state.rotated += len(selected)
+            state.skipped += skipped
+            if progress:
+                progress(state)
+        self.db.execute("DELETE FROM rotation_jobs WHERE user_id = ? AND last_id = ?;", (user_id, last_id))
+        return state
+
+    def rotate(
+        self,
+        user_id: int,
+        updated_before: Optional[float] = None,
+        max_score: Optional[int] = None,
+        progress: Callable[[RotationProgress], None] | None = None,
+    ) -> RotationProgress:
+        """
+        start + run. Rota las entradas no modificadas desde `updated_before`
+        (segundos Unix) y/o cuya contraseña puntúa `max_score` o menos (0-4).
+        Sin ningún criterio rota la bóveda entera.
+        """
+        self.start(user_id, updated_before, max_score)
+        return self.run(user_id, progress) or RotationProgress()
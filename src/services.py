@@ -0,0 +1,448 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import agent
+from database import AuthManager, Database, EntrySummary, User, VaultManager
+from encryption import EncryptionManager, KdfParams
+from kdf import KeyDerivationService, SessionKeyCache
+from metrics import timed
+from rekey import RekeyProgress, VaultRekeyer
+
+# --- CAPA DE SERVICIOS DEL PROCESO (MODO SERVIDOR) ---
+# Todas las sesiones (web, API, CLI) comparten una sola instancia de Services:
+#   * una Database, cuyas conexiones van por hilo y no por sesión;
+#   * el pool de procesos del KDF, acotado a unos pocos trabajadores;
+#   * las claves de las sesiones autenticadas y, por sesión, las páginas ya
+#     descifradas del listado, con un tope de memoria global: al superarlo se
+#     vacían las cachés de las sesiones usadas hace más tiempo;
+#   * control de admisión: con el máximo de sesiones abiertas o demasiados
+#     desbloqueos en cola se rechaza el inicio de sesión con ServerBusy, en
+#     lugar de encolar trabajo que ya no se va a atender a tiempo.
+
+DB_PATH              = os.getenv("OLESA_DB", "passmanager.db")
+MAX_SESSIONS         = int(os.getenv("OLESA_MAX_SESSIONS", "500"))
+MAX_PENDING_UNLOCKS  = int(os.getenv("OLESA_MAX_PENDING_UNLOCKS", "32"))
+VAULT_CACHE_MB       = float(os.getenv("OLESA_VAULT_CACHE_MB", "64"))
+VAULT_CACHE_TTL      = float(os.getenv("OLESA_VAULT_CACHE_TTL", "60"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("OLESA_SESSION_IDLE_TIMEOUT", str(15 * 60)))
+KDF_WORKERS          = int(os.getenv("OLESA_KDF_WORKERS", "0")) or None
+
+
+class ServerBusy(Exception):
+    """No hay capacidad para otra sesión o desbloqueo; el cliente debe reintentar más tarde."""
+
+
+class CachedVault(VaultManager):
+    """
+    VaultManager de una sesión que guarda las páginas del listado ya
+    descifradas (solo servicio y usuario, nunca contraseñas). Cualquier
+    escritura del mismo usuario a través de Services las invalida; el TTL
+    acota lo desfasadas que pueden quedar ante escrituras de otros procesos.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        engine: EncryptionManager,
+        cache: "VaultCache",
+        session_id: str,
+        user_id: int,
+        generation: Optional[int] = None,
+    ):
+        super().__init__(db, engine, generation)
+        self._cache = cache
+        self.session_id = session_id
+        self.user_id = user_id
+        self._pages: Dict[Tuple[int, int], Tuple[float, List[EntrySummary]]] = {}
+        self._count: Optional[Tuple[float, int]] = None
+        self.size = 0
+
+    def clear(self):
+        self._pages.clear()
+        self._count = None
+        self._cache._resize(self, 0)
+
+    def list_page(self, user_id: int, after_id: int = 0, limit: int = VaultManager.PAGE_SIZE) -> List[EntrySummary]:
+        if user_id != self.user_id:
+            return super().list_page(user_id, after_id, limit)
+        cached = self._pages.get((after_id, limit))
+        if cached is not None and time.monotonic() - cached[0] < self._cache.ttl:
+            self._cache._touch(self)
+            return list(cached[1])
+        page = super().list_page(user_id, after_id, limit)
+        old_size = _summaries_size(cached[1]) if cached else 0
+        self._pages[(after_id, limit)] = (time.monotonic(), page)
+        self._cache._resize(self, self.size - old_size + _summaries_size(page))
+        return list(page)
+
+    def count_entries(self, user_id: int) -> int:
+        if user_id != self.user_id:
+            return super().count_entries(user_id)
+        if self._count is not None and time.monotonic() - self._count[0] < self._cache.ttl:
+            return self._count[1]
+        count = super().count_entries(user_id)
+        self._count = (time.monotonic(), count)
+        return count
+
+    # Escrituras: se invalidan las cachés de todas las sesiones del usuario
+    def add(self, user_id, *args, **kwargs):
+        try:
+            return super().add(user_id, *args, **kwargs)
+        finally:
+            self._cache.invalidate_user(user_id)
+
+    def add_many(self, conn, user_id, *args, **kwargs):
+        try:
+            return super().add_many(conn, user_id, *args, **kwargs)
+        finally:
+            self._cache.invalidate_user(user_id)
+
+    def update(self, user_id, *args, **kwargs):
+        try:
+            return super().update(user_id, *args, **kwargs)
+        finally:
+            self._cache.invalidate_user(user_id)
+
+    def update_many(self, conn, user_id, *args, **kwargs):
+        try:
+            return super().update_many(conn, user_id, *args, **kwargs)
+        finally:
+            self._cache.invalidate_user(user_id)
+
+    def delete(self, user_id, *args, **kwargs):
+        try:
+            return super().delete(user_id, *args, **kwargs)
+        finally:
+            self._cache.invalidate_user(user_id)
+
+    def delete_many(self, conn, user_id, *args, **kwargs):
+        try:
+            return super().delete_many(conn, user_id, *args, **kwargs)
+        finally:
+            self._cache.invalidate_user(user_id)
+
+
+def _summaries_size(page: List[EntrySummary]) -> int:
+    """Estimación de los bytes que ocupa una página de resúmenes."""
+    return sys.getsizeof(page) + sum(
+        sys.getsizeof(e) + sys.getsizeof(e.site_name) + sys.getsizeof(e.site_user) for e in page
+    )
+
+
+class VaultCache:
+    """Bóvedas en caché de cada sesión, con tope de memoria global y expulsión LRU."""
+
+    def __init__(self, max_bytes: int, ttl: float = VAULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._vaults: OrderedDict[str, CachedVault] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    def get(
+        self, session_id: str, db: Database, engine: EncryptionManager, user_id: int, generation: Optional[int] = None
+    ) -> CachedVault:
+        with self._lock:
+            vault = self._vaults.get(session_id)
+            # Clave nueva (p. ej. tras rotarla) o usuario distinto: bóveda nueva
+            if vault is None or vault.engine is not engine or vault.user_id != user_id or vault.generation != generation:
+                self.drop(session_id)
+                vault = CachedVault(db, engine, self, session_id, user_id, generation)
+                self._vaults[session_id] = vault
+            self._vaults.move_to_end(session_id)
+            return vault
+
+    def drop(self, session_id: str):
+        with self._lock:
+            vault = self._vaults.pop(session_id, None)
+            if vault is not None:
+                self._bytes -= vault.size
+                vault.size = 0
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for vault in [v for v in self._vaults.values() if v.user_id == user_id]:
+                vault.clear()
+
+    def _touch(self, vault: CachedVault):
+        with self._lock:
+            if self._vaults.get(vault.session_id) is vault:
+                self._vaults.move_to_end(vault.session_id)
+
+    def _resize(self, vault: CachedVault, size: int):
+        with self._lock:
+            if self._vaults.get(vault.session_id) is not vault:
+                # Bóveda ya sustituida o cerrada: no guarda nada más
+                vault._pages.clear()
+                vault._count = None
+                return
+            self._bytes += size - vault.size
+            vault.size = size
+            self._vaults.move_to_end(vault.session_id)
+            # Se vacían las páginas de las sesiones menos usadas (la actual es
+            # la última); la sesión sigue abierta y vuelve a consultar SQLite
+            for other in list(self._vaults.values()):
+                if self._bytes <= self.max_bytes:
+                    break
+                if other.size:
+                    other._pages.clear()
+                    other._count = None
+                    self._bytes -= other.size
+                    other.size = 0
+
+
+class Services:
+    """Estado compartido por todas las sesiones del proceso."""
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        max_sessions: int = MAX_SESSIONS,
+        max_pending_unlocks: int = MAX_PENDING_UNLOCKS,
+        cache_bytes: int = int(VAULT_CACHE_MB * 1024 * 1024),
+        kdf_workers: Optional[int] = KDF_WORKERS,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+    ):
+        self.db = Database(db_path)
+        self.db_path = os.path.abspath(db_path)
+        self.auth = AuthManager(self.db)
+        self.kdf = KeyDerivationService(kdf_workers)
+        self.keys = SessionKeyCache(idle_timeout, on_evict=self._forget)
+        self.vaults = VaultCache(cache_bytes)
+        self.max_sessions = max_sessions
+        self.max_pending_unlocks = max_pending_unlocks
+        self._users: Dict[str, User] = {}
+        # Generación de la clave de datos de cada sesión (ver VaultManager._check_key)
+        self._generations: Dict[str, int] = {}
+        self._pending_unlocks = 0
+        self._admitting: Set[str] = set()  # sesiones con el inicio de sesión en curso
+        self._lock = threading.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+
+    # ── admisión ──────────────────────────────────────────────────────────────
+    @contextmanager
+    def _admit(self, session_id: str):
+        """
+        Reserva el hueco de la sesión mientras dura su inicio de sesión. La
+        cuenta y la reserva van bajo el mismo lock: dos inicios simultáneos no
+        pueden ocupar a la vez el último hueco.
+        """
+        with self._lock:
+            if self.keys.get(session_id) is None and session_id not in self._admitting:
+                if len(self.keys) + len(self._admitting) >= self.max_sessions:
+                    self.keys.purge_expired()
+                    if len(self.keys) + len(self._admitting) >= self.max_sessions:
+                        raise ServerBusy("Se ha alcanzado el máximo de sesiones abiertas.")
+                self._admitting.add(session_id)
+                reserved = True
+            else:
+                reserved = False
+        try:
+            yield
+        finally:
+            # Para entonces la sesión ya cuenta en self.keys (o no se abrió)
+            if reserved:
+                with self._lock:
+                    self._admitting.discard(session_id)
+
+    @contextmanager
+    def _unlock_slot(self):
+        with self._lock:
+            if self._pending_unlocks >= self.max_pending_unlocks:
+                raise ServerBusy("Demasiados inicios de sesión en curso.")
+            self._pending_unlocks += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pending_unlocks -= 1
+
+    def _background(self, coro):
+        # Se guarda la referencia: asyncio solo guarda referencias débiles a las tareas
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # ── cuentas ───────────────────────────────────────────────────────────────
+    def has_users(self) -> bool:
+        try:
+            return self.db.execute("SELECT 1 FROM credentials LIMIT 1;", fetchone=True) is not None
+        except Exception:
+            return False
+
+    async def register(self, username: str, password: str, two_fa_contact: str) -> int:
+        """bcrypt + KEK para envolver la clave de datos, fuera del bucle de eventos."""
+        target = await self.kdf.target_params_async()
+        return await asyncio.to_thread(self.auth.register_user, username, password, two_fa_contact, target)
+
+    async def unlock(self, username: str, password: str):
+        """(fila de credenciales, clave de datos); la clave es None si la contraseña no es correcta."""
+        row = await asyncio.to_thread(self.auth.get_credentials, username)
+        if row is None:
+            return None, None
+        with self._unlock_slot():
+            try:
+                key = await self.kdf.unlock_async(
+                    password, row["password_hash"], row["salt"], row["wrapped_key"], row["kdf_params"]
+                )
+            except Exception as ex:
+                logging.error(f"Error en login: {ex}")
+                key = None
+        return row, key
+
+    @timed("session_login")
+    async def login(
+        self,
+        session_id: str,
+        username: str,
+        password: str,
+        notify: Callable[[str], None] | None = None,
+    ) -> Optional[User]:
+        """
+        Abre la sesión: verifica la contraseña en el pool del KDF, guarda la
+        clave, adopta las cuentas anteriores al cifrado de sobre, termina las
+        rotaciones de clave pendientes y, en segundo plano, actualiza los
+        parámetros del KDF. None si las credenciales no son correctas.
+        """
+        with self._admit(session_id):
+            row, key = await self.unlock(username, password)
+            if not key:
+                return None
+            engine = self.keys.put(session_id, key)
+        user = User(id=row["id"], username=username, salt=row["salt"])
+        generation = row["key_generation"]
+        # Lo que se ha desenvuelto: la actualización del KDF solo se escribe si
+        # las credenciales siguen siendo estas (ver AuthManager.CAS_GUARD)
+        expected_wrapped = row["wrapped_key"]
+        try:
+            if row["wrapped_key"] is None:
+                expected_wrapped = await asyncio.to_thread(self.auth.adopt_legacy_key, user.id, key)
+            # Una rotación de la clave de datos quedó a medias: se termina
+            # antes de abrir la bóveda (la clave vigente aún es la antigua)
+            rekeyer = VaultRekeyer(self.db)
+            target = rekeyer.target_generation(user.id)
+            if target is not None:
+                if notify:
+                    notify("Terminando la rotación de la clave de la bóveda...")
+                self.evict_user(user.id, keep=session_id)
+                key = await asyncio.to_thread(rekeyer.run, user.id, engine)
+                generation = target
+                self.keys.put(session_id, key)
+                await asyncio.to_thread(self.lock_agent, username)
+                expected_wrapped = None  # credenciales nuevas: se actualizará en el próximo inicio de sesión
+        except Exception:
+            self.logout(session_id)
+            raise
+        self._users[session_id] = user
+        self._generations[session_id] = generation
+        if expected_wrapped is not None:
+            self._background(self._upgrade_kdf(user.id, password, key, row["kdf_params"], row["salt"], expected_wrapped))
+        return user
+
+    async def _upgrade_kdf(
+        self, user_id: int, password: str, key: bytes, kdf_params: Optional[str], expected_salt: str, expected_wrapped: bytes
+    ):
+        """Parámetros del KDF por debajo de los vigentes: se re-envuelve la clave de datos."""
+        try:
+            target = await self.kdf.target_params_async()
+            if not KdfParams.from_json(kdf_params).needs_upgrade(target):
+                return
+            salt, wrapped = await self.kdf.rewrap_async(password, key, target)
+            stored = await asyncio.to_thread(
+                self.auth.store_wrapped_key, user_id, salt, wrapped, target, expected_salt, expected_wrapped
+            )
+            if not stored:
+                # La contraseña o la clave de datos cambiaron mientras tanto
+                logging.info(f"KDF del usuario {user_id} sin actualizar: las credenciales han cambiado")
+                return
+            logging.info(f"KDF del usuario {user_id} actualizado a {target.to_json()}")
+        except Exception as ex:
+            # Se reintenta en el próximo inicio de sesión
+            logging.error(f"Error actualizando los parámetros del KDF: {ex}")
+
+    def lock_agent(self, username: str):
+        """Tras cambiar la contraseña o la clave de datos: el agente de la CLI olvida la clave de la cuenta."""
+        agent.lock(self.db_path, username)
+
+    def set_key(self, session_id: str, key: bytes, generation: int) -> EncryptionManager:
+        """Sustituye la clave de una sesión ya abierta (tras rotar la clave de datos)."""
+        self._generations[session_id] = generation
+        return self.keys.put(session_id, key)
+
+    def evict_user(self, user_id: int, keep: Optional[str] = None):
+        """Cierra todas las sesiones web y tokens de la API del usuario, salvo `keep`."""
+        for session_id, user in list(self._users.items()):
+            if user.id == user_id and session_id != keep:
+                self.logout(session_id)
+
+    def rotate_data_key(
+        self, session_id: str, password: str, progress: Callable[[RekeyProgress], None] | None = None
+    ) -> bytes:
+        """
+        Genera una clave de datos nueva para el usuario de la sesión, re-cifra su
+        bóveda y la activa en la sesión. Las demás sesiones del usuario se
+        cierran al empezar: su clave deja de valer al terminar, y hasta entonces
+        no pueden escribir (ver VaultManager._check_key). Se ejecuta en un hilo.
+        """
+        engine = self.keys.get(session_id)
+        user = self._users.get(session_id)
+        if engine is None or user is None:
+            raise RuntimeError("La sesión ha caducado.")
+        rekeyer = VaultRekeyer(self.db)
+        rekeyer.start(user.id, engine, password)
+        self.evict_user(user.id, keep=session_id)
+        target = rekeyer.target_generation(user.id)
+        key = rekeyer.run(user.id, engine, progress)
+        self.set_key(session_id, key, target)
+        self.lock_agent(user.username)
+        return key
+
+    def user(self, session_id: str) -> Optional[User]:
+        return self._users.get(session_id) if self.keys.get(session_id) is not None else None
+
+    def vault(self, session_id: str) -> Optional[CachedVault]:
+        """Bóveda de la sesión, o None si no hay sesión o ha caducado por inactividad."""
+        engine = self.keys.get(session_id)
+        user = self._users.get(session_id)
+        if engine is None or user is None:
+            self.logout(session_id)
+            return None
+        return self.vaults.get(session_id, self.db, engine, user.id, self._generations.get(session_id))
+
+    def _forget(self, session_id: str):
+        # Sesión caducada o cerrada: fuera su usuario y su caché de la bóveda
+        self.vaults.drop(session_id)
+        self._users.pop(session_id, None)
+        self._generations.pop(session_id, None)
+
+    def logout(self, session_id: str):
+        self.keys.evict(session_id)
+        self._forget(session_id)
+
+    def shutdown(self):
+        self.kdf.shutdown()
+        self.db.close_all()
+
+
+_services: Optional[Services] = None
+_services_lock = threading.Lock()
+
+
+def get_services() -> Services:
+    """Instancia única del proceso; se crea en el primer uso."""
+    global _services
+    with _services_lock:
+        if _services is None:
+            _services = Services()
+        return _services
@@ -0,0 +1,398 @@
+import datetime
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from dataset import DatasetIndex, shared_index
+from metrics import timed
+
+# --- ESTIMADOR LOCAL DE FORTALEZA (ESTILO ZXCVBN) ---
+# Busca en la contraseña los patrones que un atacante prueba primero
+# (palabras del diccionario filtrado, l33t, recorridos de teclado, secuencias,
+# repeticiones, fechas y años), estima cuántos intentos necesita cada uno y
+# elige la segmentación más barata. Todo en proceso y en menos de 1 ms, así
+# que el indicador puede actualizarse en cada pulsación sin llamar al LLM.
+
+MAX_LENGTH = 64        # diccionario y fechas; el resto de patrones mira el doble y lo que siga no suma
+MIN_WORD = 4           # longitud mínima de una palabra del diccionario
+MAX_WORD = 10          # longitud máxima de las subcadenas consultadas en el índice
+MIN_YEAR_SPACE = 20
+
+# Las ~60 contraseñas más usadas; sirven cuando no hay índice de rockyou.
+COMMON_PASSWORDS = (
+    "123456", "12345", "123456789", "password", "iloveyou", "princess", "1234567",
+    "rockyou", "12345678", "abc123", "nicole", "daniel", "babygirl", "monkey",
+    "lovely", "jessica", "654321", "michael", "ashley", "qwerty", "111111",
+    "iloveu", "000000", "michelle", "tigger", "sunshine", "chocolate", "password1",
+    "soccer", "anthony", "friends", "butterfly", "purple", "angel", "jordan",
+    "liverpool", "justin", "loveme", "fuckyou", "123123", "football", "secret",
+    "andrea", "carlos", "jennifer", "joshua", "bubbles", "1234567890", "superman",
+    "hannah", "amanda", "loveyou", "pretty", "basketball", "andrew", "angels",
+    "tweety", "flower", "playboy", "hello", "admin", "contraseña", "hola", "amor",
+    "teamo", "futbol", "barcelona", "madrid", "dragon", "master", "welcome",
+)
+_COMMON_RANK = {word: rank for rank, word in enumerate(COMMON_PASSWORDS)}
+
+L33T = str.maketrans({"4": "a", "@": "a", "8": "b", "(": "c", "3": "e", "6": "g",
+                      "1": "i", "!": "i", "|": "i", "0": "o", "$": "s", "5": "s",
+                      "7": "t", "+": "t", "2": "z"})
+
+# Teclado QWERTY: filas sin y con mayúsculas. Cada fila está desplazada media
+# tecla a la derecha respecto a la anterior.
+_ROWS = ("`1234567890-=", "qwertyuiop[]\\", "asdfghjkl;'", "zxcvbnm,./")
+_SHIFTED = ('~!@#$%^&*()_+', "QWERTYUIOP{}|", 'ASDFGHJKL:"', "ZXCVBNM<>?")
+_KEY_POS: Dict[str, Tuple[int, int]] = {}
+for _r, (_row, _shift) in enumerate(zip(_ROWS, _SHIFTED)):
+    for _c, (_k, _s) in enumerate(zip(_row, _shift)):
+        _KEY_POS[_k] = _KEY_POS[_s] = (_r, _c)
+_SHIFTED_KEYS = frozenset("".join(_SHIFTED))
+_NEIGHBOUR_STEPS = ((0, -1), (0, 1), (-1, 0), (-1, 1), (1, -1), (1, 0))
+_KEYBOARD_STARTS = len(_KEY_POS) // 2
+_KEYBOARD_DEGREE = 4.6  # media de vecinos por tecla
+
+_DATE_SEP = re.compile(r"(\d{1,4})([\s/\\_.-])(\d{1,2})\2(\d{1,4})")
+_DIGITS = re.compile(r"\d{6}|\d{8}")
+_YEAR = re.compile(r"19\d\d|20\d\d")
+
+# Intentos por segundo de cada escenario de ataque
+ATTACK_RATES = {
+    "online_throttled": 100 / 3600,
+    "online": 10,
+    "offline_slow_hash": 1e4,
+    "offline_fast_hash": 1e10,
+}
+
+SCORE_LABELS = ("Muy debil", "Debil", "Regular", "Buena", "Fuerte")
+
+_WARNINGS = {
+    "dictionary": "Aparece en filtraciones de contraseñas.",
+    "top": "Es una de las contraseñas más usadas.",
+    "spatial": "Los recorridos de teclado como 'qwerty' son fáciles de adivinar.",
+    "sequence": "Las secuencias como 'abc' o '6543' son fáciles de adivinar.",
+    "repeat": "Las repeticiones como 'aaa' o 'abcabc' son fáciles de adivinar.",
+    "date": "Las fechas y los años son fáciles de adivinar.",
+}
+
+
+@dataclass(frozen=True)
+class Match:
+    pattern: str
+    i: int
+    j: int           # posición final, incluida
+    token: str
+    guesses: float
+    rank: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class StrengthEstimate:
+    guesses: float
+    entropy_bits: float
+    score: int                       # 0 (muy débil) a 4 (fuerte)
+    crack_time_seconds: Dict[str, float]
+    crack_time_display: str          # escenario offline con hash lento
+    warning: str
+    sequence: Tuple[Match, ...]
+
+    @property
+    def label(self) -> str:
+        return SCORE_LABELS[self.score]
+
+
+# ── patrones ──────────────────────────────────────────────────────────────────
+
+def _uppercase_variations(word: str) -> float:
+    if word.islower() or not any(c.isalpha() for c in word):
+        return 1
+    if word.isupper() or (word[0].isupper() and word[1:].islower()) or (word[-1].isupper() and word[:-1].islower()):
+        return 2
+    upper = sum(c.isupper() for c in word)
+    lower = sum(c.islower() for c in word)
+    return sum(math.comb(upper + lower, k) for k in range(1, min(upper, lower) + 1))
+
+
+def _l33t_variations(token: str) -> float:
+    subs = sum(1 for c in token if c in "4@8(361!|0$57+2")
+    return max(2, 2 ** subs) if subs else 1
+
+
+def _rank(index: Optional[DatasetIndex], word: str, memo: Dict[str, Optional[int]]) -> Optional[int]:
+    # La memoria es de una sola llamada: una caché global guardaría trozos de
+    # contraseñas en claro durante toda la vida del proceso
+    if word not in memo:
+        rank = _COMMON_RANK.get(word)
+        if rank is None and index is not None:
+            rank = index.rank(word)
+        memo[word] = rank
+    return memo[word]
+
+
+def _dictionary_matches(password: str, index: Optional[DatasetIndex]) -> List[Match]:
+    matches = []
+    memo: Dict[str, Optional[int]] = {}
+    lower = password.lower()
+    unleet = lower.translate(L33T)
+    n = len(password)
+    for i in range(n):
+        for j in range(i + MIN_WORD - 1, min(n, i + MAX_WORD)):
+            word = lower[i:j + 1]
+            candidates = [(word, 1)]
+            if unleet[i:j + 1] != word and not word.isdigit():
+                candidates.append((unleet[i:j + 1], _l33t_variations(word)))
+            for candidate, l33t in candidates:
+                rank = _rank(index, candidate, memo)
+                if rank is not None:
+                    token = password[i:j + 1]
+                    guesses = (rank + 1) * _uppercase_variations(token) * l33t
+                    matches.append(Match("dictionary", i, j, token, guesses, rank))
+                    break
+    if n > MAX_WORD:
+        rank = _rank(index, lower, memo)
+        if rank is not None:
+            matches.append(Match("dictionary", 0, n - 1, password, rank + 1, rank))
+    return matches
+
+
+def _spatial_matches(password: str) -> List[Match]:
+    matches = []
+    n = len(password)
+    i = 0
+    while i < n - 2:
+        j, turns, direction = i, 0, None
+        while j + 1 < n and password[j] in _KEY_POS and password[j + 1] in _KEY_POS:
+            (r1, c1), (r2, c2) = _KEY_POS[password[j]], _KEY_POS[password[j + 1]]
+            step = (r2 - r1, c2 - c1)
+            if step not in _NEIGHBOUR_STEPS:
+                break
+            if step != direction:
+                turns += 1
+                direction = step
+            j += 1
+        length = j - i + 1
+        if length >= 3:
+            guesses = 0.0
+            for k in range(2, length + 1):
+                for t in range(1, min(turns, k - 1) + 1):
+                    guesses += math.comb(k - 1, t - 1) * _KEYBOARD_STARTS * _KEYBOARD_DEGREE ** t
+            token = password[i:j + 1]
+            shifted = sum(c in _SHIFTED_KEYS for c in token)
+            if shifted and shifted < length:
+                guesses *= sum(math.comb(length, k) for k in range(1, min(shifted, length - shifted) + 1))
+            elif shifted:
+                guesses *= 2
+            matches.append(Match("spatial", i, j, token, guesses))
+            i = j
+        else:
+            i += 1
+    return matches
+
+
+def _sequence_matches(password: str) -> List[Match]:
+    matches = []
+    n = len(password)
+    i = 0
+    while i < n - 2:
+        delta = ord(password[i + 1]) - ord(password[i])
+        j = i + 1
+        if 0 < abs(delta) <= 5:
+            while j + 1 < n and ord(password[j + 1]) - ord(password[j]) == delta:
+                j += 1
+        if j - i + 1 >= 3:
+            token = password[i:j + 1]
+            first = token[0]
+            if first in "aAzZ019":
+                base = 4
+            elif first.isdigit():
+                base = 10
+            else:
+                base = 26
+            guesses = base * len(token) * (1 if delta > 0 else 2)
+            matches.append(Match("sequence", i, j, token, guesses))
+            i = j
+        else:
+            i += 1
+    return matches
+
+
+_REPEAT_GREEDY = re.compile(r"(.+)\1+")
+_REPEAT_LAZY = re.compile(r"(.+?)\1+")
+_REPEAT_BASE = re.compile(r"^(.+?)\1+$")
+
+
+def _repeat_matches(password: str, index: Optional[DatasetIndex]) -> List[Match]:
+    matches = []
+    pos = 0
+    while pos < len(password):
+        greedy = _REPEAT_GREEDY.search(password, pos)
+        if greedy is None:
+            break
+        lazy = _REPEAT_LAZY.search(password, pos)
+        # "aabaab": la versión codiciosa ve el bloque "aab"; en "aaaa" la
+        # perezosa ve "a", que es la base más corta
+        if len(greedy.group(0)) > len(lazy.group(0)):
+            m, base = greedy, _REPEAT_BASE.match(greedy.group(0)).group(1)
+        else:
+            m, base = lazy, lazy.group(1)
+        count = len(m.group(0)) // len(base)
+        base_guesses = estimate(base, index, _nested=True).guesses if len(base) > 1 else 10
+        matches.append(Match("repeat", m.start(), m.end() - 1, m.group(0), base_guesses * count))
+        pos = m.end()
+    return matches
+
+
+def _reference_year() -> int:
+    return datetime.date.today().year
+
+
+def _valid_date(day: int, month: int, year: int) -> Optional[int]:
+    if year < 100:
+        year += 2000 if year <= _reference_year() % 100 else 1900
+    if 1 <= month <= 12 and 1 <= day <= 31 and 1900 <= year <= 2050:
+        return year
+    return None
+
+
+def _date_guesses(year: int, separator: bool) -> float:
+    return 365 * max(abs(year - _reference_year()), MIN_YEAR_SPACE) * (4 if separator else 1)
+
+
+def _date_matches(password: str) -> List[Match]:
+    matches = []
+    for m in _DATE_SEP.finditer(password):
+        a, b, c = int(m.group(1)), int(m.group(3)), int(m.group(4))
+        for day, month, year in ((a, b, c), (b, a, c), (c, b, a)):
+            full = _valid_date(day, month, year)
+            if full:
+                matches.append(Match("date", m.start(), m.end() - 1, m.group(0), _date_guesses(full, True)))
+                break
+    for i in range(len(password)):
+        for size in (6, 8):
+            token = password[i:i + size]
+            if len(token) != size or not _DIGITS.fullmatch(token):
+                continue
+            y = 4 if size == 8 else 2
+            layouts = ((token[:2], token[2:4], token[4:]), (token[2:4], token[:2], token[4:]),
+                       (token[-2:], token[-4:-2], token[:y]))
+            for day, month, year in layouts:
+                full = _valid_date(int(day), int(month), int(year))
+                if full:
+                    matches.append(Match("date", i, i + size - 1, token, _date_guesses(full, False)))
+                    break
+    for m in _YEAR.finditer(password):
+        year = int(m.group(0))
+        matches.append(Match("date", m.start(), m.end() - 1, m.group(0),
+                             max(abs(year - _reference_year()), MIN_YEAR_SPACE)))
+    return matches
+
+
+# ── búsqueda de la segmentación más barata ────────────────────────────────────
+
+def _cardinality(password: str) -> int:
+    size = 0
+    if any(c.islower() for c in password):
+        size += 26
+    if any(c.isupper() for c in password):
+        size += 26
+    if any(c.isdigit() for c in password):
+        size += 10
+    if any(not c.isalnum() and c.isascii() for c in password):
+        size += 33
+    if any(not c.isascii() for c in password):
+        size += 100
+    return size or 10
+
+
+def _minimum_guesses(password: str, matches: List[Match]) -> Tuple[float, Tuple[Match, ...]]:
+    """
+    Programación dinámica en escala logarítmica: cada posición se cubre con un
+    patrón o con un carácter de fuerza bruta, y cada patrón adicional añade la
+    penalización del orden en que el atacante los combina.
+    """
+    n = len(password)
+    brute = math.log2(_cardinality(password))
+    by_end: Dict[int, List[Match]] = {}
+    for m in matches:
+        by_end.setdefault(m.j, []).append(m)
+    # best[k] = (bits, número de patrones, segmentación) para password[:k]
+    best: List[Tuple[float, int, Tuple[Match, ...]]] = [(0.0, 0, ())] + [(math.inf, 0, ())] * n
+    for k in range(1, n + 1):
+        bits, count, seq = best[k - 1]
+        if seq and seq[-1].pattern == "bruteforce" and seq[-1].j == k - 2:
+            prev = seq[-1]
+            token = password[prev.i:k]
+            candidate = (bits + brute, count, seq[:-1] + (Match("bruteforce", prev.i, k - 1, token, 0),))
+        else:
+            candidate = (bits + brute + math.log2(count + 1), count + 1,
+                         seq + (Match("bruteforce", k - 1, k - 1, password[k - 1], 0),))
+        for m in by_end.get(k - 1, ()):
+            b, c, s = best[m.i]
+            cost = b + math.log2(max(m.guesses, 1)) + math.log2(c + 1)
+            if cost < candidate[0]:
+                candidate = (cost, c + 1, s + (m,))
+        best[k] = candidate
+    bits, _, seq = best[n]
+    seq = tuple(Match(m.pattern, m.i, m.j, m.token, _cardinality(password) ** len(m.token))
+                if m.pattern == "bruteforce" else m for m in seq)
+    return 2 ** bits, seq
+
+
+def _display_time(seconds: float) -> str:
+    if seconds < 1:
+        return "menos de un segundo"
+    for unit, size in (("segundos", 60), ("minutos", 60), ("horas", 24), ("días", 30), ("meses", 12)):
+        if seconds < size:
+            return f"{int(seconds)} {unit}"
+        seconds /= size
+    if seconds < 100:
+        return f"{int(seconds)} años"
+    return "siglos"
+
+
+def _score(guesses: float) -> int:
+    for score, limit in enumerate((1e3, 1e6, 1e8, 1e10)):
+        if guesses < limit + 5:
+            return score
+    return 4
+
+
+def _warning(score: int, sequence: Tuple[Match, ...]) -> str:
+    if score > 2 or not sequence:
+        return ""
+    worst = max((m for m in sequence if m.pattern != "bruteforce"), key=lambda m: len(m.token), default=None)
+    if worst is None:
+        return ""
+    if worst.pattern == "dictionary" and worst.rank is not None and worst.rank < 1000 and len(sequence) == 1:
+        return _WARNINGS["top"]
+    return _WARNINGS[worst.pattern]
+
+
+@timed("strength_estimate")
+def estimate(password: str, index: Optional[DatasetIndex] = None, _nested: bool = False) -> StrengthEstimate:
+    """
+    Estima cuántos intentos necesita un atacante para adivinar la contraseña.
+    Sin índice explícito usa el de rockyou compartido, sin esperar a que se abra.
+    """
+    if index is None and not _nested:
+        index = shared_index(wait=False)
+    # Las búsquedas caras (diccionario, fechas) solo en la cabeza; repeticiones,
+    # secuencias y teclado en una ventana del doble. Pasado eso no se suma
+    # nada: contar el resto como fuerza bruta daría "fuerte" a 'a' * 70.
+    head, window = password[:MAX_LENGTH], password[:2 * MAX_LENGTH]
+    matches = (_dictionary_matches(head, index) + _date_matches(head)
+               + _spatial_matches(window) + _sequence_matches(window))
+    if not _nested:
+        matches += _repeat_matches(window, index)
+    guesses, sequence = _minimum_guesses(window, matches) if window else (1.0, ())
+    guesses = max(guesses, 1.0)
+    score = _score(guesses)
+    crack_times = {name: guesses / rate for name, rate in ATTACK_RATES.items()}
+    return StrengthEstimate(
+        guesses=guesses,
+        entropy_bits=math.log2(guesses),
+        score=score,
+        crack_time_seconds=crack_times,
+        crack_time_display=_display_time(crack_times["offline_slow_hash"]),
+        warning=_warning(score, sequence),
+        sequence=sequence,
+    )
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos de la aplicación están en src/ y se importan sin paquete, igual
+# que al ejecutar `python src/interface.py`. Va delante de test/, que tiene
+# copias antiguas con los mismos nombres (database.py, encryption.py...).
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+import kdf  # noqa: E402
+from database import AuthManager, Database, migrate  # noqa: E402
+from encryption import KdfParams  # noqa: E402
+from services import Services  # noqa: E402
+
+# test/ también tiene un llm.py antiguo; pytest pone test/ delante de src/ al
+# importar cada módulo de prueba, así que se carga aquí el de src/
+import llm  # noqa: E402,F401
+
+# PBKDF2 barato: las pruebas comprueban la lógica, no el coste del KDF
+FAST_KDF = KdfParams(iterations=1000)
+PASSWORD = "Secreta123!"
+
+
+@pytest.fixture(autouse=True, scope="session")
+def src_first():
+    # pytest vuelve a poner test/ delante al importar los módulos de prueba; los
+    # procesos del pool de KDF (spawn) heredan sys.path y tienen que ver src/
+    if sys.path[0] != SRC:
+        sys.path.remove(SRC)
+        sys.path.insert(0, SRC)
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / "test.db"))
+    migrate(database)
+    yield database
+    database.close_all()
+
+
+@pytest.fixture
+def auth(db):
+    return AuthManager(db)
+
+
+@pytest.fixture
+def user_id(auth):
+    return auth.register_user("ana", PASSWORD, "ana@example.com", FAST_KDF)
+
+
+@pytest.fixture
+def services(db, monkeypatch):
+    """Capa de servicios sobre la base de datos de prueba, con el KDF barato como objetivo."""
+    monkeypatch.setattr(kdf, "KDF_PARAMS_OVERRIDE", FAST_KDF.to_json())
+    services = Services(db._db_name, kdf_workers=1)
+    yield services
+    services.shutdown()
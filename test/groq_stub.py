@@ -0,0 +1,91 @@
+"""
+Servidor local que imita el endpoint de chat de Groq para probar el análisis
+sin red ni API key:
+
+    python test/groq_stub.py 8089
+    GROQ_BASE_URL=http://127.0.0.1:8089 API_KEY=stub python src/interface.py
+
+Responde siempre el mismo análisis y cuenta las peticiones recibidas y el
+máximo de ellas atendidas a la vez (GET /stats), útil para comprobar la
+caché por forma de contraseña y el límite de concurrencia. RETRASO alarga
+cada respuesta.
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPUESTA = """- NIVEL DE SEGURIDAD: 7
+- ENTROPÍA POR FUERZA BRUTA: 78 bits
+- TIEMPO DE CRACKEO POR FUERZA BRUTA: 1000000 horas
+- BREVE EXPLICACION DE PORQUE NO ES SEGURA:"""
+
+peticiones = 0
+en_curso = 0
+max_en_curso = 0
+RETRASO = 0.0
+_lock = threading.Lock()
+
+
+def reset():
+    global peticiones, max_en_curso
+    with _lock:
+        peticiones = max_en_curso = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        global peticiones, en_curso, max_en_curso
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        with _lock:
+            peticiones += 1
+            en_curso += 1
+            max_en_curso = max(max_en_curso, en_curso)
+        try:
+            time.sleep(RETRASO)
+        finally:
+            with _lock:
+                en_curso -= 1
+        self._json({
+            "id": f"stub-{peticiones}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": RESPUESTA},
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._json({"requests": peticiones, "max_concurrent": max_en_curso})
+        else:
+            self.send_error(404)
+
+    def _json(self, data):
+        payload = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = 8089) -> ThreadingHTTPServer:
+    return ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8089
+    print(f"Groq stub escuchando en http://127.0.0.1:{port}")
+    serve(port).serve_forever()
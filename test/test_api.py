@@ -0,0 +1,149 @@
+import asyncio
+
+import httpx
+import pytest
+
+import api
+from conftest import PASSWORD
+from services import CachedVault
+
+
+@pytest.fixture
+def serve(services, user_id):
+    """Ejecuta escenario(cliente, puerto) contra un servidor en un puerto libre."""
+
+    def serve(scenario):
+        async def main():
+            server = await asyncio.start_server(api.ApiServer(services).handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server, httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+                return await scenario(client, port)
+
+        return asyncio.run(main())
+
+    return serve
+
+
+async def login(client: httpx.AsyncClient) -> dict:
+    r = await client.post("/v1/sessions", json={"username": "ana", "password": PASSWORD})
+    assert r.status_code == 201
+    return {"Authorization": "Bearer " + r.json()["token"]}
+
+
+def test_sessions_and_entry_routes(serve):
+    async def scenario(c, _):
+        assert (await c.post("/v1/sessions", json={"username": "ana", "password": "otra"})).status_code == 401
+        assert (await c.get("/v1/entries")).status_code == 401
+        h = await login(c)
+
+        r = await c.post("/v1/entries", json={"site": "github.com", "user": "ana"}, headers=h)
+        assert r.status_code == 201
+        entry = r.json()
+        assert entry["password"]
+
+        r = await c.get(f"/v1/entries/{entry['id']}", headers=h)
+        assert r.json() == entry
+        r = await c.get("/v1/entries/search", params={"q": "github"}, headers=h)
+        assert [e["id"] for e in r.json()["entries"]] == [entry["id"]]
+        r = await c.get("/v1/entries", headers=h)
+        assert r.json()["total"] == 1
+
+        assert (await c.delete(f"/v1/entries/{entry['id']}", headers=h)).status_code == 204
+        assert (await c.get(f"/v1/entries/{entry['id']}", headers=h)).status_code == 404
+        assert (await c.delete("/v1/sessions", headers=h)).status_code == 204
+        assert (await c.get("/v1/entries", headers=h)).status_code == 401
+
+    serve(scenario)
+
+
+def test_update_keeps_omitted_and_null_fields_and_rejects_empty(serve):
+    async def scenario(c, _):
+        h = await login(c)
+        r = await c.post("/v1/entries", json={"site": "github.com", "user": "ana", "password": "pw1"}, headers=h)
+        entry_id = r.json()["id"]
+
+        r = await c.put(f"/v1/entries/{entry_id}", json={"password": "pw2", "user": None}, headers=h)
+        assert r.status_code == 200
+        assert (r.json()["site"], r.json()["user"], r.json()["password"]) == ("github.com", "ana", "pw2")
+
+        # Lo mismo en una petición suelta y dentro de un lote
+        assert (await c.put(f"/v1/entries/{entry_id}", json={"site": ""}, headers=h)).status_code == 400
+        r = await c.post("/v1/entries/batch", json={"update": [{"id": entry_id, "site": ""}]}, headers=h)
+        assert r.status_code == 400
+        r = await c.get(f"/v1/entries/{entry_id}", headers=h)
+        assert r.json()["site"] == "github.com"
+
+    serve(scenario)
+
+
+def test_batch_is_all_or_nothing(serve, monkeypatch):
+    async def scenario(c, _):
+        h = await login(c)
+        r = await c.post("/v1/entries", json={"site": "github.com", "user": "ana", "password": "pw"}, headers=h)
+        entry_id = r.json()["id"]
+        adds = [{"site": f"s{n}.example", "user": "ana", "password": "pw"} for n in range(20)]
+
+        # Una actualización no válida rechaza el lote entero
+        r = await c.post(
+            "/v1/entries/batch", json={"add": adds, "update": [{"id": entry_id, "user": ""}]}, headers=h
+        )
+        assert r.status_code == 400
+        assert (await c.get("/v1/entries", headers=h)).json()["total"] == 1
+
+        # Un fallo a mitad de la transacción deshace lo ya escrito
+        def broken(*args, **kwargs):
+            raise RuntimeError("disco lleno")
+
+        with monkeypatch.context() as m:
+            m.setattr(CachedVault, "delete_many", broken)
+            r = await c.post(
+                "/v1/entries/batch",
+                json={"add": adds, "update": [{"id": entry_id, "site": "gitlab.com"}], "delete": [entry_id]},
+                headers=h,
+            )
+        assert r.status_code == 500
+        r = await c.get("/v1/entries", headers=h)
+        assert r.json()["total"] == 1
+        assert (await c.get(f"/v1/entries/{entry_id}", headers=h)).json()["site"] == "github.com"
+
+        r = await c.post("/v1/entries/batch", json={"add": adds, "delete": [entry_id, 9999]}, headers=h)
+        assert r.status_code == 200
+        assert (len(r.json()["added"]), r.json()["deleted"], r.json()["not_found"]) == (20, [entry_id], [9999])
+
+    serve(scenario)
+
+
+def test_stalled_request_gets_408(serve, monkeypatch):
+    monkeypatch.setattr(api, "REQUEST_TIMEOUT", 0.2)
+
+    async def scenario(_, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        # Línea de petición y una cabecera, y luego nada más
+        writer.write(b"GET /v1/health HTTP/1.1\r\nHost: x\r\n")
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return response
+
+    response = serve(scenario)
+    assert response.startswith(b"HTTP/1.1 408")
+    assert b"Connection: close" in response
+
+
+def test_out_of_range_ids_are_rejected(serve):
+    too_big = 2**63
+
+    async def scenario(c, _):
+        h = await login(c)
+        for method in ("GET", "PUT", "DELETE"):
+            r = await c.request(method, f"/v1/entries/{too_big}", json={"site": "x"}, headers=h)
+            assert r.status_code == 400
+        assert (await c.get(f"/v1/entries/{'9' * 5000}", headers=h)).status_code == 400
+        assert (await c.get("/v1/entries", params={"after": too_big}, headers=h)).status_code == 400
+        assert (await c.get("/v1/entries", params={"after": too_big - 1}, headers=h)).status_code == 200
+        r = await c.post("/v1/entries/batch", json={"update": [{"id": too_big, "site": "x"}]}, headers=h)
+        assert r.status_code == 400
+        r = await c.post("/v1/entries/batch", json={"delete": [too_big]}, headers=h)
+        assert r.status_code == 400
+
+    serve(scenario)
@@ -0,0 +1,122 @@
+import io
+import struct
+
+import pytest
+
+from backup import (
+    HEADER, KIND_VAULT, LENGTH, MAX_CHUNK, MAX_ITERATIONS, ArchiveReader, ArchiveWriter, BackupError,
+    backup_database, export_vault, restore_database, restore_vault,
+)
+from database import Database, VaultManager
+from encryption import EncryptionManager, generate_data_key
+
+PASSPHRASE = "frase de paso"
+
+
+def make_archive(records: int) -> bytes:
+    out = io.BytesIO()
+    writer = ArchiveWriter(out, PASSPHRASE, KIND_VAULT)
+    for n in range(records):
+        writer.write({"site": f"site{n}.example", "user": "ana", "password": "x" * 40})
+    writer.close()
+    return out.getvalue()
+
+
+def chunks(data: bytes):
+    """(cabecera, [bloque con su longitud, ...])."""
+    pos, parts = HEADER.size, []
+    while pos < len(data):
+        length = LENGTH.unpack_from(data, pos)[0]
+        parts.append(data[pos:pos + LENGTH.size + length])
+        pos += LENGTH.size + length
+    return data[:HEADER.size], parts
+
+
+def read_all(data: bytes, passphrase: str = PASSPHRASE):
+    return list(ArchiveReader(io.BytesIO(data), passphrase))
+
+
+def test_round_trip_over_several_chunks():
+    data = make_archive(3000)
+    assert len(chunks(data)[1]) > 2
+    records = read_all(data)
+    assert len(records) == 3000
+    assert records[-1]["site"] == "site2999.example"
+
+
+def test_wrong_passphrase():
+    with pytest.raises(BackupError):
+        read_all(make_archive(10), "otra")
+
+
+def test_missing_final_chunk_is_detected():
+    header, parts = chunks(make_archive(3000))
+    with pytest.raises(BackupError):
+        read_all(header + b"".join(parts[:-1]))
+
+
+def test_truncated_chunk_is_detected():
+    data = make_archive(3000)
+    with pytest.raises(BackupError, match="truncado"):
+        read_all(data[:-10])
+
+
+def test_reordered_chunks_are_detected():
+    header, parts = chunks(make_archive(3000))
+    parts[0], parts[1] = parts[1], parts[0]
+    with pytest.raises(BackupError):
+        read_all(header + b"".join(parts))
+
+
+def test_trailing_data_is_detected():
+    with pytest.raises(BackupError):
+        read_all(make_archive(10) + b"extra")
+
+
+def test_oversized_chunk_length_is_rejected_before_reading():
+    header, _ = chunks(make_archive(10))
+    with pytest.raises(BackupError, match="tamaño"):
+        read_all(header + struct.pack(">I", MAX_CHUNK + 17) + b"\0" * 32)
+
+
+def test_export_skips_unreadable_entries(db, user_id):
+    vault = VaultManager(db, EncryptionManager.from_key(generate_data_key()))
+    foreign = VaultManager(db, EncryptionManager.from_key(generate_data_key()))
+    vault.add(user_id, "github.com", "ana", "pw1")
+    foreign.add(user_id, "gitlab.com", "ana", "pw2")
+
+    out = io.BytesIO()
+    result = export_vault(vault, user_id, out, PASSPHRASE)
+    assert (result.exported, result.unreadable) == (1, 1)
+    assert [r["site"] for r in read_all(out.getvalue())] == ["github.com"]
+
+    db.execute("DELETE FROM vault;")
+    assert restore_vault(vault, user_id, io.BytesIO(out.getvalue()), PASSPHRASE) == 1
+    assert [e.site_password for e in vault.iter_entries(user_id)] == ["pw1"]
+
+
+@pytest.mark.parametrize("iterations", [0, 1, MAX_ITERATIONS + 1, 2**32 - 1])
+def test_iterations_outside_the_accepted_range_are_rejected(iterations):
+    data = bytearray(make_archive(1))
+    magic, kind, salt, _, prefix = HEADER.unpack_from(data)
+    HEADER.pack_into(data, 0, magic, kind, salt, iterations, prefix)
+    with pytest.raises(BackupError, match="iteraciones"):
+        read_all(bytes(data))
+
+
+def test_restored_database_does_not_reuse_deleted_ids(db, user_id, tmp_path):
+    vault = VaultManager(db, EncryptionManager.from_key(generate_data_key()))
+    entries = [vault.add(user_id, f"site{n}.example", "ana", "pw") for n in range(3)]
+    vault.delete(user_id, entries[-1].id)
+
+    out = io.BytesIO()
+    backup_database(db, out, PASSPHRASE)
+    path = str(tmp_path / "restored.db")
+    restore_database(io.BytesIO(out.getvalue()), path, PASSPHRASE)
+
+    restored = Database(path)
+    try:
+        again = VaultManager(restored, vault.engine).add(user_id, "new.example", "ana", "pw")
+        assert again.id > entries[-1].id
+    finally:
+        restored.close_all()
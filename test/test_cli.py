@@ -0,0 +1,65 @@
+import getpass
+
+import pytest
+
+import agent
+import cli
+from conftest import PASSWORD
+from encryption import DECRYPT_ERROR, EncryptionManager
+from rekey import VaultRekeyer
+
+pytestmark = pytest.mark.skipif(not agent.supported(), reason="el agente necesita sockets Unix y fork")
+
+
+@pytest.fixture
+def run(db, user_id, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(agent, "AGENT_SOCK", str(tmp_path / "agent.sock"))
+    prompts = []
+
+    def fake_getpass(prompt=""):
+        prompts.append(prompt)
+        return PASSWORD
+
+    monkeypatch.setattr(getpass, "getpass", fake_getpass)
+
+    def run(*argv):
+        capsys.readouterr()
+        code = cli.main(["--db", db._db_name, "-u", "ana", *argv])
+        out = capsys.readouterr().out
+        return code, out
+
+    run.prompts = prompts
+    yield run
+    agent.lock()
+
+
+def test_agent_skips_the_password_prompt(run):
+    assert run("unlock", "--ttl", "60")[0] == 0
+    assert len(run.prompts) == 1
+    code, out = run("add", "github.com", "ana")
+    assert code == 0
+    entry_id = int(out)
+    code, out = run("get", str(entry_id))
+    assert out.split("\t")[1] == "github.com"
+    assert len(run.prompts) == 1
+
+
+def test_stale_agent_key_is_not_used_after_rotation(run, db, user_id):
+    run("unlock", "--ttl", "60")
+    _, out = run("add", "github.com", "ana")
+    entry_id = int(out)
+
+    # Rotación de la clave de datos desde la web con el agente desbloqueado
+    _, _, old_key, _ = agent.get_key(db._db_name, "ana")
+    VaultRekeyer(db).rotate_data_key(user_id, EncryptionManager.from_key(old_key), PASSWORD)
+
+    # La CLI descarta la clave del agente y vuelve a pedir la contraseña
+    code, out = run("add", "gitlab.com", "ana")
+    assert code == 0
+    assert len(run.prompts) == 2
+    assert agent.get_key(db._db_name, "ana") is None
+
+    # Todo lo escrito sigue siendo legible con la clave vigente
+    code, out = run("list")
+    assert [line.split("\t")[1] for line in out.splitlines()] == ["github.com", "gitlab.com"]
+    assert DECRYPT_ERROR not in run("get", str(entry_id))[1]
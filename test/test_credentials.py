@@ -0,0 +1,93 @@
+import pytest
+
+from conftest import FAST_KDF, PASSWORD
+from encryption import EncryptionManager, KdfParams
+from kdf import _rewrap, verify_and_derive
+from rekey import VaultRekeyer
+
+
+def unlock(auth, password, username="ana"):
+    row = auth.get_credentials(username)
+    return row, verify_and_derive(password, row["password_hash"], row["salt"], row["wrapped_key"], row["kdf_params"])
+
+
+def test_kdf_upgrade_after_password_change_is_skipped(auth, user_id):
+    # Sesión A abre con la contraseña antigua; su actualización del KDF va en segundo plano
+    row, key = unlock(auth, PASSWORD)
+    upgraded = KdfParams(iterations=2000)
+    salt, wrapped = _rewrap(PASSWORD, key, upgraded)
+
+    # Mientras tanto, sesión B cambia la contraseña
+    assert auth.change_master_password(user_id, key, "Nueva456!", row["salt"], row["wrapped_key"], FAST_KDF)
+
+    # La actualización de A llega tarde y no debe pisar las credenciales nuevas
+    assert not auth.store_wrapped_key(user_id, salt, wrapped, upgraded, row["salt"], row["wrapped_key"])
+    _, new_key = unlock(auth, "Nueva456!")
+    assert new_key == key
+    assert unlock(auth, PASSWORD)[1] is None
+
+
+def test_kdf_upgrade_applies_when_credentials_are_unchanged(auth, user_id):
+    row, key = unlock(auth, PASSWORD)
+    upgraded = KdfParams(iterations=2000)
+    salt, wrapped = _rewrap(PASSWORD, key, upgraded)
+    assert auth.store_wrapped_key(user_id, salt, wrapped, upgraded, row["salt"], row["wrapped_key"])
+    row, again = unlock(auth, PASSWORD)
+    assert again == key
+    assert KdfParams.from_json(row["kdf_params"]) == upgraded
+
+
+def test_stale_password_change_is_rejected(auth, user_id):
+    row, key = unlock(auth, PASSWORD)
+    assert auth.change_master_password(user_id, key, "Primera1!", row["salt"], row["wrapped_key"], FAST_KDF)
+    assert not auth.change_master_password(user_id, key, "Segunda2!", row["salt"], row["wrapped_key"], FAST_KDF)
+    assert unlock(auth, "Primera1!")[1] == key
+
+
+def test_kdf_upgrade_after_data_key_rotation_is_skipped(db, auth, user_id):
+    row, key = unlock(auth, PASSWORD)
+    salt, wrapped = _rewrap(PASSWORD, key, KdfParams(iterations=2000))
+
+    new_key = VaultRekeyer(db).rotate_data_key(user_id, EncryptionManager.from_key(key), PASSWORD)
+    assert new_key != key
+
+    # Volver a envolver la clave antigua dejaría la bóveda ilegible
+    assert not auth.store_wrapped_key(user_id, salt, wrapped, KdfParams(iterations=2000), row["salt"], row["wrapped_key"])
+    assert unlock(auth, PASSWORD)[1] == new_key
+
+
+def test_credentials_are_frozen_while_rekey_is_pending(db, auth, user_id):
+    row, key = unlock(auth, PASSWORD)
+    VaultRekeyer(db).start(user_id, EncryptionManager.from_key(key), PASSWORD)
+    assert not auth.change_master_password(user_id, key, "Nueva456!", row["salt"], row["wrapped_key"], FAST_KDF)
+
+
+def test_rekey_finishes_only_once(db, auth, user_id):
+    _, key = unlock(auth, PASSWORD)
+    engine = EncryptionManager.from_key(key)
+    rekeyer = VaultRekeyer(db)
+    rekeyer.start(user_id, engine, PASSWORD)
+    job = db.execute("SELECT * FROM rekey_jobs WHERE user_id = ?;", (user_id,), fetchone=True)
+    new_key = rekeyer.run(user_id, engine)
+    assert rekeyer.run(user_id, engine) is None
+
+    # Un trabajo que ya no corresponde a las credenciales vigentes no las pisa
+    generation = db.execute("SELECT key_generation FROM credentials WHERE id = ?;", (user_id,), fetchone=True)[0]
+    db.execute(
+        "INSERT INTO rekey_jobs (user_id, target_generation, password_hash, salt, wrapped_key, credential_key) VALUES (?, ?, ?, ?, ?, ?);",
+        (user_id, job["target_generation"], job["password_hash"], job["salt"], job["wrapped_key"], job["credential_key"]),
+    )
+    with pytest.raises(RuntimeError):
+        rekeyer.run(user_id, engine)
+    assert db.execute("SELECT key_generation FROM credentials WHERE id = ?;", (user_id,), fetchone=True)[0] == generation
+    assert unlock(auth, PASSWORD)[1] == new_key
+
+
+def test_password_change_with_key_wrapped_elsewhere(auth, user_id):
+    # Como en la interfaz: la KEK nueva viene ya derivada del pool de KDF
+    row, key = unlock(auth, PASSWORD)
+    rewrapped = _rewrap("Nueva456!", key, FAST_KDF)
+    assert auth.change_master_password(user_id, key, "Nueva456!", row["salt"], row["wrapped_key"], FAST_KDF, rewrapped)
+    row, new_key = unlock(auth, "Nueva456!")
+    assert new_key == key
+    assert row["salt"] == rewrapped[0]
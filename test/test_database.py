@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+
+import pytest
+
+from database import Database
+
+THREADS = 8
+ROWS = 50
+
+
+@pytest.fixture
+def items(tmp_path):
+    db = Database(str(tmp_path / "pool.db"), timeout=30)
+    db.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, thread INTEGER NOT NULL, n INTEGER NOT NULL);")
+    yield db
+    db.close_all()
+
+
+def run_threads(target, count=THREADS):
+    errors = []
+
+    def wrapper(i):
+        try:
+            target(i)
+        except Exception as ex:  # se comprueba en el hilo principal
+            errors.append(ex)
+
+    threads = [threading.Thread(target=wrapper, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_each_thread_gets_its_own_configured_connection(items):
+    seen = {}
+
+    def check(i):
+        conn = items._conn
+        assert items._conn is conn
+        seen[i] = conn
+        assert conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA busy_timeout;").fetchone()[0] == 30000
+        assert conn.execute("PRAGMA foreign_keys;").fetchone()[0] == 1
+
+    run_threads(check)
+    assert len({id(c) for c in seen.values()}) == THREADS
+
+
+def test_concurrent_writers_and_readers(items):
+    counts = []
+
+    def work(i):
+        if i % 2:
+            for n in range(ROWS):
+                with items.transaction() as conn:
+                    conn.execute("INSERT INTO items (thread, n) VALUES (?, ?);", (i, n))
+        else:
+            last = 0
+            for _ in range(ROWS):
+                count = items.execute("SELECT COUNT(*) FROM items;", fetchone=True)[0]
+                assert count >= last  # cada lectura ve un estado confirmado
+                last = count
+            counts.append(last)
+
+    run_threads(work)
+    writers = THREADS // 2
+    assert items.execute("SELECT COUNT(*) FROM items;", fetchone=True)[0] == writers * ROWS
+    rows = items.execute("SELECT thread, COUNT(*) FROM items GROUP BY thread;", fetch=True)
+    assert {r[0]: r[1] for r in rows} == {i: ROWS for i in range(1, THREADS, 2)}
+
+
+def test_failed_transaction_is_rolled_back(items):
+    with pytest.raises(RuntimeError):
+        with items.transaction() as conn:
+            conn.execute("INSERT INTO items (thread, n) VALUES (0, 0);")
+            raise RuntimeError("fallo a mitad")
+    assert items.execute("SELECT COUNT(*) FROM items;", fetchone=True)[0] == 0
+
+
+def test_connections_of_finished_threads_are_closed(items):
+    run_threads(lambda i: items.execute("SELECT 1;"), count=4)
+    finished = [conn for thread, conn in items._conns.values() if not thread.is_alive()]
+    assert finished
+
+    # Al abrir una conexión nueva se cierran las de los hilos que ya terminaron
+    def connect(i):
+        items.execute("SELECT 1;")
+        assert all(thread.is_alive() for thread, _ in items._conns.values())
+
+    run_threads(connect, count=1)
+    for conn in finished:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1;")
+
+
+def test_memory_database_is_shared_between_threads():
+    db = Database(":memory:")
+    db.execute("CREATE TABLE items (n INTEGER);")
+    run_threads(lambda i: db.execute("INSERT INTO items (n) VALUES (?);", (i,)))
+    assert db.execute("SELECT COUNT(*) FROM items;", fetchone=True)[0] == THREADS
+    db.close_all()
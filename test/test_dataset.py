@@ -0,0 +1,88 @@
+import hashlib
+import threading
+
+import pytest
+
+import dataset
+from dataset import HASH_SIZE, DatasetIndex, build_index
+
+WORDS = ["123456", "password", "iloveyou", "princess", "123456", "ñandú", "  rockyou  ", "monkey"]
+
+
+@pytest.fixture
+def wordlist(tmp_path):
+    path = tmp_path / "words.txt"
+    path.write_bytes("\n".join(WORDS).encode("latin-1") + b"\n")
+    return str(path)
+
+
+@pytest.fixture
+def index(wordlist, tmp_path):
+    path = str(tmp_path / "words.idx")
+    assert build_index(wordlist, path) == len(set(w.strip() for w in WORDS))
+    index = DatasetIndex(path)
+    yield index
+    index.close()
+
+
+def test_rank_of_present_and_absent_passwords(index):
+    assert index.rank("123456") == 0
+    assert index.rank("password") == 1
+    assert index.rank("monkey") == 7
+    assert index.rank("ñandú") == 5
+    # Misma normalización que la búsqueda lineal: strip()
+    assert index.rank("rockyou") == 6
+    assert index.rank("Password") is None
+    assert index.rank("") is None
+    assert index.contains_many(["iloveyou", "nope", "princess"]) == [True, False, True]
+
+
+def test_build_leaves_no_temporary_files(index, tmp_path):
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["words.idx", "words.txt"]
+
+
+def test_colliding_hashes_keep_the_best_rank(wordlist, tmp_path, monkeypatch):
+    # Hash que solo mira la longitud: "123456" y "monkey" colisionan, y también
+    # "password", "iloveyou" y "princess"
+    def weak_hash(password: str) -> bytes:
+        return hashlib.blake2b(str(len(password)).encode(), digest_size=HASH_SIZE).digest()
+
+    monkeypatch.setattr(dataset, "password_hash", weak_hash)
+    path = str(tmp_path / "weak.idx")
+    build_index(wordlist, path)
+    index = DatasetIndex(path)
+    try:
+        assert index.rank("monkey") == 0
+        assert index.rank("princess") == 1
+        assert index.rank("abc") is None
+    finally:
+        index.close()
+
+
+def test_invalid_index_is_rejected(tmp_path):
+    path = tmp_path / "bad.idx"
+    path.write_bytes(b"\0" * dataset.DATA_OFFSET)
+    with pytest.raises(ValueError):
+        DatasetIndex(str(path))
+
+
+def test_shared_index_without_waiting_loads_in_background(index, monkeypatch):
+    monkeypatch.setattr(dataset, "_shared", None)
+    monkeypatch.setattr(dataset, "_shared_loaded", False)
+    monkeypatch.setattr(dataset, "_shared_loading", False)
+    release = threading.Event()
+    calls = []
+
+    def slow_open():
+        calls.append(1)
+        release.wait(5)
+        return index
+
+    monkeypatch.setattr(dataset, "open_index", slow_open)
+    assert dataset.shared_index(wait=False) is None
+    # Mientras se carga, las consultas sin espera no se bloquean ni lanzan otra carga
+    assert dataset.shared_index(wait=False) is None
+    release.set()
+    assert dataset.shared_index() is index
+    assert dataset.shared_index(wait=False) is index
+    assert calls == [1]
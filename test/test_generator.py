@@ -0,0 +1,94 @@
+import string
+from collections import Counter
+
+import pytest
+
+import encryption
+from encryption import (
+    LOOKALIKES, MAX_PASSWORD_LENGTH, SYMBOLS, PasswordPolicy, _RandomBuffer, _translation, generate_passwords,
+)
+
+
+def count_in(password: str, alphabet: str) -> int:
+    return sum(c in alphabet for c in password)
+
+
+@pytest.mark.parametrize("policy", [
+    PasswordPolicy(),
+    PasswordPolicy(length=8, lowercase=2, uppercase=2, digits=2, symbols=2),
+    PasswordPolicy(length=12, lowercase=0, uppercase=5, digits=None, symbols=None),
+    PasswordPolicy(length=20, symbols=4, symbol_set="-_.", exclude_lookalikes=True),
+])
+def test_every_password_meets_the_class_minimums(policy):
+    allowed = "".join(a for a, _ in policy.classes())
+    for password in generate_passwords(300, policy):
+        assert len(password) == policy.length
+        assert set(password) <= set(allowed)
+        for alphabet, minimum in policy.classes():
+            assert count_in(password, alphabet) >= minimum
+
+
+def test_excluded_classes_never_appear():
+    policy = PasswordPolicy(length=16, uppercase=None, symbols=None)
+    joined = "".join(generate_passwords(200, policy))
+    assert count_in(joined, string.ascii_uppercase + SYMBOLS) == 0
+
+
+def test_lookalikes_are_excluded():
+    policy = PasswordPolicy(length=64, exclude_lookalikes=True, symbol_set=SYMBOLS + "|")
+    joined = "".join(generate_passwords(200, policy))
+    assert not set(joined) & set(LOOKALIKES)
+    # Sin la opción aparecen (con 12800 caracteres, prácticamente seguro)
+    assert set("".join(generate_passwords(200, PasswordPolicy(length=64)))) & set(LOOKALIKES)
+
+
+@pytest.mark.parametrize("length", [1, 6, MAX_PASSWORD_LENGTH])
+def test_lengths_within_bounds(length):
+    policy = PasswordPolicy(length=length, lowercase=1, uppercase=0, digits=0, symbols=0)
+    assert [len(p) for p in generate_passwords(3, policy)] == [length] * 3
+
+
+@pytest.mark.parametrize("policy", [
+    PasswordPolicy(length=0, lowercase=0, uppercase=0, digits=0, symbols=0),
+    PasswordPolicy(length=MAX_PASSWORD_LENGTH + 1),
+    PasswordPolicy(length=5),  # mínimos 1 + 1 + 1 + 3 > 5
+    PasswordPolicy(lowercase=None, uppercase=None, digits=None, symbols=None),
+    PasswordPolicy(digits=None, symbols=2, symbol_set="|", exclude_lookalikes=True),
+])
+def test_impossible_policies_are_rejected(policy):
+    with pytest.raises(ValueError):
+        generate_passwords(1, policy)
+
+
+def test_passwords_are_distinct_and_count_is_respected():
+    assert generate_passwords(0) == []
+    passwords = generate_passwords(500)
+    assert len(set(passwords)) == 500
+
+
+def test_translation_table_has_no_modulo_bias():
+    for alphabet in (b"abc", string.ascii_letters.encode(), SYMBOLS.encode(), bytes(range(33, 127))):
+        table, rejected, limit = _translation(alphabet)
+        assert limit % len(alphabet) == 0
+        assert set(rejected) == set(range(limit, 256))
+        counts = Counter(table[:limit])
+        assert set(counts) == set(alphabet)
+        assert set(counts.values()) == {limit // len(alphabet)}
+
+
+def test_rejected_bytes_are_skipped(monkeypatch):
+    # Con 3 símbolos se aceptan los bytes < 255; el 255 se descarta
+    stream = iter([bytes([255, 0, 1, 255, 2, 3, 255, 4]) + bytes(4096)])
+    monkeypatch.setattr(encryption.os, "urandom", lambda n: next(stream)[:n].ljust(n, b"\0"))
+    assert _RandomBuffer(0).chars("abc", 5) == "abcab"
+
+
+def test_uniform_sampling_sanity():
+    rand = _RandomBuffer(0)
+    n = 60000
+    for counts, k in ((Counter(rand.chars("abcdefg", n)), 7), (Counter(rand.below(7, n)), 7)):
+        expected = n / k
+        chi2 = sum((c - expected) ** 2 / expected for c in counts.values())
+        assert len(counts) == k
+        # 6 grados de libertad: p < 1e-6 por encima de ~40
+        assert chi2 < 40
@@ -0,0 +1,41 @@
+import pytest
+
+from database import VaultManager
+from encryption import EncryptionManager, generate_data_key
+from importer import VaultImporter
+
+CSV = "name,url,username,password\n" + "".join(f"site{n},https://site{n}.example,ana,pw{n}\n" for n in range(25))
+DATA = CSV.encode("utf-8")
+
+
+@pytest.fixture
+def vault(db):
+    return VaultManager(db, EncryptionManager.from_key(generate_data_key()))
+
+
+def sites(vault, user_id):
+    return sorted(e.site_name for e in vault.iter_entries(user_id))
+
+
+def test_interrupted_import_resumes_where_it_stopped(vault, user_id):
+    def crash(state):
+        if state.rows_done == 10:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        VaultImporter(vault, batch_size=5).import_bytes(user_id, DATA, crash)
+    assert len(sites(vault, user_id)) == 10
+
+    state = VaultImporter(vault, batch_size=5).import_bytes(user_id, DATA)
+    assert (state.rows_done, state.imported) == (25, 15)
+    assert sites(vault, user_id) == sorted(f"site{n}" for n in range(25))
+
+
+def test_finished_import_can_be_repeated(vault, user_id, db):
+    assert VaultImporter(vault, batch_size=5).import_bytes(user_id, DATA).imported == 25
+    assert db.execute("SELECT COUNT(*) FROM import_jobs;", fetchone=True)[0] == 0
+
+    # El mismo fichero más tarde (p. ej. tras vaciar la bóveda) se importa entero
+    db.execute("DELETE FROM vault;")
+    assert VaultImporter(vault, batch_size=5).import_bytes(user_id, DATA).imported == 25
+    assert len(sites(vault, user_id)) == 25
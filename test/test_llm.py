@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import urllib.request
+
+import pytest
+
+import groq_stub
+import llm
+from conftest import SRC
+from llm import AiModel, TTLCache, password_shape
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Servidor de groq_stub en un puerto libre, con la caché y los clientes de AiModel vacíos."""
+    server = groq_stub.serve(0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    groq_stub.reset()
+    monkeypatch.setenv("API_KEY", "stub")
+    monkeypatch.setattr(llm, "GROQ_BASE_URL", url)
+    monkeypatch.setattr(AiModel, "_cache", TTLCache(16, 60))
+    for attr in ("_client", "_async_client", "_async_loop", "_semaphore"):
+        monkeypatch.setattr(AiModel, attr, None)
+
+    def stats():
+        with urllib.request.urlopen(url + "/stats") as r:
+            return json.loads(r.read())
+
+    yield stats
+    server.shutdown()
+    server.server_close()
+
+
+def test_groq_is_imported_only_when_a_client_is_created():
+    code = "import sys, llm; print('groq' in sys.modules); llm.AiModel()._sync_client(); print('groq' in sys.modules)"
+    env = {**os.environ, "PYTHONPATH": SRC, "API_KEY": "stub"}
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["False", "True"]
+
+
+def test_password_shape():
+    assert password_shape("Abc123!x") == "Aaa999#a"
+    assert password_shape("Xyz987?q") == password_shape("Abc123!x")
+
+
+def test_ttl_cache_expires_and_evicts_least_recent():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("1", None, "3")
+    expired = TTLCache(maxsize=2, ttl=0)
+    expired.put("a", "1")
+    assert expired.get("a") is None
+
+
+def test_same_shape_is_analysed_once(stub):
+    model = AiModel()
+    first = model.consultar_seguridad("Abc123!x")
+    assert groq_stub.RESPUESTA in first
+    # Misma forma: sale de la caché sin otra petición
+    assert model.consultar_seguridad("Xyz987?q") == first
+    assert asyncio.run(model.consultar_seguridad_async("Qwe456#r")) == first
+    assert stub()["requests"] == 1
+    model.consultar_seguridad("abc")
+    assert stub()["requests"] == 2
+
+
+def test_concurrent_requests_are_capped(stub, monkeypatch):
+    monkeypatch.setattr(llm, "GROQ_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(groq_stub, "RETRASO", 0.1)
+    model = AiModel()
+
+    async def main():
+        # Formas distintas para que ninguna salga de la caché
+        return await asyncio.gather(*[model.consultar_seguridad_async("a" * n) for n in range(1, 7)])
+
+    assert len(asyncio.run(main())) == 6
+    assert stub() == {"requests": 6, "max_concurrent": 2}
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from conftest import FAST_KDF, PASSWORD
+from database import VaultManager
+from encryption import EncryptionManager, derive_kek, generate_data_key, unwrap_key, wrap_key
+from rekey import VaultRekeyer
+from services import ServerBusy
+
+
+def login(services, password=PASSWORD, session_id="s1"):
+    return asyncio.run(services.login(session_id, "ana", password))
+
+
+def data_key(auth, password=PASSWORD):
+    row = auth.get_credentials("ana")
+    return unwrap_key(derive_kek(password, row["salt"], FAST_KDF), row["wrapped_key"])
+
+
+def test_wrap_and_unwrap():
+    kek, key = generate_data_key(), generate_data_key()
+    wrapped = wrap_key(kek, key)
+    assert unwrap_key(kek, wrapped) == key
+    with pytest.raises(InvalidTag):
+        unwrap_key(generate_data_key(), wrapped)
+
+
+def test_envelope_account_login(services, auth, user_id):
+    key = data_key(auth)
+    entry = VaultManager(services.db, EncryptionManager.from_key(key)).add(user_id, "github.com", "ana", "pw")
+
+    assert login(services, "Otra123456!") is None
+    assert login(services).id == user_id
+    assert services.vault("s1").get_entry(user_id, entry.id).site_password == "pw"
+
+
+def test_legacy_account_key_is_adopted_at_login(services, db, auth, user_id):
+    # Cuenta anterior al cifrado de sobre: sin clave envuelta, la clave de datos es la KEK
+    row = auth.get_credentials("ana")
+    kek = derive_kek(PASSWORD, row["salt"], FAST_KDF)
+    db.execute("UPDATE credentials SET wrapped_key = NULL WHERE id = ?;", (user_id,))
+    entry = VaultManager(db, EncryptionManager.from_key(kek)).add(user_id, "github.com", "ana", "pw")
+
+    assert login(services).id == user_id
+    wrapped = auth.get_credentials("ana")["wrapped_key"]
+    assert wrapped is not None
+    assert unwrap_key(kek, wrapped) == kek
+    # Otro proceso que también la adopte no la vuelve a escribir
+    assert auth.adopt_legacy_key(user_id, kek) is None
+
+    # El siguiente inicio de sesión ya va por la clave envuelta
+    assert login(services, session_id="s2").id == user_id
+    assert services.vault("s2").get_entry(user_id, entry.id).site_password == "pw"
+
+
+def test_changing_the_master_password_only_rewraps_the_data_key(db, auth, user_id):
+    key = data_key(auth)
+    vault = VaultManager(db, EncryptionManager.from_key(key))
+    entry = vault.add(user_id, "github.com", "ana", "pw")
+
+    row = auth.get_credentials("ana")
+    assert auth.change_master_password(user_id, key, "Nueva456!x", row["salt"], row["wrapped_key"], FAST_KDF)
+    assert auth.login("ana", PASSWORD) is None and auth.login("ana", "Nueva456!x") is not None
+    assert data_key(auth, "Nueva456!x") == key
+    assert vault.get_entry(user_id, entry.id).site_password == "pw"
+
+
+def test_pending_rekey_is_finished_at_login(services, db, auth, user_id):
+    old_key = data_key(auth)
+    old_engine = EncryptionManager.from_key(old_key)
+    entries = [VaultManager(db, old_engine).add(user_id, f"site{n}.example", "ana", f"pw{n}") for n in range(5)]
+    rekeyer = VaultRekeyer(db)
+    rekeyer.start(user_id, old_engine, PASSWORD)
+
+    assert login(services).id == user_id
+    assert not rekeyer.pending(user_id)
+    new_key = data_key(auth)
+    assert new_key != old_key
+    vault = services.vault("s1")
+    assert [vault.get_entry(user_id, e.id).site_password for e in entries] == [f"pw{n}" for n in range(5)]
+
+
+def test_concurrent_logins_cannot_exceed_the_session_limit(services, user_id):
+    services.max_sessions = 2
+
+    async def main():
+        return await asyncio.gather(
+            *[services.login(f"s{n}", "ana", PASSWORD) for n in range(4)], return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert sum(isinstance(r, ServerBusy) for r in results) == 2
+    assert len(services.keys) == 2
+    # Un inicio de sesión fallido no se queda con el hueco reservado
+    services.logout("s0")
+    services.logout("s1")
+    assert login(services, password="otra", session_id="s5") is None
+    assert login(services, session_id="s6").id == user_id
+    assert login(services, session_id="s7").id == user_id
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import threading
+import urllib.request
+from concurrent.futures import Future
+
+import bcrypt
+import pytest
+
+import metrics
+from conftest import FAST_KDF, PASSWORD
+from encryption import derive_kek, generate_data_key, wrap_key
+from kdf import KeyDerivationService, _measured, _unpack_measured, _verify_and_derive
+from metrics import Registry, timed
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    return registry
+
+
+def test_disabled_timed_returns_the_function_itself(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+
+    def fn():
+        return 1
+
+    assert timed("fn")(fn) is fn
+
+
+def test_sync_calls_and_errors_are_recorded(registry):
+    @timed("sync_op")
+    def op(fail=False):
+        if fail:
+            raise ValueError("fallo")
+        return 42
+
+    assert op() == 42
+    with pytest.raises(ValueError):
+        op(fail=True)
+    data = registry.snapshot()["sync_op"]
+    assert (data["count"], data["errors"], data["error_rate"]) == (2, 1, 0.5)
+    assert sum(data["buckets"].values()) == 2
+
+
+def test_async_calls_and_errors_are_recorded(registry):
+    @timed("async_op")
+    async def op(fail=False):
+        await asyncio.sleep(0.01)
+        if fail:
+            raise ValueError("fallo")
+        return 42
+
+    assert asyncio.run(op()) == 42
+    with pytest.raises(ValueError):
+        asyncio.run(op(fail=True))
+    data = registry.snapshot()["async_op"]
+    assert (data["count"], data["errors"]) == (2, 1)
+    assert data["sum_seconds"] >= 0.02
+    assert data["buckets"]["0.005"] == 0
+
+
+def test_prometheus_and_json_exporters(registry):
+    registry.observe("db_execute", 0.002)
+    registry.observe("db_execute", 0.3, error=True)
+    text = registry.render_prometheus()
+    assert "# TYPE olesa_db_execute_seconds histogram" in text
+    assert 'olesa_db_execute_seconds_bucket{le="0.005"} 1' in text
+    assert 'olesa_db_execute_seconds_bucket{le="+Inf"} 2' in text
+    assert "olesa_db_execute_seconds_count 2" in text
+    assert "olesa_db_execute_errors_total 1" in text
+
+    server = metrics.ThreadingHTTPServer(("127.0.0.1", 0), metrics._Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(base + "/metrics") as r:
+            assert r.read().decode() == text
+        with urllib.request.urlopen(base + "/metrics.json") as r:
+            assert json.loads(r.read())["db_execute"]["count"] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_worker_measurements_travel_with_the_result(registry):
+    @timed("worker_step")
+    def step(x):
+        return x * 2
+
+    result, records, error = _measured(step, 21)
+    assert (result, error) == (42, None)
+    assert [name for name, _, _ in records] == ["worker_step"]
+    # En el trabajador no se registran: las registra el proceso principal
+    assert registry.snapshot() == {}
+    metrics.replay(records)
+    assert registry.snapshot()["worker_step"]["count"] == 1
+
+
+def test_pooled_unlock_reports_bcrypt_and_kdf_timings(registry, monkeypatch):
+    # Los trabajadores (spawn) leen OLESA_METRICS al importar metrics
+    monkeypatch.setenv("OLESA_METRICS", "1")
+    salt = "c2FsdHNhbHRzYWx0c2FsdA=="
+    key = generate_data_key()
+    wrapped = wrap_key(derive_kek(PASSWORD, salt, FAST_KDF), key)
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode()
+
+    service = KeyDerivationService(1)
+    try:
+        assert service.unlock(PASSWORD, password_hash, salt, wrapped, FAST_KDF.to_json()).result() == key
+        assert service.unlock("otra", password_hash, salt, wrapped, FAST_KDF.to_json()).result() is None
+    finally:
+        service.shutdown()
+    snapshot = registry.snapshot()
+    assert snapshot["bcrypt_checkpw"]["count"] == 2
+    assert snapshot["kdf_derive_kek"]["count"] == 1
+
+
+def test_worker_errors_are_raised_in_the_caller(registry):
+    inner, outer = Future(), Future()
+    inner.set_result(_measured(_verify_and_derive, PASSWORD, "no es un hash", "c2FsdA=="))
+    _unpack_measured(inner, outer)
+    with pytest.raises(ValueError):
+        outer.result()
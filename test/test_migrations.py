@@ -0,0 +1,84 @@
+import base64
+import secrets
+import sqlite3
+
+import bcrypt
+import pytest
+
+from conftest import PASSWORD
+from database import SCHEMA_VERSION, Database, VaultManager, migrate, schema_version
+from encryption import LEGACY_KDF, EncryptionManager, derive_kek
+
+ENTRIES = [("github.com", "ana", "pw1"), ("gitlab.com", "ana@example.com", "pw2")]
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    """Base de datos como la creaba la versión original: cifrados en base64 dentro de columnas TEXT."""
+    path = str(tmp_path / "baseline.db")
+    salt = base64.b64encode(secrets.token_bytes(16)).decode("utf-8")
+    key = derive_kek(PASSWORD, salt, LEGACY_KDF)
+    aesgcm = EncryptionManager.from_key(key).aesgcm
+
+    def old_encrypt(text: str) -> str:
+        nonce = secrets.token_bytes(12)
+        return base64.b64encode(nonce + aesgcm.encrypt(nonce, text.encode(), None)).decode("utf-8")
+
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE credentials (
+            id             INTEGER PRIMARY KEY AUTOINCREMENT,
+            username       TEXT UNIQUE NOT NULL,
+            password_hash  TEXT NOT NULL,
+            salt           TEXT NOT NULL,
+            two_fa_contact TEXT NOT NULL
+        );
+        CREATE TABLE vault (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id       INTEGER NOT NULL,
+            site_name     TEXT NOT NULL,
+            site_user     TEXT NOT NULL,
+            site_password TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES credentials (id) ON DELETE CASCADE
+        );
+    """)
+    password_hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(4)).decode("utf-8")
+    conn.execute(
+        "INSERT INTO credentials (username, password_hash, salt, two_fa_contact) VALUES (?, ?, ?, ?);",
+        ("ana", password_hash, salt, "ana@example.com"),
+    )
+    conn.executemany(
+        "INSERT INTO vault (user_id, site_name, site_user, site_password) VALUES (1, ?, ?, ?);",
+        [tuple(old_encrypt(v) for v in entry) for entry in ENTRIES],
+    )
+    conn.commit()
+    conn.close()
+    db = Database(path)
+    yield db, key
+    db.close_all()
+
+
+def test_baseline_database_is_migrated(baseline):
+    db, key = baseline
+    assert schema_version(db) == 0
+    assert migrate(db) == SCHEMA_VERSION
+    assert schema_version(db) == SCHEMA_VERSION
+
+    kinds = db.execute("SELECT DISTINCT typeof(site_name), typeof(site_password) FROM vault;", fetch=True)
+    assert [tuple(k) for k in kinds] == [("blob", "blob")]
+    row = db.execute("SELECT wrapped_key, kdf_params, key_generation FROM credentials;", fetchone=True)
+    assert tuple(row) == (None, None, 0)
+
+    # Las entradas antiguas se siguen leyendo con la clave derivada de la contraseña
+    vault = VaultManager(db, EncryptionManager.from_key(key))
+    entries = [(e.site_name, e.site_user, e.site_password) for e in vault.iter_entries(1)]
+    assert entries == ENTRIES
+
+
+def test_migrate_is_idempotent_and_refuses_newer_schemas(baseline):
+    db, _ = baseline
+    migrate(db)
+    assert migrate(db) == 0
+    db.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1};")
+    with pytest.raises(RuntimeError):
+        migrate(db)
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from conftest import PASSWORD
+from database import StaleKeyError, VaultManager
+from encryption import EncryptionManager
+from kdf import verify_and_derive
+from rekey import VaultRekeyer
+
+
+def data_key(auth):
+    row = auth.get_credentials("ana")
+    return verify_and_derive(PASSWORD, row["password_hash"], row["salt"], row["wrapped_key"], row["kdf_params"])
+
+
+def test_rekey_resumes_after_a_crash(db, auth, user_id):
+    old_key = data_key(auth)
+    old_engine = EncryptionManager.from_key(old_key)
+    entries = [VaultManager(db, old_engine).add(user_id, f"site{n}.example", "ana", f"pw{n}") for n in range(23)]
+    rekeyer = VaultRekeyer(db, batch_size=5)
+    rekeyer.start(user_id, old_engine, PASSWORD)
+
+    def crash(state):
+        if state.done == 10:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        rekeyer.run(user_id, old_engine, crash)
+    # A medias: las credenciales siguen desenvolviendo la clave antigua
+    assert rekeyer.pending(user_id)
+    assert data_key(auth) == old_key
+    generations = db.execute("SELECT key_generation, COUNT(*) FROM vault GROUP BY key_generation;", fetch=True)
+    assert sorted(tuple(g) for g in generations) == [(0, 13), (1, 10)]
+
+    done = []
+    new_key = rekeyer.run(user_id, old_engine, lambda state: done.append(state.done))
+    assert done[0] == 15 and done[-1] == 23
+    assert not rekeyer.pending(user_id)
+    assert data_key(auth) == new_key
+
+    vault = VaultManager(db, EncryptionManager.from_key(new_key))
+    assert [vault.get_entry(user_id, e.id).site_password for e in entries] == [f"pw{n}" for n in range(23)]
+    assert [e.id for e in vault.search(user_id, "site7.example")] == [entries[7].id]
+
+
+def test_other_sessions_cannot_write_during_or_after_a_rekey(services, user_id):
+    asyncio.run(services.login("web", "ana", PASSWORD))
+    asyncio.run(services.login("api", "ana", PASSWORD))
+    for n in range(7):
+        services.vault("web").add(user_id, f"site{n}.example", "ana", f"pw{n}")
+    # La otra sesión ya tenía su bóveda (una petición en curso, p. ej.)
+    stale = services.vault("api")
+    attempts = []
+
+    def write_from_other_session(state):
+        # También tras el último lote, justo antes de activar la clave nueva
+        with pytest.raises(StaleKeyError):
+            stale.add(user_id, f"late{state.done}.example", "ana", "pw")
+        attempts.append(state.done)
+
+    services.rotate_data_key("web", PASSWORD, write_from_other_session)
+    assert attempts and attempts[-1] == 7
+    # La otra sesión se cerró al empezar, y su clave ya no vale para escribir
+    assert services.vault("api") is None
+    with pytest.raises(StaleKeyError):
+        stale.add(user_id, "after.example", "ana", "pw")
+    # (ni puede leer ya las entradas para actualizarlas)
+    assert stale.update(user_id, 1, password="otra") is None
+
+    vault = services.vault("web")
+    entries = list(vault.iter_entries(user_id))
+    assert [e.site_password for e in entries] == [f"pw{n}" for n in range(7)]
+    vault.add(user_id, "new.example", "ana", "pw")
+    assert vault.count_entries(user_id) == 8
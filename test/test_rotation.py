@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import rotation
+from conftest import PASSWORD
+from database import VaultManager
+from encryption import EncryptionManager, generate_data_key
+from kdf import verify_and_derive
+from rekey import VaultRekeyer
+from rotation import VaultRotator
+
+STRONG = "k7#Vq9!xTz2@pL4mWd8&"
+
+
+@pytest.fixture
+def vault(db, user_id, monkeypatch):
+    # Sin el índice de rockyou: la puntuación sale solo del estimador local
+    monkeypatch.setattr(rotation, "shared_index", lambda: None)
+    return VaultManager(db, EncryptionManager.from_key(generate_data_key()))
+
+
+def age(db, entry_id, days):
+    db.execute("UPDATE vault SET updated_at = ? WHERE id = ?;", (int(time.time()) - days * 86400, entry_id))
+
+
+def test_selection_by_age(db, vault, user_id):
+    old = vault.add(user_id, "old.example", "ana", STRONG)
+    recent = vault.add(user_id, "recent.example", "ana", STRONG)
+    age(db, old.id, 200)
+
+    state = VaultRotator(vault).rotate(user_id, updated_before=time.time() - 90 * 86400)
+    assert (state.total, state.scanned, state.rotated, state.skipped) == (1, 1, 1, 0)
+    assert vault.get_password(user_id, old.id) != STRONG
+    assert vault.get_password(user_id, recent.id) == STRONG
+
+
+def test_selection_by_score_keeps_the_previous_password(vault, user_id):
+    weak = vault.add(user_id, "weak.example", "ana", "123456")
+    strong = vault.add(user_id, "strong.example", "ana", STRONG)
+
+    state = VaultRotator(vault).rotate(user_id, max_score=2)
+    assert (state.scanned, state.rotated) == (2, 1)
+    rotated = vault.get_entry(user_id, weak.id)
+    assert (rotated.site_name, rotated.site_user) == ("weak.example", "ana")
+    assert len(rotated.site_password) == rotation.DEFAULT_POLICY.length
+    assert vault.get_previous_password(user_id, weak.id) == "123456"
+    assert vault.get_password(user_id, strong.id) == STRONG
+    assert vault.get_previous_password(user_id, strong.id) is None
+
+
+def test_batches_report_progress_and_skip_unreadable_entries(db, vault, user_id):
+    entries = [vault.add(user_id, f"site{n}.example", "ana", "123456") for n in range(7)]
+    db.execute("UPDATE vault SET record = X'00' WHERE id = ?;", (entries[3].id,))
+
+    reports = []
+    state = VaultRotator(vault, batch_size=3).rotate(
+        user_id, progress=lambda s: reports.append((s.scanned, s.rotated, s.skipped))
+    )
+    assert reports == [(3, 3, 0), (6, 5, 1), (7, 6, 1)]
+    assert (state.total, state.rotated, state.skipped) == (7, 6, 1)
+    assert vault.get_previous_password(user_id, entries[3].id) is None
+    assert not VaultRotator(vault).pending(user_id)
+
+
+def test_interrupted_rotation_resumes_with_its_stored_criteria(db, vault, user_id):
+    entries = [vault.add(user_id, f"site{n}.example", "ana", f"pw{n}") for n in range(5)]
+    rotator = VaultRotator(vault, batch_size=2)
+
+    def crash(state):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        rotator.rotate(user_id, progress=crash)
+    assert rotator.pending(user_id)
+    # Los criterios se fijaron al empezar: al reanudar se mantienen aunque se
+    # pidan otros, y lo añadido después no se rota
+    later = vault.add(user_id, "later.example", "ana", "123456")
+
+    state = VaultRotator(vault, batch_size=2).rotate(user_id, max_score=0)
+    assert (state.total, state.scanned, state.rotated) == (5, 5, 5)
+    assert not rotator.pending(user_id)
+    assert [vault.get_previous_password(user_id, e.id) for e in entries] == [f"pw{n}" for n in range(5)]
+    assert vault.get_password(user_id, later.id) == "123456"
+
+
+def test_previous_password_follows_a_data_key_rotation(db, auth, user_id, monkeypatch):
+    monkeypatch.setattr(rotation, "shared_index", lambda: None)
+    row = auth.get_credentials("ana")
+    key = verify_and_derive(PASSWORD, row["password_hash"], row["salt"], row["wrapped_key"], row["kdf_params"])
+    old_engine = EncryptionManager.from_key(key)
+    vault = VaultManager(db, old_engine)
+    entry = vault.add(user_id, "weak.example", "ana", "123456")
+    VaultRotator(vault).rotate(user_id, max_score=2)
+
+    new_key = VaultRekeyer(db).rotate_data_key(user_id, old_engine, PASSWORD)
+    assert VaultManager(db, EncryptionManager.from_key(new_key)).get_previous_password(user_id, entry.id) == "123456"
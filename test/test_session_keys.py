@@ -0,0 +1,24 @@
+from encryption import EncryptionManager, generate_data_key
+from kdf import SessionKeyCache
+
+
+def test_evicted_engine_keeps_working_for_in_flight_operations():
+    evicted = []
+    cache = SessionKeyCache(idle_timeout=60, on_evict=evicted.append)
+    key = generate_data_key()
+    engine = cache.put("s1", key)
+    token = engine.encrypt("secreto")
+
+    cache.evict("s1")
+    assert evicted == ["s1"]
+    assert cache.get("s1") is None
+    # Un hilo que ya tenía el gestor termina su operación con datos reales
+    assert engine.decrypt(token) == "secreto"
+    assert EncryptionManager.from_key(key).decrypt(token) == "secreto"
+
+
+def test_idle_sessions_expire():
+    cache = SessionKeyCache(idle_timeout=0)
+    cache.put("s1", generate_data_key())
+    cache.purge_expired()
+    assert len(cache) == 0
@@ -0,0 +1,46 @@
+import datetime
+
+import pytest
+
+from encryption import PasswordPolicy, generate_passwords
+from strength import MAX_LENGTH, estimate
+
+
+@pytest.mark.parametrize("password, pattern", [
+    ("password", "dictionary"),
+    ("P@ssw0rd", "dictionary"),
+    ("qwerty", "dictionary"),
+    ("zxcvbnm", "spatial"),
+    ("abcdef", "sequence"),
+    ("aaaaaaaa", "repeat"),
+    ("25/12/1990", "date"),
+])
+def test_common_patterns_are_weak(password, pattern):
+    result = estimate(password)
+    assert result.score <= 1
+    assert [m.pattern for m in result.sequence] == [pattern]
+    assert result.warning
+
+
+def test_random_passwords_are_strong():
+    for password in generate_passwords(5, PasswordPolicy(length=20)):
+        result = estimate(password)
+        assert result.score == 4
+        assert result.warning == ""
+
+
+@pytest.mark.parametrize("password", ["a" * 70, "x" * 200, "qwertyuiop" * 10, "Aa1!" * 40])
+def test_long_repetitions_are_not_strong(password):
+    assert len(password) > MAX_LENGTH
+    assert estimate(password).score < 4
+
+
+def test_long_random_password_is_strong():
+    password = generate_passwords(1, PasswordPolicy(length=3 * MAX_LENGTH))[0]
+    assert estimate(password).score == 4
+
+
+def test_recent_years_are_cheaper_than_old_ones():
+    this_year = str(datetime.date.today().year)
+    assert estimate(this_year).guesses < estimate("1950").guesses
+
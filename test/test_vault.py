@@ -0,0 +1,42 @@
+from conftest import FAST_KDF, PASSWORD
+from database import DECRYPT_ERROR, VaultManager
+from encryption import EncryptionManager, generate_data_key
+
+
+def test_index_missing_skips_unreadable_entries(db, user_id):
+    vault = VaultManager(db, EncryptionManager.from_key(generate_data_key()))
+    foreign = VaultManager(db, EncryptionManager.from_key(generate_data_key()))
+    readable = vault.add(user_id, "github.com", "ana", "pw")
+    unreadable = foreign.add(user_id, "gitlab.com", "ana", "pw")
+    db.execute("DELETE FROM vault_search;")
+
+    assert vault.index_missing(user_id) == 1
+    assert [e.id for e in vault.search(user_id, "github")] == [readable.id]
+    # El texto de error no acaba en el índice como si fuera el servicio
+    assert vault.search(user_id, DECRYPT_ERROR) == []
+    assert vault.search(user_id, "error") == []
+    indexed = {row[0] for row in db.execute("SELECT DISTINCT entry_id FROM vault_search;", fetch=True)}
+    assert unreadable.id not in indexed
+
+
+def test_sealed_records_are_bound_to_their_row_and_user(db, auth, user_id):
+    vault = VaultManager(db, EncryptionManager.from_key(generate_data_key()))
+    a = vault.add(user_id, "github.com", "ana", "pw1")
+    with db.transaction() as conn:
+        b, c = vault.add_many(conn, user_id, [("gitlab.com", "ana", "pw2"), ("x.org", "ana", "pw3")], workers=2)
+    assert [vault.get_password(user_id, i) for i in (b, c)] == ["pw2", "pw3"]
+
+    # Cabecera y registro de la fila a copiados en la fila b
+    db.execute(
+        """UPDATE vault SET header = (SELECT header FROM vault WHERE id = ?),
+           record = (SELECT record FROM vault WHERE id = ?) WHERE id = ?;""",
+        (a.id, a.id, b),
+    )
+    assert vault.get_password(user_id, b) == DECRYPT_ERROR
+    assert vault.list_page(user_id)[1].site_name == DECRYPT_ERROR
+
+    # La fila c pasada a otro usuario (aunque compartiera la clave)
+    other = auth.register_user("bea", PASSWORD, "bea@example.com", FAST_KDF)
+    db.execute("UPDATE vault SET user_id = ? WHERE id = ?;", (other, c))
+    assert vault.get_password(other, c) == DECRYPT_ERROR
+    assert vault.get_password(user_id, a.id) == "pw1"